@@ -11,9 +11,37 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import folium
+import folium.plugins
+from branca.element import MacroElement, Template
+from folium.utilities import JsCode
+import openpyxl
+from openpyxl.utils.exceptions import InvalidFileException
 from streamlit_folium import st_folium
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import hashlib
+import io
 import json
 import math
+import os
+import threading
+import time
+import tracemalloc
+import zipfile
+
+# Cálculos sem Streamlit (distâncias, riscos, IPE, seleção e cenários) ficam em nucleo.py, importável
+# pelos processos da varredura de cenários
+from nucleo import (
+    CAMERAS_POR_TIPO_PADRAO, EIXOS, LAT_REF_RECIFE, OTIMIZADORES, PARAMETROS_CENARIO, PRECO_CAMERA_PADRAO,
+    PROCESSOS_CENARIOS, RAIO_RISCO_PADRAO, RAIO_TERRA_M, TIPOS_CAMERA, associar_riscos, calcular_ipe_base,
+    chave_par, construir_grafo_vizinhanca, construir_indice_grade, construir_trilha_selecao,
+    consultar_indice_grade, coordenadas_validas, custo_por_ponto, distancia_metros_vetor, executar_cenarios,
+    grade_cenarios, interpretar_faixa, latitude_referencia, melhorar_selecao, milp, normalizar_logradouro,
+    otimizar_selecao, pontos_regra_50_30_20, prazo_cenario, projetar_metros, quantitativo_por_tipo,
+    resolver_exato, sugerir_tipo_camera, tabela_selecionados, verificar_riscos,
+)
 
 # ============================================================
 # CONFIGURAÇÃO DA PÁGINA
@@ -304,6 +332,15 @@ RUAS_SINISTROS_ALVO = [
     "RUA SANTOS ARAUJO", "RUA FONSECA OLIVEIRA"
 ]
 
+# Modelos de custo do painel (constantes de eixos, tipos de câmera e preços em nucleo.py)
+MODELOS_CUSTO = {'regra': "Regra 50-30-20 (estimativa)", 'tipo': "Pelo tipo de camera do ponto"}
+# Eixos de risco (por cruzamento, a partir das camadas de alagamentos e sinistros)
+EIXOS_RISCO = ['alag', 'sin']
+EIXOS_EQUIPAMENTO = ['seg', 'lct', 'com']
+RAIO_EQUIPAMENTOS_PADRAO = 200
+ROTULOS_EIXOS_EXTRA = {'alag': "Alagamento", 'sin': "Sinistros",
+                       'eq_seg': "Equip. SEG", 'eq_lct': "Equip. LCT", 'eq_com': "Equip. COM"}
+
 # ============================================================
 # INICIALIZAÇÃO DO SESSION STATE
 # ============================================================
@@ -317,146 +354,779 @@ if 'equipamentos' not in st.session_state:
     st.session_state.equipamentos = pd.DataFrame()
 if 'bairros_geojson' not in st.session_state:
     st.session_state.bairros_geojson = None
-if 'ultimo_selecionados' not in st.session_state:
-    st.session_state.ultimo_selecionados = pd.DataFrame()
+# Seleção atual: posições (int32) em cruzamentos_calculados, não uma cópia das linhas
+if 'selecao' not in st.session_state:
+    st.session_state.selecao = np.zeros(0, dtype=np.int32)
+if 'dataset_id' not in st.session_state:
+    st.session_state.dataset_id = None
+if 'chave_ipe' not in st.session_state:
+    st.session_state.chave_ipe = None
+if 'equipamentos_id' not in st.session_state:
+    st.session_state.equipamentos_id = None
+if 'etapas_memo' not in st.session_state:
+    st.session_state.etapas_memo = {}
+# Camadas de risco carregadas (None: listas padrão do código)
+if 'camada_alagamentos' not in st.session_state:
+    st.session_state.camada_alagamentos = None
+    st.session_state.camada_alagamentos_id = 'padrao_alagamentos'
+if 'camada_sinistros' not in st.session_state:
+    st.session_state.camada_sinistros = None
+    st.session_state.camada_sinistros_id = 'padrao_sinistros'
+# Última varredura de cenários: {'chave': parâmetros fixos usados, 'tabela': DataFrame}
+if 'cenarios' not in st.session_state:
+    st.session_state.cenarios = None
 
 # ============================================================
-# FUNÇÕES AUXILIARES
+# CACHE DE CARREGAMENTO (SHA-256 do arquivo -> dados processados)
+# ============================================================
+CACHE_DIR = Path(os.environ.get("COP_CACHE_DIR", Path(__file__).resolve().parent / ".cache_cop"))
+CACHE_MAX_ITENS = 8
+CACHE_VERSAO = 6  # Incrementar quando o formato dos dados carregados mudar
+
+
+class CacheLRU:
+    """Cache em memória com despejo LRU, compartilhado entre sessões (thread-safe)"""
+
+    def __init__(self, max_itens: int):
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        with self._lock:
+            if chave not in self._itens:
+                return None
+            self._itens.move_to_end(chave)
+            return self._itens[chave]
+
+    def guardar(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.max_itens:
+                self._itens.popitem(last=False)
+
+
+@st.cache_resource
+def obter_cache(nome: str, max_itens: int = CACHE_MAX_ITENS) -> CacheLRU:
+    """Retorna o cache LRU do processo identificado por nome (sobrevive aos reruns)"""
+    return CacheLRU(max_itens)
+
+
+def hash_arquivo(file) -> str:
+    """SHA-256 do conteúdo do arquivo enviado (UploadedFile, BytesIO ou caminho)"""
+    if hasattr(file, 'getvalue'):
+        conteudo = file.getvalue()
+    else:
+        conteudo = Path(file).read_bytes()
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def _ler_cache_disco(pasta: Path):
+    """Lê o sidecar em disco (parquet para DataFrames, JSON para o restante)"""
+    meta_path = pasta / "meta.json"
+    if not meta_path.exists():
+        return None
+    try:
+        meta = json.loads(meta_path.read_text(encoding='utf-8'))
+        itens = []
+        for i, tipo in enumerate(meta['tipos']):
+            if tipo == 'parquet':
+                itens.append(pd.read_parquet(pasta / f"{i}.parquet"))
+            else:
+                itens.append(json.loads((pasta / f"{i}.json").read_text(encoding='utf-8')))
+        return tuple(itens) + (meta['msg'],)
+    except Exception:
+        return None
+
+
+def _gravar_cache_disco(pasta: Path, resultado: tuple):
+    """Persiste o resultado do carregador; falhas (sem pyarrow, disco somente leitura) são ignoradas"""
+    try:
+        pasta.mkdir(parents=True, exist_ok=True)
+        tipos = []
+        for i, item in enumerate(resultado[:-1]):
+            if isinstance(item, pd.DataFrame):
+                item.to_parquet(pasta / f"{i}.parquet", index=False)
+                tipos.append('parquet')
+            else:
+                (pasta / f"{i}.json").write_text(json.dumps(item), encoding='utf-8')
+                tipos.append('json')
+        # meta.json por último: sua presença indica sidecar completo
+        (pasta / "meta.json").write_text(json.dumps({'tipos': tipos, 'msg': resultado[-1]}), encoding='utf-8')
+    except Exception:
+        pass
+
+
+def carregar_com_cache(file, tipo: str, carregador, digest: str = None) -> tuple:
+    """
+    Executa o carregador com cache pelo SHA-256 do conteúdo do arquivo.
+    
+    Ordem de busca: memória (LRU) -> sidecar em disco -> carregador.
+    O carregador deve retornar uma tupla (dados..., mensagem), com o primeiro item None em caso de erro;
+    resultados com erro não são armazenados.
+    """
+    digest = digest or hash_arquivo(file)
+    chave = f"{tipo}_v{CACHE_VERSAO}_{digest}"
+    cache = obter_cache('carregamento')
+    
+    resultado = cache.obter(chave)
+    if resultado is not None:
+        return resultado
+    
+    pasta = CACHE_DIR / chave
+    resultado = _ler_cache_disco(pasta)
+    if resultado is None:
+        resultado = carregador(file)
+        if resultado[0] is None:
+            return resultado
+        _gravar_cache_disco(pasta, resultado)
+    
+    cache.guardar(chave, resultado)
+    return resultado
+
+
+def etapa_memorizada(nome: str, dependencias: tuple, calcular):
+    """
+    Executa `calcular()` só quando as dependências declaradas mudam; senão devolve o último resultado.
+    
+    Guarda um resultado por etapa na sessão: cada rerun reaproveita as etapas cujas entradas não mudaram.
+    """
+    memo = st.session_state.etapas_memo
+    anterior = memo.get(nome)
+    if anterior is not None and anterior[0] == dependencias:
+        return anterior[1]
+    resultado = calcular()
+    memo[nome] = (dependencias, resultado)
+    return resultado
+
+
+# ============================================================
+# INSTRUMENTAÇÃO - TEMPO, LINHAS E PICO DE MEMÓRIA POR ETAPA
+# ============================================================
+PERFIL_LOG = Path(os.environ.get("COP_PERFIL_LOG", Path(__file__).resolve().parent / "cop_perfil.jsonl"))
+
+# Etapas medidas no rerun atual (o script é reexecutado a cada interação, zerando a lista)
+ETAPAS_RERUN = []
+PERFIL_ATIVO = st.session_state.get('perfil_ativo', False)
+# tracemalloc é global do processo: liga com o servidor (COP_PERFIL_MEMORIA=1) e nenhuma sessão o desliga
+PERFIL_MEMORIA = os.environ.get("COP_PERFIL_MEMORIA") == "1"
+
+if PERFIL_MEMORIA and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+@st.cache_resource
+def obter_estado_memoria() -> dict:
+    """Etapas em andamento no processo (todas as sessões), para não misturar picos de memória"""
+    return {'trava': threading.Lock(), 'ativas': 0, 'iniciadas': 0}
+
+
+@contextmanager
+def medir_etapa(nome: str, linhas: int = None):
+    """
+    Mede tempo de parede e pico de memória (tracemalloc, com COP_PERFIL_MEMORIA) de uma etapa.
+    
+    O pico é único no processo: só é zerado por uma etapa que começa sozinha e só é registrado se
+    nenhuma outra etapa (de qualquer sessão) começou até o fim desta.
+    O registro é entregue ao bloco, que pode preencher registro['linhas'] ao final.
+    """
+    registro = {'etapa': nome, 'linhas': linhas}
+    estado = obter_estado_memoria() if tracemalloc.is_tracing() else None
+    if estado is not None:
+        with estado['trava']:
+            sozinha = estado['ativas'] == 0
+            estado['ativas'] += 1
+            estado['iniciadas'] += 1
+            marca = estado['iniciadas']
+            if sozinha:
+                tracemalloc.reset_peak()
+                memoria_inicial = tracemalloc.get_traced_memory()[0]
+    inicio = time.perf_counter()
+    try:
+        yield registro
+    finally:
+        registro['tempo_ms'] = round((time.perf_counter() - inicio) * 1000, 2)
+        if estado is not None:
+            with estado['trava']:
+                estado['ativas'] -= 1
+                if sozinha and estado['iniciadas'] == marca and tracemalloc.is_tracing():
+                    registro['pico_mb'] = round((tracemalloc.get_traced_memory()[1] - memoria_inicial) / 1e6, 2)
+        ETAPAS_RERUN.append(registro)
+
+
+def registrar_perfil_rerun(parametros: dict, parametros_anteriores: dict):
+    """Acrescenta uma linha JSON com as etapas do rerun e os parâmetros alterados em PERFIL_LOG"""
+    alterados = sorted(k for k, v in parametros.items() if parametros_anteriores.get(k) != v)
+    linha = {
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'dataset_id': st.session_state.get('dataset_id'),
+        'parametros': parametros,
+        'alterados': alterados,
+        'total_ms': round(sum(e['tempo_ms'] for e in ETAPAS_RERUN), 2),
+        'etapas': ETAPAS_RERUN
+    }
+    try:
+        with open(PERFIL_LOG, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(linha, ensure_ascii=False, default=str) + "\n")
+    except OSError:
+        pass
+
+
+# ============================================================
+# FRONTEIRAS DE BAIRROS - SIMPLIFICAÇÃO COM TOPOLOGIA PRESERVADA
 # ============================================================
+QUANTIZACAO_BAIRROS = 1e-5   # graus (~1,1 m): grade das coordenadas enviadas ao navegador
+ZOOMS_BAIRROS = (11, 13, 15)
+ZOOM_BAIRROS_PADRAO = 13
+
+
+def metros_por_pixel(zoom: int, lat: float = LAT_REF_RECIFE) -> float:
+    """Resolução dos tiles Web Mercator (256 px) no zoom e latitude dados"""
+    return 2 * math.pi * RAIO_TERRA_M * math.cos(math.radians(lat)) / (256 * 2 ** zoom)
+
+
+def _importancia_douglas_peucker(x: np.ndarray, y: np.ndarray) -> np.ndarray:
+    """
+    Tolerância máxima (m) em que cada vértice sobrevive ao Douglas-Peucker do arco.
+    
+    Um único passe serve a todos os zooms: o vértice fica no nível de tolerância t se importancia > t.
+    A importância de um vértice é limitada pela do vértice que o separou, o que mantém os níveis aninhados.
+    """
+    n = len(x)
+    importancia = np.zeros(n)
+    importancia[0] = importancia[-1] = np.inf
+    pilha = [(0, n - 1, np.inf)]
+    while pilha:
+        i, j, limite = pilha.pop()
+        if j <= i + 1:
+            continue
+        dx, dy = x[j] - x[i], y[j] - y[i]
+        px, py = x[i + 1:j] - x[i], y[i + 1:j] - y[i]
+        comprimento = math.hypot(dx, dy)
+        if comprimento > 0:
+            dist = np.abs(dy * px - dx * py) / comprimento
+        else:
+            dist = np.hypot(px, py)
+        k = int(np.argmax(dist))
+        valor = min(float(dist[k]), limite)
+        k += i + 1
+        importancia[k] = valor
+        pilha.append((i, k, valor))
+        pilha.append((k, j, valor))
+    return importancia
+
 
-def distancia_metros(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-    """Calcula distância geodésica em metros usando fórmula de Haversine"""
-    R = 6371000
-    to_rad = math.pi / 180
-    d_lat = (lat2 - lat1) * to_rad
-    d_lon = (lon2 - lon1) * to_rad
-    a = (math.sin(d_lat / 2) ** 2 +
-         math.cos(lat1 * to_rad) * math.cos(lat2 * to_rad) *
-         math.sin(d_lon / 2) ** 2)
-    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-    return R * c
-
-
-def sugerir_tipo_camera(seg_tot: float, lct_tot: float, com_tot: float, mob_tot: float) -> str:
-    """Sugere tipo de câmera baseado nos eixos predominantes"""
-    candidatos = [("PTZ", seg_tot), ("360", lct_tot), ("FIXA", com_tot), ("LPR", mob_tot)]
-    candidatos.sort(key=lambda x: x[1], reverse=True)
-    return candidatos[0][0] if candidatos[0][1] > 0 else "FIXA"
-
-
-def verificar_alagamentos(df_selecionados: pd.DataFrame) -> list:
-    """Verifica quais cruzamentos selecionados são pontos de alagamento"""
-    alagamentos_encontrados = []
-    if df_selecionados.empty:
-        return alagamentos_encontrados
-    
-    lista_alvo_norm = [x.strip().upper() for x in ALAGAMENTOS_ALVO]
-    for _, row in df_selecionados.iterrows():
-        l1 = str(row['log1']).strip().upper()
-        l2 = str(row['log2']).strip().upper()
-        comb1 = f"{l1} / {l2}"
-        comb2 = f"{l2} / {l1}"
-        if comb1 in lista_alvo_norm:
-            alagamentos_encontrados.append(comb1)
-        elif comb2 in lista_alvo_norm:
-            alagamentos_encontrados.append(comb2)
-    
-    return alagamentos_encontrados
-
-
-def verificar_sinistros(df_selecionados: pd.DataFrame) -> list:
-    """Verifica quais ruas dos cruzamentos selecionados têm histórico de sinistros"""
-    sinistros_encontrados = []
-    if df_selecionados.empty:
-        return sinistros_encontrados
-    
-    lista_sinistros_norm = set([x.strip().upper() for x in RUAS_SINISTROS_ALVO])
-    ruas_unicas_encontradas = set()
-    
-    for _, row in df_selecionados.iterrows():
-        l1 = str(row['log1']).strip().upper()
-        l2 = str(row['log2']).strip().upper()
+def _aneis_do_geojson(geojson: dict) -> tuple:
+    """Separa as feições em (feicoes, aneis): cada polígono passa a referenciar índices em `aneis`"""
+    if geojson.get('type') == 'FeatureCollection':
+        feicoes_orig = geojson.get('features') or []
+    elif geojson.get('type') == 'Feature':
+        feicoes_orig = [geojson]
+    else:
+        feicoes_orig = [{'type': 'Feature', 'geometry': geojson}]
+    
+    aneis, feicoes = [], []
+    for feicao in feicoes_orig:
+        geometria = feicao.get('geometry') or {}
+        tipo = geometria.get('type')
+        if tipo == 'Polygon':
+            poligonos = [geometria['coordinates']]
+        elif tipo == 'MultiPolygon':
+            poligonos = geometria['coordinates']
+        else:
+            continue
+        estrutura = []
+        for poligono in poligonos:
+            estrutura.append(list(range(len(aneis), len(aneis) + len(poligono))))
+            aneis.extend(np.asarray(anel, dtype=float)[:, :2] for anel in poligono)
+        feicoes.append((tipo, estrutura))
+    return feicoes, aneis
+
+
+def preparar_bairros(geojson: dict, zooms=ZOOMS_BAIRROS, quantizacao: float = QUANTIZACAO_BAIRROS) -> dict:
+    """
+    Simplifica as fronteiras uma única vez, em um nível por zoom, e serializa cada nível.
+    
+    As coordenadas são quantizadas em uma grade de `quantizacao` graus; vértices compartilhados
+    passam a coincidir exatamente. Cada anel é cortado em arcos nas junções (vértices onde muda o
+    conjunto de anéis que passam por eles), e cada arco é simplificado em sentido canônico: a
+    fronteira comum a dois bairros sai idêntica nos dois, sem frestas nem sobreposições.
+    Tolerância de cada nível: meio pixel no zoom correspondente.
+    
+    Retorna {'niveis': {zoom: json}, 'vertices': {'original': n, zoom: n}} (chaves em str, como no sidecar).
+    """
+    feicoes, aneis = _aneis_do_geojson(geojson)
+    casas = max(0, round(-math.log10(quantizacao)))
+    
+    # Grade inteira, sem o ponto de fechamento e sem vértices repetidos em sequência
+    grades = []
+    for anel in aneis:
+        q = np.round(anel / quantizacao).astype(np.int64)
+        if len(q) > 1:
+            repetido = np.all(q == np.roll(q, 1, axis=0), axis=1)
+            q = q[~repetido] if not repetido.all() else q[:1]
+        grades.append(q)
+    
+    n_aneis = len(grades)
+    tamanhos = np.array([len(q) for q in grades], dtype=np.int64)
+    todos = np.concatenate(grades) if n_aneis else np.zeros((0, 2), dtype=np.int64)
+    chaves = (todos[:, 0] + 2 ** 31) * 2 ** 32 + (todos[:, 1] + 2 ** 31)
+    _, id_vertice = np.unique(chaves, return_inverse=True)
+    anel_do_vertice = np.repeat(np.arange(n_aneis, dtype=np.int64), tamanhos)
+    
+    # Assinatura do conjunto de anéis que passam por cada vértice (xor de hashes aleatórios fixos)
+    hash_anel = np.random.default_rng(0).integers(1, 2 ** 62, n_aneis, dtype=np.int64)
+    pares = np.unique(id_vertice * max(n_aneis, 1) + anel_do_vertice)
+    vert_par = pares // max(n_aneis, 1)
+    assinatura = np.zeros(int(id_vertice.max()) + 1 if len(id_vertice) else 0, dtype=np.int64)
+    if len(pares):
+        inicios = np.flatnonzero(np.r_[True, np.diff(vert_par) != 0])
+        assinatura[vert_par[inicios]] = np.bitwise_xor.reduceat(hash_anel[pares % max(n_aneis, 1)], inicios)
+    
+    lonlat = todos * quantizacao
+    x_todos, y_todos = projetar_metros(lonlat[:, 1], lonlat[:, 0], latitude_referencia(lonlat[:, 1], lonlat[:, 0])) \
+        if len(todos) else (np.zeros(0), np.zeros(0))
+    
+    importancias = []
+    deslocamento = 0
+    for q in grades:
+        n = len(q)
+        fatia = slice(deslocamento, deslocamento + n)
+        deslocamento += n
+        if n < 4:
+            importancias.append(np.full(n, np.inf))
+            continue
+        chave, x, y = chaves[fatia], x_todos[fatia], y_todos[fatia]
+        sig = assinatura[id_vertice[fatia]]
+        fixos = np.flatnonzero((sig != np.roll(sig, 1)) | (sig != np.roll(sig, -1)))
+        if len(fixos) < 2:
+            # Anel sem junções: âncoras escolhidas só pela geometria, iguais em qualquer anel que o repita
+            a = int(np.argmin(chave))
+            b = int(np.argmax(np.hypot(x - x[a], y - y[a])))
+            fixos = np.array(sorted({a, b}))
         
-        if l1 in lista_sinistros_norm:
-            ruas_unicas_encontradas.add(l1)
-        if l2 in lista_sinistros_norm:
-            ruas_unicas_encontradas.add(l2)
+        importancia = np.zeros(n)
+        importancia[fixos] = np.inf
+        for inicio, fim in zip(fixos, np.r_[fixos[1:], fixos[0] + n]):
+            idx = np.arange(inicio, fim + 1) % n
+            if len(idx) <= 2:
+                continue
+            invertido = chave[idx[0]] > chave[idx[-1]] or (
+                chave[idx[0]] == chave[idx[-1]] and chave[idx[1]] > chave[idx[-2]])
+            if invertido:
+                idx = idx[::-1]
+            importancia[idx[1:-1]] = _importancia_douglas_peucker(x[idx], y[idx])[1:-1]
+        importancias.append(importancia)
+    
+    niveis, vertices = {}, {'original': int(sum(len(a) for a in aneis))}
+    for zoom in zooms:
+        tolerancia = 0.5 * metros_por_pixel(zoom)
+        coords_aneis = []
+        for q, importancia in zip(grades, importancias):
+            manter = importancia > tolerancia
+            if manter.sum() < 3:
+                manter = np.zeros(len(q), dtype=bool)
+                manter[np.argsort(-importancia, kind='stable')[:3]] = True
+            pontos = np.round(q[manter] * quantizacao, casas).tolist()
+            coords_aneis.append(pontos + pontos[:1])
+        
+        features = []
+        for tipo, estrutura in feicoes:
+            poligonos = [[coords_aneis[i] for i in poligono] for poligono in estrutura]
+            features.append({'type': 'Feature', 'properties': {}, 'geometry': {
+                'type': tipo, 'coordinates': poligonos[0] if tipo == 'Polygon' else poligonos}})
+        niveis[str(zoom)] = json.dumps({'type': 'FeatureCollection', 'features': features}, separators=(',', ':'))
+        vertices[str(zoom)] = int(sum(len(c) for c in coords_aneis))
     
-    return sorted(list(ruas_unicas_encontradas))
+    return {'niveis': niveis, 'vertices': vertices}
 
 
-def carregar_excel_cruzamentos(file) -> tuple:
-    """Carrega e processa o Excel de cruzamentos"""
+class CamadaFronteiras(MacroElement):
+    """Camada de contorno a partir do GeoJSON já serializado (sem reprocessar feições a cada rerun)"""
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        var {{ this.get_name() }} = L.geoJson({{ this.payload }}, {
+            style: {{ this.estilo|tojson }}, interactive: false
+        }).addTo({{ this._parent.get_name() }});
+        {% endmacro %}
+    """)
+    
+    def __init__(self, payload: str, estilo: dict):
+        super().__init__()
+        self._name = 'CamadaFronteiras'
+        self.payload = payload
+        self.estilo = estilo
+
+
+# ============================================================
+# FUNÇÕES AUXILIARES
+# ============================================================
+
+# Cabeçalhos aceitos nos arquivos de risco (já normalizados; basta o cabeçalho começar pelo termo)
+COLUNAS_RISCO = {
+    'nome': ('LOGRADOURO', 'LOCAL', 'ENDERECO', 'RUA', 'VIA', 'NOME', 'DESCRICAO'),
+    'lat': ('LATITUDE', 'LAT'),
+    'lon': ('LONGITUDE', 'LON', 'LNG'),
+    'quantidade': ('QUANTIDADE', 'QTD', 'OCORRENCIAS', 'EVENTOS', 'TOTAL', 'CONTAGEM'),
+    'data': ('DATA',),
+}
+
+
+def camada_risco_de_lista(nomes: list) -> pd.DataFrame:
+    """Camada de risco só com nomes (uma ocorrência por nome, sem coordenadas nem data)"""
+    nomes = [str(n).strip() for n in nomes]
+    return pd.DataFrame({
+        'nome': nomes, 'lat': np.nan, 'lon': np.nan, 'quantidade': 1.0, 'data': pd.NaT
+    }, index=pd.RangeIndex(len(nomes)))
+
+
+def _coluna_risco(df: pd.DataFrame, campo: str):
+    """Primeira coluna do arquivo cujo cabeçalho normalizado começa por um dos termos do campo"""
+    cabecalhos = {normalizar_logradouro(c): c for c in df.columns}
+    for termo in COLUNAS_RISCO[campo]:
+        for normalizado, original in cabecalhos.items():
+            if normalizado == termo or normalizado.startswith(termo + ' '):
+                return df[original]
+    return None
+
+
+def _numero(serie) -> pd.Series:
+    """Converte para float aceitando vírgula decimal"""
+    if serie is None:
+        return None
+    if serie.dtype.kind in 'if':
+        return serie.astype(float)
+    return pd.to_numeric(serie.astype(str).str.strip().str.replace(',', '.', regex=False), errors='coerce')
+
+
+def carregar_camada_risco(file) -> tuple:
+    """
+    Carrega uma camada de risco (Excel ou CSV).
+    
+    Aceita pontos (LATITUDE/LONGITUDE) e/ou nomes de logradouro ("RUA A" ou "RUA A / RUA B"),
+    com QUANTIDADE e DATA opcionais. Linhas com coordenadas válidas são associadas por distância;
+    as demais, pelo nome.
+    """
     try:
-        xls = pd.ExcelFile(file)
+        nome_arquivo = str(getattr(file, 'name', file)).lower()
+        if nome_arquivo.endswith('.csv'):
+            df = pd.read_csv(file, sep=None, engine='python', encoding='utf-8-sig')
+        else:
+            df = pd.read_excel(file, header=0)
         
-        if "MODELO" not in xls.sheet_names or "cruzamentos_100%" not in xls.sheet_names:
-            return None, None, "Abas 'MODELO' e 'cruzamentos_100%' não encontradas."
+        nome, lat, lon = _coluna_risco(df, 'nome'), _numero(_coluna_risco(df, 'lat')), _numero(_coluna_risco(df, 'lon'))
+        if nome is None and (lat is None or lon is None):
+            return None, "Arquivo sem coluna de logradouro nem de LATITUDE/LONGITUDE."
         
-        df_modelo = pd.read_excel(file, sheet_name="MODELO", header=None)
+        quantidade = _numero(_coluna_risco(df, 'quantidade'))
+        data = _coluna_risco(df, 'data')
+        camada = pd.DataFrame({
+            'nome': nome.fillna('').astype(str).str.strip() if nome is not None else '',
+            'lat': lat if lat is not None else np.nan,
+            'lon': lon if lon is not None else np.nan,
+            'quantidade': quantidade.fillna(1.0) if quantidade is not None else 1.0,
+            'data': pd.to_datetime(data, errors='coerce', dayfirst=True) if data is not None else pd.NaT,
+        })
+        com_ponto = coordenadas_validas(camada['lat'].to_numpy(), camada['lon'].to_numpy())
+        camada = camada[com_ponto | (camada['nome'] != '')].reset_index(drop=True)
+        n_pontos = int(coordenadas_validas(camada['lat'].to_numpy(), camada['lon'].to_numpy()).sum())
+        return camada, f"✓ {len(camada)} registros ({n_pontos} com coordenadas)"
+    except Exception as e:
+        return None, f"Erro: {str(e)}"
+
+
+def indexar_camada_risco(camada: pd.DataFrame) -> dict:
+    """
+    Índices de uma camada de risco, montados uma vez por camada.
+    
+    - por nome (linhas sem coordenadas): 'pares' (chave de par -> linha) para "RUA A / RUA B [/ ...]",
+      com todos os pares do registro, e 'ruas' (rua -> linha) para registros de uma única rua;
+    - espacial (linhas com coordenadas): posições 'pontos', projeção e latitude de referência.
+    """
+    lat, lon = camada['lat'].to_numpy(dtype=float), camada['lon'].to_numpy(dtype=float)
+    com_ponto = coordenadas_validas(lat, lon)
+    
+    pares, ruas = [], []
+    for linha in np.flatnonzero(~com_ponto):
+        partes = [normalizar_logradouro(p) for p in camada['nome'].iat[linha].split('/') if p.strip()]
+        if len(partes) == 1:
+            ruas.append((partes[0], linha))
+        for i in range(len(partes)):
+            for j in range(i + 1, len(partes)):
+                pares.append((chave_par(partes[i], partes[j]).item(), linha))
+    
+    pontos = np.flatnonzero(com_ponto)
+    lat_ref = latitude_referencia(lat[pontos], lon[pontos]) if len(pontos) else LAT_REF_RECIFE
+    x, y = projetar_metros(lat[pontos], lon[pontos], lat_ref)
+    coordenadas = camada['lat'].round(5).astype(str) + ', ' + camada['lon'].round(5).astype(str)
+    rotulos = camada['nome'].where(camada['nome'] != '', coordenadas)
+    return {
+        'camada': camada,
+        'rotulos': rotulos.to_numpy(dtype=object),
+        'pares': pd.DataFrame(pares, columns=['chave', 'linha']),
+        'ruas': pd.DataFrame(ruas, columns=['chave', 'linha']),
+        'pontos': pontos, 'x': x, 'y': y, 'lat_ref': lat_ref,
+    }
+
+
+def obter_indice_risco(camada_id: str, camada: pd.DataFrame) -> dict:
+    """Índice da camada em cache pelo id (digest do arquivo ou 'padrao_*')"""
+    cache = obter_cache('indices_risco')
+    indice = cache.obter(camada_id)
+    if indice is None:
+        indice = indexar_camada_risco(camada)
+        cache.guardar(camada_id, indice)
+    return indice
+
+
+CAMADA_ALAGAMENTOS_PADRAO = camada_risco_de_lista(list(dict.fromkeys(ALAGAMENTOS_ALVO)))
+CAMADA_SINISTROS_PADRAO = camada_risco_de_lista(
+    pd.Series(RUAS_SINISTROS_ALVO).str.strip().groupby([normalizar_logradouro(r) for r in RUAS_SINISTROS_ALVO],
+                                                       sort=False).first().tolist()
+)
+
+
+def verificar_alagamentos(df_selecionados: pd.DataFrame, indice: dict = None, raio: float = RAIO_RISCO_PADRAO) -> list:
+    """Pontos de alagamento (na ordem da camada) atingidos por algum cruzamento selecionado"""
+    indice = indice or obter_indice_risco('padrao_alagamentos', CAMADA_ALAGAMENTOS_PADRAO)
+    return verificar_riscos(df_selecionados, indice, raio)['rotulos']
+
+
+def verificar_sinistros(df_selecionados: pd.DataFrame, indice: dict = None, raio: float = RAIO_RISCO_PADRAO) -> list:
+    """Ruas/pontos com histórico de sinistros que aparecem nos cruzamentos selecionados (ordem alfabética)"""
+    indice = indice or obter_indice_risco('padrao_sinistros', CAMADA_SINISTROS_PADRAO)
+    return sorted(verificar_riscos(df_selecionados, indice, raio)['rotulos'])
+
+
+def indice_risco(camada_tipo: str) -> dict:
+    """Índice da camada de risco ativa (arquivo carregado ou lista padrão)"""
+    camada = st.session_state[f'camada_{camada_tipo}']
+    if camada is None:
+        camada = CAMADA_ALAGAMENTOS_PADRAO if camada_tipo == 'alagamentos' else CAMADA_SINISTROS_PADRAO
+    return obter_indice_risco(st.session_state[f'camada_{camada_tipo}_id'], camada)
+
+
+# Colunas efetivamente usadas de cada aba (posição na planilha -> nome)
+COLUNAS_MODELO = {1: 'cod_log', 2: 'nome', 3: 'seg', 4: 'lct', 5: 'com', 6: 'mob'}
+COLUNAS_CRUZAMENTOS = {0: 'cod1', 2: 'log1', 4: 'cod2', 6: 'log2', 11: 'lat', 12: 'lon'}
+
+
+def _linhas_para_df(linhas, colunas: dict) -> pd.DataFrame:
+    """Monta DataFrame apenas com as colunas de interesse a partir de linhas (tuplas) da planilha"""
+    dados = {nome: [] for nome in colunas.values()}
+    for linha in linhas:
+        n = len(linha)
+        for pos, nome in colunas.items():
+            dados[nome].append(linha[pos] if pos < n else None)
+    return pd.DataFrame(dados)
+
+
+def _ler_abas_openpyxl(file) -> tuple:
+    """Leitura em passada única (openpyxl read_only), sem materializar as abas inteiras"""
+    wb = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        if "MODELO" not in wb.sheetnames or "cruzamentos_100%" not in wb.sheetnames:
+            return None, None, "Abas 'MODELO' e 'cruzamentos_100%' não encontradas."
         
-        idx_header = None
-        for i, row in df_modelo.iterrows():
-            if row.iloc[0] == "RANKING_IPE":
-                idx_header = i
+        max_col_modelo = max(COLUNAS_MODELO) + 1
+        linhas_modelo = wb["MODELO"].iter_rows(max_col=max_col_modelo, values_only=True)
+        for linha in linhas_modelo:
+            if linha and linha[0] == "RANKING_IPE":
                 break
-        
-        if idx_header is None:
+        else:
             return None, None, "Cabeçalho da aba MODELO não identificado."
+        df_modelo = _linhas_para_df(linhas_modelo, COLUNAS_MODELO)
         
-        df_logs = df_modelo.iloc[idx_header + 1:].copy()
-        df_logs.columns = df_modelo.iloc[idx_header].values
-        df_logs = df_logs.dropna(subset=[df_logs.columns[1]])
+        max_col_cruz = max(COLUNAS_CRUZAMENTOS) + 1
+        linhas_cruz = wb["cruzamentos_100%"].iter_rows(min_row=2, max_col=max_col_cruz, values_only=True)
+        df_cruz = _linhas_para_df(linhas_cruz, COLUNAS_CRUZAMENTOS)
+        return df_modelo, df_cruz, None
+    finally:
+        wb.close()
+
+
+def _ler_abas_pandas(file) -> tuple:
+    """Fallback para formatos não suportados pelo openpyxl (.xls): um único ExcelFile, colunas podadas"""
+    xls = pd.ExcelFile(file)
+    if "MODELO" not in xls.sheet_names or "cruzamentos_100%" not in xls.sheet_names:
+        return None, None, "Abas 'MODELO' e 'cruzamentos_100%' não encontradas."
+    
+    df_modelo = xls.parse("MODELO", header=None, usecols=lambda c: c <= max(COLUNAS_MODELO))
+    primeira_col = df_modelo.iloc[:, 0]
+    idx_header = primeira_col.index[primeira_col == "RANKING_IPE"]
+    if len(idx_header) == 0:
+        return None, None, "Cabeçalho da aba MODELO não identificado."
+    df_modelo = df_modelo.loc[idx_header[0] + 1:, list(COLUNAS_MODELO)].rename(columns=COLUNAS_MODELO)
+    
+    df_cruz = xls.parse("cruzamentos_100%", header=None, skiprows=1,
+                        usecols=lambda c: c in COLUNAS_CRUZAMENTOS)
+    df_cruz = df_cruz.reindex(columns=list(COLUNAS_CRUZAMENTOS)).rename(columns=COLUNAS_CRUZAMENTOS)
+    return df_modelo, df_cruz, None
+
+
+def ler_abas_cruzamentos(file) -> tuple:
+    """
+    Abre a planilha de cruzamentos uma única vez e extrai apenas as colunas usadas.
+    
+    Retorna: (df_modelo, df_cruz, erro) — df_modelo com as linhas após o cabeçalho RANKING_IPE
+    e colunas de COLUNAS_MODELO; df_cruz com as colunas de COLUNAS_CRUZAMENTOS (valores brutos).
+    """
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    try:
+        return _ler_abas_openpyxl(file)
+    except (InvalidFileException, zipfile.BadZipFile):
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        return _ler_abas_pandas(file)
+
+
+def deduplicar_cruzamentos(df_cruz: pd.DataFrame) -> pd.DataFrame:
+    """
+    Agrupa as linhas de cruzamento pelo par canônico (cod_min, cod_max).
+    
+    Os nomes vêm da primeira ocorrência do par; lat/lon são a média exata das ocorrências
+    com coordenadas não nulas (0 se nenhuma tiver). Os ids seguem a ordem da primeira ocorrência.
+    """
+    colunas = ['id', 'cod_log1', 'log1', 'cod_log2', 'log2', 'lat', 'lon']
+    if df_cruz.empty:
+        return pd.DataFrame(columns=colunas)
+    
+    cod1 = df_cruz['cod1'].to_numpy(dtype=np.int64)
+    cod2 = df_cruz['cod2'].to_numpy(dtype=np.int64)
+    troca = cod1 >= cod2
+    cod_min = np.where(troca, cod2, cod1)
+    cod_max = np.where(troca, cod1, cod2)
+    
+    # Chave inteira única por par (códigos de logradouro são pequenos o bastante para caber em int64)
+    base = int(cod_max.max()) - int(cod_min.min()) + 1
+    chave = (cod_min - cod_min.min()) * base + (cod_max - cod_min.min())
+    grupo, _ = pd.factorize(chave)
+    n_grupos = int(grupo.max()) + 1
+    _, primeira = np.unique(grupo, return_index=True)
+    
+    lat = df_cruz['lat'].to_numpy(dtype=float)
+    lon = df_cruz['lon'].to_numpy(dtype=float)
+    validas = (lat != 0) & (lon != 0)
+    n_validas = np.bincount(grupo, weights=validas, minlength=n_grupos)
+    soma_lat = np.bincount(grupo, weights=np.where(validas, lat, 0), minlength=n_grupos)
+    soma_lon = np.bincount(grupo, weights=np.where(validas, lon, 0), minlength=n_grupos)
+    divisor = np.maximum(n_validas, 1)
+    
+    log1 = df_cruz['log1'].to_numpy(dtype=object)[primeira]
+    log2 = df_cruz['log2'].to_numpy(dtype=object)[primeira]
+    troca_primeira = troca[primeira]
+    
+    return pd.DataFrame({
+        'id': np.arange(1, n_grupos + 1),
+        'cod_log1': cod_min[primeira],
+        'log1': np.where(troca_primeira, log2, log1),
+        'cod_log2': cod_max[primeira],
+        'log2': np.where(troca_primeira, log1, log2),
+        'lat': soma_lat / divisor,
+        'lon': soma_lon / divisor
+    })
+
+
+# Coordenadas dos cruzamentos carregados em ponto fixo: inteiros de 1e-7 grau (~1 cm)
+ESCALA_COORDENADAS = 10_000_000
+
+
+def inteiros_compactos(valores) -> np.ndarray:
+    """Códigos inteiros como int32 quando cabem (int64 caso contrário)"""
+    valores = np.asarray(valores, dtype=np.int64)
+    info = np.iinfo(np.int32)
+    if len(valores) == 0 or (valores.min() >= info.min and valores.max() <= info.max):
+        return valores.astype(np.int32)
+    return valores
+
+
+def compactar_cruzamentos(cruzamentos: pd.DataFrame) -> pd.DataFrame:
+    """
+    Representação compacta dos cruzamentos mantida na sessão.
+    
+    Códigos e ids em int32, nomes de logradouro como categóricas com um único vocabulário para
+    log1 e log2, e lat/lon em ponto fixo (colunas lat_e7/lon_e7, ver ESCALA_COORDENADAS).
+    preparar_base_ipe devolve lat/lon em graus (float64) na base compartilhada em cache.
+    """
+    log1 = cruzamentos['log1'].astype(str)
+    log2 = cruzamentos['log2'].astype(str)
+    nomes = pd.unique(pd.concat([log1, log2], ignore_index=True))
+    return pd.DataFrame({
+        'id': inteiros_compactos(cruzamentos['id']),
+        'cod_log1': inteiros_compactos(cruzamentos['cod_log1']),
+        'log1': pd.Categorical(log1, categories=nomes),
+        'cod_log2': inteiros_compactos(cruzamentos['cod_log2']),
+        'log2': pd.Categorical(log2, categories=nomes),
+        'lat_e7': np.round(cruzamentos['lat'].to_numpy(dtype=float) * ESCALA_COORDENADAS).astype(np.int32),
+        'lon_e7': np.round(cruzamentos['lon'].to_numpy(dtype=float) * ESCALA_COORDENADAS).astype(np.int32)
+    })
+
+
+def carregar_excel_cruzamentos(file) -> tuple:
+    """Carrega e processa o Excel de cruzamentos"""
+    try:
+        df_logs, df_cruz, erro = ler_abas_cruzamentos(file)
+        if erro:
+            return None, None, erro
         
+        df_logs = df_logs.dropna(subset=['cod_log'])
         logs = pd.DataFrame({
-            'cod_log': pd.to_numeric(df_logs.iloc[:, 1], errors='coerce'),
-            'nome': df_logs.iloc[:, 2].astype(str),
-            'seg': pd.to_numeric(df_logs.iloc[:, 3], errors='coerce').fillna(0),
-            'lct': pd.to_numeric(df_logs.iloc[:, 4], errors='coerce').fillna(0),
-            'com': pd.to_numeric(df_logs.iloc[:, 5], errors='coerce').fillna(0),
-            'mob': pd.to_numeric(df_logs.iloc[:, 6], errors='coerce').fillna(0)
+            'cod_log': pd.to_numeric(df_logs['cod_log'], errors='coerce'),
+            'nome': df_logs['nome'].fillna('').astype(str),
+            'seg': pd.to_numeric(df_logs['seg'], errors='coerce').fillna(0),
+            'lct': pd.to_numeric(df_logs['lct'], errors='coerce').fillna(0),
+            'com': pd.to_numeric(df_logs['com'], errors='coerce').fillna(0),
+            'mob': pd.to_numeric(df_logs['mob'], errors='coerce').fillna(0)
         }).dropna(subset=['cod_log'])
+        if (logs['cod_log'] % 1 == 0).all():
+            logs['cod_log'] = inteiros_compactos(logs['cod_log'])
         
-        df_cruz = pd.read_excel(file, sheet_name="cruzamentos_100%", header=0)
-        
-        cruz_dict = {}
-        id_counter = 1
-        
-        for _, row in df_cruz.iterrows():
-            cod1, cod2 = row.iloc[0], row.iloc[4]
-            if pd.isna(cod1) or pd.isna(cod2):
-                continue
-            
-            cod1, cod2 = int(cod1), int(cod2)
-            log1 = str(row.iloc[2]) if not pd.isna(row.iloc[2]) else ""
-            log2 = str(row.iloc[6]) if not pd.isna(row.iloc[6]) else ""
-            lat = float(row.iloc[11]) if not pd.isna(row.iloc[11]) else 0
-            lon = float(row.iloc[12]) if not pd.isna(row.iloc[12]) else 0
-            
-            if cod1 < cod2:
-                cod_min, cod_max, log_min, log_max = cod1, cod2, log1, log2
-            else:
-                cod_min, cod_max, log_min, log_max = cod2, cod1, log2, log1
-            
-            chave = f"{cod_min}|{cod_max}"
-            
-            if chave not in cruz_dict:
-                cruz_dict[chave] = {
-                    'id': id_counter, 'cod_log1': cod_min, 'log1': log_min,
-                    'cod_log2': cod_max, 'log2': log_max, 'lat': lat, 'lon': lon
-                }
-                id_counter += 1
-            elif lat != 0 and lon != 0:
-                cruz_dict[chave]['lat'] = (cruz_dict[chave]['lat'] + lat) / 2
-                cruz_dict[chave]['lon'] = (cruz_dict[chave]['lon'] + lon) / 2
+        df_cruz = pd.DataFrame({
+            'cod1': pd.to_numeric(df_cruz['cod1'], errors='coerce'),
+            'log1': df_cruz['log1'].fillna('').astype(str),
+            'cod2': pd.to_numeric(df_cruz['cod2'], errors='coerce'),
+            'log2': df_cruz['log2'].fillna('').astype(str),
+            'lat': pd.to_numeric(df_cruz['lat'], errors='coerce').fillna(0).astype(float),
+            'lon': pd.to_numeric(df_cruz['lon'], errors='coerce').fillna(0).astype(float)
+        }).dropna(subset=['cod1', 'cod2'])
         
-        cruzamentos = pd.DataFrame(list(cruz_dict.values()))
+        cruzamentos = compactar_cruzamentos(deduplicar_cruzamentos(df_cruz))
         return logs, cruzamentos, f"✓ {len(logs)} logradouros, {len(cruzamentos)} cruzamentos"
     
     except Exception as e:
         return None, None, f"Erro: {str(e)}"
 
 
+# Primeira palavra do tipo -> categoria agrupada nas estatísticas
+MAPA_SEMELHANTES = {
+    "2ª": "2ª Jardim", "Primeira": "Parque", "Maria": "Rua", "Skate,": "Skatepark",
+    "3ª": "3ª Jardim", "1º": "1ª Jardim", "Administração": "Pátio", "AVENIDA": "AVENIDA",
+    "CAIXA": "Caixa Cultural", "Casa": "Casa dos Patrimônios", "Novo": "Skatepark",
+    "ANTIGO": "Hotel", "CASA": "Casa da Cultura", "BURACO": "Praia", "POLO": "Polo",
+    "Numa": "Rua", "PARQUE": "Parque"
+}
+
+# Grupos de eixo exibidos nas estatísticas de equipamentos
+GRUPOS_EQUIPAMENTOS = {'main': ['LCT', 'SEG'], 'com': ['COM']}
+
+
+def normalizar_equipamentos(equip: pd.DataFrame) -> pd.DataFrame:
+    """
+    Colunas derivadas calculadas uma única vez na carga, como categóricas: eixo normalizado
+    (maiúsculo, sem espaços), primeira palavra do tipo e categoria agrupada (MAPA_SEMELHANTES).
+    Os textos repetidos (eixo, tipo, logradouro) também passam a categóricas.
+    """
+    tipo = equip['tipo'].astype(str)
+    primeira_palavra = tipo.str.split(' ', n=1).str[0].where(tipo.str.len() > 0, "Outros")
+    return equip.astype({'eixo': 'category', 'tipo': 'category', 'log': 'category'}).assign(
+        eixo_norm=equip['eixo'].astype(str).str.strip().str.upper().astype('category'),
+        primeira_palavra=primeira_palavra.astype('category'),
+        agrupado=primeira_palavra.replace(MAPA_SEMELHANTES).astype('category')
+    )
+
+
 def carregar_excel_equipamentos(file) -> tuple:
     """Carrega o Excel de equipamentos"""
     try:
@@ -475,349 +1145,503 @@ def carregar_excel_equipamentos(file) -> tuple:
             'peso': pd.to_numeric(df["PESO"], errors='coerce').fillna(0)
         }).dropna(subset=['lat', 'lon'])
         
-        return equip, f"✓ {len(equip)} equipamentos"
+        return normalizar_equipamentos(equip), f"✓ {len(equip)} equipamentos"
     except Exception as e:
         return None, f"Erro: {str(e)}"
 
 
-def calcular_ipe_cruzamentos(logs: pd.DataFrame, cruzamentos: pd.DataFrame, 
-                              w_seg: float, w_lct: float, w_com: float, w_mob: float) -> pd.DataFrame:
-    """Calcula IPE para todos os cruzamentos"""
-    if logs.empty or cruzamentos.empty:
-        return pd.DataFrame()
-    
-    logs_dict = logs.set_index('cod_log').to_dict('index')
-    resultados = []
+def carregar_geojson_bairros(file) -> tuple:
+    """Carrega o GeoJSON de bairros já simplificado e serializado por zoom (ver preparar_bairros)"""
+    try:
+        bairros = preparar_bairros(json.load(file))
+        vertices = bairros['vertices']
+        return bairros, (f"✓ Fronteira carregada ({vertices['original']:,} vértices; "
+                         f"{vertices[str(ZOOM_BAIRROS_PADRAO)]:,} no zoom {ZOOM_BAIRROS_PADRAO})")
+    except Exception as e:
+        return None, f"Erro: {str(e)}"
+
+
+def preparar_base_ipe(logs: pd.DataFrame, cruzamentos: pd.DataFrame) -> dict:
+    """
+    Parte do cálculo de IPE que não depende dos pesos.
     
-    for _, c in cruzamentos.iterrows():
-        cod1, cod2 = c['cod_log1'], c['cod_log2']
-        if cod1 not in logs_dict or cod2 not in logs_dict:
-            continue
-        
-        l1, l2 = logs_dict[cod1], logs_dict[cod2]
-        
-        ipe1 = w_seg * l1['seg'] + w_lct * l1['lct'] + w_com * l1['com'] + w_mob * l1['mob']
-        ipe2 = w_seg * l2['seg'] + w_lct * l2['lct'] + w_com * l2['com'] + w_mob * l2['mob']
-        ipe_cruz = ipe1 + ipe2
-        
-        seg_tot = l1['seg'] + l2['seg']
-        lct_tot = l1['lct'] + l2['lct']
-        com_tot = l1['com'] + l2['com']
-        mob_tot = l1['mob'] + l2['mob']
-        
-        resultados.append({
-            'id': c['id'], 'cod_log1': cod1, 'log1': c['log1'],
-            'cod_log2': cod2, 'log2': c['log2'], 'lat': c['lat'], 'lon': c['lon'],
-            'ipe_log1': ipe1, 'ipe_log2': ipe2, 'ipe_cruz': ipe_cruz,
-            'seg_tot': seg_tot, 'lct_tot': lct_tot, 'com_tot': com_tot, 'mob_tot': mob_tot,
-            'ipe_cruz_seg': w_seg * seg_tot, 'ipe_cruz_lct': w_lct * lct_tot,
-            'ipe_cruz_com': w_com * com_tot, 'ipe_cruz_mob': w_mob * mob_tot,
-            'camera_tipo': sugerir_tipo_camera(seg_tot, lct_tot, com_tot, mob_tot)
-        })
+    Resolve cod_log1/cod_log2 em posições de `logs` uma única vez e monta as matrizes de eixos
+    (N×4, ordem de EIXOS) de cada logradouro e do cruzamento (soma dos dois).
+    Cruzamentos com algum código ausente em `logs` são descartados; as coordenadas em ponto fixo
+    (compactar_cruzamentos) voltam a lat/lon em graus.
+    """
+    logs_unicos = logs.drop_duplicates('cod_log', keep='last')
+    indice_logs = pd.Index(logs_unicos['cod_log'].to_numpy(dtype=float))
+    idx1 = indice_logs.get_indexer(cruzamentos['cod_log1'].to_numpy(dtype=float))
+    idx2 = indice_logs.get_indexer(cruzamentos['cod_log2'].to_numpy(dtype=float))
+    validos = (idx1 >= 0) & (idx2 >= 0)
     
-    if not resultados:
-        return pd.DataFrame()
+    eixos_logs = logs_unicos[EIXOS].to_numpy(dtype=float)
+    eixos_log1 = eixos_logs[idx1[validos]]
+    eixos_log2 = eixos_logs[idx2[validos]]
+    eixos = eixos_log1 + eixos_log2
     
-    df = pd.DataFrame(resultados).sort_values('ipe_cruz', ascending=False).reset_index(drop=True)
+    base_cruzamentos = cruzamentos.loc[validos, ['id', 'cod_log1', 'log1', 'cod_log2', 'log2']].reset_index(drop=True)
+    base_cruzamentos['lat'] = cruzamentos['lat_e7'].to_numpy()[validos] / ESCALA_COORDENADAS
+    base_cruzamentos['lon'] = cruzamentos['lon_e7'].to_numpy()[validos] / ESCALA_COORDENADAS
     
-    total_ipe = df['ipe_cruz'].sum()
-    if total_ipe > 0:
-        df['perc_ipe'] = df['ipe_cruz'] / total_ipe
-        df['cobertura_acum'] = df['ipe_cruz'].cumsum() / total_ipe
-    else:
-        df['perc_ipe'] = 0
-        df['cobertura_acum'] = 0
+    return {
+        'cruzamentos': base_cruzamentos,
+        'eixos_log1': eixos_log1,
+        'eixos_log2': eixos_log2,
+        'eixos': eixos,
+        'camera_tipo': pd.Categorical(sugerir_tipo_camera(eixos), categories=TIPOS_CAMERA)
+    }
+
+
+def obter_base_ipe(logs: pd.DataFrame, cruzamentos: pd.DataFrame, dataset_id: str = None) -> dict:
+    """Base de IPE do conjunto de dados (independente dos pesos), em cache pelo hash do arquivo"""
+    if dataset_id is None:
+        return preparar_base_ipe(logs, cruzamentos)
     
-    return df
+    cache = obter_cache('base_ipe')
+    base = cache.obter(dataset_id)
+    if base is None:
+        base = preparar_base_ipe(logs, cruzamentos)
+        cache.guardar(dataset_id, base)
+    return base
 
 
-def filtrar_por_cobertura_e_distancia(df: pd.DataFrame, cobertura_frac: float, min_dist: float, 
-                                       max_cruzamentos: int = None, raio_cobertura: float = 50,
-                                       limite_cobertura_logradouro: float = None) -> tuple:
+def calcular_eixos_risco(base: dict, indices: dict, raio: float = RAIO_RISCO_PADRAO) -> dict:
     """
-    Filtra cruzamentos mantendo a cobertura alvo mesmo com filtro de distância.
+    Eixos de risco por cruzamento: soma das ocorrências associadas (nome ou distância) de cada camada.
     
-    Args:
-        df: DataFrame com cruzamentos ordenados por IPE
-        cobertura_frac: Fração de cobertura alvo (0-1)
-        min_dist: Distância mínima entre cruzamentos DO MESMO LOGRADOURO em metros
-        max_cruzamentos: Limite máximo de cruzamentos (None = sem limite)
-        raio_cobertura: Raio de cobertura de cada câmera NO MESMO LOGRADOURO em metros
-        limite_cobertura_logradouro: Fração máxima de cobertura por logradouro (0-1, None = sem limite)
+    Cada eixo é reescalado para que seu máximo valha a média dos máximos dos quatro eixos do
+    cruzamento, deixando os pesos de risco na mesma escala dos demais.
+    """
+    cruzamentos = base['cruzamentos']
+    escala = float(base['eixos'].max(axis=0).mean()) if len(base['eixos']) else 1.0
+    eixos = {}
+    for nome, indice in indices.items():
+        pares = associar_riscos(indice, cruzamentos, raio)
+        quantidade = indice['camada']['quantidade'].to_numpy(dtype=float)
+        densidade = np.bincount(pares['pos'].to_numpy(), weights=quantidade[pares['linha'].to_numpy()],
+                                minlength=len(cruzamentos))
+        maximo = densidade.max() if len(densidade) else 0.0
+        eixos[nome] = densidade * (escala / maximo) if maximo > 0 else densidade
+    return eixos
+
+
+def obter_eixos_risco(chave, base: dict, indices: dict, raio: float) -> dict:
+    """Eixos de risco em cache por (dataset, camadas, raio): trocar só os pesos não refaz a associação"""
+    cache = obter_cache('eixos_risco')
+    eixos = cache.obter(chave)
+    if eixos is None:
+        eixos = calcular_eixos_risco(base, indices, raio)
+        cache.guardar(chave, eixos)
+    return eixos
+
+
+def calcular_eixos_equipamentos(base: dict, equipamentos: pd.DataFrame,
+                                raio: float = RAIO_EQUIPAMENTOS_PADRAO) -> dict:
+    """
+    Eixos de proximidade por cruzamento: soma do `peso` dos equipamentos a até `raio` metros,
+    separada pelo eixo do equipamento ({'eq_seg', 'eq_lct', 'eq_com'}).
     
-    Retorna: (DataFrame selecionados, cobertura_real, alvo_atingido, motivo_limite, ids_cobertos)
+    Os equipamentos vão para a grade espacial (coordenadas projetadas) e cada cruzamento consulta só
+    as células vizinhas; a distância exata (haversine) decide os candidatos. Um único fator de escala
+    leva o máximo da soma dos três eixos à escala dos quatro eixos do cruzamento, preservando a
+    proporção entre eles.
     """
-    if df.empty:
-        return pd.DataFrame(), 0.0, True, None, set()
-    
-    ipe_total = df['ipe_cruz'].sum()
-    if ipe_total <= 0:
-        return pd.DataFrame(), 0.0, True, None, set()
-    
-    # Calcular IPE total por logradouro (para limite de cobertura por rua)
-    ipe_por_logradouro = {}
-    if limite_cobertura_logradouro is not None:
-        for _, c in df.iterrows():
-            ipe = c['ipe_cruz']
-            for cod_log in [c['cod_log1'], c['cod_log2']]:
-                ipe_por_logradouro[cod_log] = ipe_por_logradouro.get(cod_log, 0) + ipe
-    
-    # Rastrear cobertura acumulada por logradouro
-    cobertura_por_logradouro = {}
-    
-    # Pré-indexar cruzamentos por logradouro
-    cruzamentos_por_logradouro = {}
-    cruz_por_id = {}
-    
-    for _, c in df.iterrows():
-        cruz_id = c['id']
-        lat, lon = c['lat'], c['lon']
-        ipe = c['ipe_cruz']
-        cod_log1, cod_log2 = c['cod_log1'], c['cod_log2']
-        
-        cruz_por_id[cruz_id] = {
-            'lat': lat, 'lon': lon, 'ipe': ipe,
-            'cod_log1': cod_log1, 'cod_log2': cod_log2
-        }
-        
-        for cod_log in [cod_log1, cod_log2]:
-            if cod_log not in cruzamentos_por_logradouro:
-                cruzamentos_por_logradouro[cod_log] = []
-            cruzamentos_por_logradouro[cod_log].append((cruz_id, lat, lon, ipe))
-    
-    cameras_por_logradouro = {}
-    
-    def camera_muito_perto_no_logradouro(lat, lon, cod_log1, cod_log2):
-        if min_dist <= 0:
-            return False
-        for cod_log in [cod_log1, cod_log2]:
-            if cod_log in cameras_por_logradouro:
-                for cam_lat, cam_lon in cameras_por_logradouro[cod_log]:
-                    if distancia_metros(lat, lon, cam_lat, cam_lon) < min_dist:
-                        return True
-        return False
-    
-    def registrar_camera_nos_logradouros(lat, lon, cod_log1, cod_log2):
-        for cod_log in [cod_log1, cod_log2]:
-            if cod_log not in cameras_por_logradouro:
-                cameras_por_logradouro[cod_log] = []
-            cameras_por_logradouro[cod_log].append((lat, lon))
-    
-    def calcular_cobertura_por_logradouro(cam_lat, cam_lon, cam_cod_log1, cam_cod_log2, ids_cobertos_atual):
-        novos_cobertos = set()
-        for cod_log in [cam_cod_log1, cam_cod_log2]:
-            if cod_log in cruzamentos_por_logradouro:
-                for cruz_id, lat, lon, ipe in cruzamentos_por_logradouro[cod_log]:
-                    if cruz_id not in ids_cobertos_atual and cruz_id not in novos_cobertos:
-                        if distancia_metros(cam_lat, cam_lon, lat, lon) <= raio_cobertura:
-                            novos_cobertos.add(cruz_id)
-        return novos_cobertos
-    
-    def violaria_limite_logradouro(cruz_id, novos_cobertos, cod_log1, cod_log2):
-        if limite_cobertura_logradouro is None:
-            return False
-        
-        ipe_adicional = {cod_log1: 0, cod_log2: 0}
-        ipe_cruz = cruz_por_id[cruz_id]['ipe']
-        ipe_adicional[cod_log1] += ipe_cruz
-        ipe_adicional[cod_log2] += ipe_cruz
-        
-        for cob_id in novos_cobertos:
-            if cob_id != cruz_id and cob_id in cruz_por_id:
-                cob_info = cruz_por_id[cob_id]
-                cob_ipe = cob_info['ipe']
-                cob_log1, cob_log2 = cob_info['cod_log1'], cob_info['cod_log2']
-                
-                if cob_log1 not in ipe_adicional:
-                    ipe_adicional[cob_log1] = 0
-                if cob_log2 not in ipe_adicional:
-                    ipe_adicional[cob_log2] = 0
-                    
-                ipe_adicional[cob_log1] += cob_ipe
-                ipe_adicional[cob_log2] += cob_ipe
-        
-        for cod_log in [cod_log1, cod_log2]:
-            ipe_total_log = ipe_por_logradouro.get(cod_log, 0)
-            if ipe_total_log <= 0:
-                continue
-            
-            ipe_atual = cobertura_por_logradouro.get(cod_log, 0)
-            ipe_novo = ipe_atual + ipe_adicional.get(cod_log, 0)
-            
-            if ipe_novo / ipe_total_log > limite_cobertura_logradouro:
-                return True
-        
-        return False
+    cruzamentos = base['cruzamentos']
+    n = len(cruzamentos)
+    eixos = {f'eq_{eixo}': np.zeros(n) for eixo in EIXOS_EQUIPAMENTO}
+    if n == 0 or equipamentos.empty:
+        return eixos
     
-    def atualizar_cobertura_logradouros(cruz_id, novos_cobertos, cod_log1, cod_log2):
-        if limite_cobertura_logradouro is None:
-            return
-        
-        processados = set()
-        ipe_cruz = cruz_por_id[cruz_id]['ipe']
-        cobertura_por_logradouro[cod_log1] = cobertura_por_logradouro.get(cod_log1, 0) + ipe_cruz
-        cobertura_por_logradouro[cod_log2] = cobertura_por_logradouro.get(cod_log2, 0) + ipe_cruz
-        processados.add(cruz_id)
-        
-        for cob_id in novos_cobertos:
-            if cob_id not in processados and cob_id in cruz_por_id:
-                cob_info = cruz_por_id[cob_id]
-                cob_ipe = cob_info['ipe']
-                cob_log1, cob_log2 = cob_info['cod_log1'], cob_info['cod_log2']
-                
-                cobertura_por_logradouro[cob_log1] = cobertura_por_logradouro.get(cob_log1, 0) + cob_ipe
-                cobertura_por_logradouro[cob_log2] = cobertura_por_logradouro.get(cob_log2, 0) + cob_ipe
-                processados.add(cob_id)
-    
-    selecionados = []
-    ids_cobertos = set()
-    ipe_coberto = 0.0
-    motivo_limite = None
-    
-    for _, c in df.iterrows():
-        if max_cruzamentos is not None and len(selecionados) >= max_cruzamentos:
-            motivo_limite = 'quantidade'
-            break
-        
-        cobertura_atual = ipe_coberto / ipe_total
-        if max_cruzamentos is None and cobertura_atual >= cobertura_frac:
-            break
-        
-        lat, lon = c['lat'], c['lon']
-        cruz_id = c['id']
-        cod_log1, cod_log2 = c['cod_log1'], c['cod_log2']
-        
-        if camera_muito_perto_no_logradouro(lat, lon, cod_log1, cod_log2):
-            continue
-        
-        novos_cobertos = calcular_cobertura_por_logradouro(lat, lon, cod_log1, cod_log2, ids_cobertos)
-        if cruz_id not in ids_cobertos:
-            novos_cobertos.add(cruz_id)
-        
-        if violaria_limite_logradouro(cruz_id, novos_cobertos, cod_log1, cod_log2):
-            continue
-        
-        selecionados.append(c.to_dict())
-        registrar_camera_nos_logradouros(lat, lon, cod_log1, cod_log2)
-        atualizar_cobertura_logradouros(cruz_id, novos_cobertos, cod_log1, cod_log2)
-        
-        for cob_id in novos_cobertos:
-            if cob_id in cruz_por_id and cob_id not in ids_cobertos:
-                ipe_coberto += cruz_por_id[cob_id]['ipe']
-        ids_cobertos.update(novos_cobertos)
+    eixo_equip = equipamentos['eixo_norm'].astype(str).str.lower().to_numpy()
+    lat_e, lon_e = equipamentos['lat'].to_numpy(dtype=float), equipamentos['lon'].to_numpy(dtype=float)
+    peso = equipamentos['peso'].to_numpy(dtype=float)
+    usados = np.flatnonzero(np.isin(eixo_equip, EIXOS_EQUIPAMENTO) & coordenadas_validas(lat_e, lon_e) & (peso > 0))
+    lat, lon = cruzamentos['lat'].to_numpy(dtype=float), cruzamentos['lon'].to_numpy(dtype=float)
+    validos = np.flatnonzero(coordenadas_validas(lat, lon))
+    if len(usados) == 0 or len(validos) == 0:
+        return eixos
     
-    if not selecionados:
-        return pd.DataFrame(), 0.0, False, None, set()
+    lat_ref = latitude_referencia(lat_e[usados], lon_e[usados])
+    xe, ye = projetar_metros(lat_e[usados], lon_e[usados], lat_ref)
+    grade = construir_indice_grade(xe, ye, raio * 1.01 + 1)
+    x, y = projetar_metros(lat[validos], lon[validos], lat_ref)
+    i, j = consultar_indice_grade(grade, x, y)
+    d = distancia_metros_vetor(lat[validos[i]], lon[validos[i]], lat_e[usados[j]], lon_e[usados[j]])
+    perto = d <= raio
+    pos, equip = validos[i[perto]], usados[j[perto]]
     
-    df_result = pd.DataFrame(selecionados)
-    cobertura_real = ipe_coberto / ipe_total
-    df_result['cobertura_acum'] = df_result['ipe_cruz'].cumsum() / ipe_total
+    for eixo in EIXOS_EQUIPAMENTO:
+        do_eixo = eixo_equip[equip] == eixo
+        eixos[f'eq_{eixo}'] = np.bincount(pos[do_eixo], weights=peso[equip[do_eixo]], minlength=n)
     
-    alvo_atingido = cobertura_real >= cobertura_frac * 0.99
-    if not alvo_atingido and motivo_limite is None:
-        motivo_limite = 'restricoes'
+    maximo = sum(eixos.values()).max()
+    if maximo > 0:
+        escala = float(base['eixos'].max(axis=0).mean()) / maximo
+        eixos = {nome: valores * escala for nome, valores in eixos.items()}
+    return eixos
+
+
+def obter_eixos_equipamentos(chave, base: dict, equipamentos: pd.DataFrame, raio: float) -> dict:
+    """Eixos de proximidade em cache por (dataset, equipamentos, raio): trocar só o peso não refaz a junção"""
+    cache = obter_cache('eixos_equipamentos')
+    eixos = cache.obter(chave)
+    if eixos is None:
+        eixos = calcular_eixos_equipamentos(base, equipamentos, raio)
+        cache.guardar(chave, eixos)
+    return eixos
+
+
+def calcular_ipe_cruzamentos(logs: pd.DataFrame, cruzamentos: pd.DataFrame, 
+                              w_seg: float, w_lct: float, w_com: float, w_mob: float) -> pd.DataFrame:
+    """Calcula IPE para todos os cruzamentos"""
+    if logs.empty or cruzamentos.empty:
+        return pd.DataFrame()
     
-    return df_result, cobertura_real, alvo_atingido, motivo_limite, ids_cobertos
+    return calcular_ipe_base(preparar_base_ipe(logs, cruzamentos), w_seg, w_lct, w_com, w_mob)
 
 
-def criar_mapa(cruzamentos_selecionados: pd.DataFrame, equipamentos: pd.DataFrame, 
-               nota_min_equip: int, bairros_geojson=None) -> folium.Map:
-    """Cria o mapa com os cruzamentos e equipamentos"""
-    m = folium.Map(location=[-8.05, -34.91], zoom_start=12, tiles='OpenStreetMap')
-    
-    if bairros_geojson is not None:
-        folium.GeoJson(bairros_geojson, style_function=lambda x: {
-            'fillColor': 'transparent', 'color': '#6b7280', 'weight': 2, 'fillOpacity': 0
-        }).add_to(m)
-    
-    if not cruzamentos_selecionados.empty:
-        for _, c in cruzamentos_selecionados.iterrows():
-            tipo = c.get('camera_tipo', 'FIXA')
-            popup_html = f"""<div style="font-size:0.8rem; min-width:180px;">
-                <strong>Cruzamento {int(c['id'])}</strong><br/>
-                <b>Ruas:</b> {c['log1']} x {c['log2']}<br/>
-                <b>Camera:</b> {tipo}<br/>
-                <b>IPE:</b> {c['ipe_cruz']:.4f}<br/>
-                <b>Cobertura:</b> {c['cobertura_acum']*100:.2f}%
-            </div>"""
-            folium.CircleMarker(
-                location=[c['lat'], c['lon']], radius=5, color="#3b82f6",
-                fill=True, fillColor="#3b82f6", fillOpacity=0.85, weight=1,
-                popup=folium.Popup(popup_html, max_width=250)
-            ).add_to(m)
-    
-    if not equipamentos.empty:
-        for _, e in equipamentos[equipamentos['peso'] >= nota_min_equip].iterrows():
-            popup_html = f"""<div style="font-size:0.8rem;">
-                <strong>{e['tipo'] or 'Equipamento'}</strong><br/>
-                <b>Log:</b> {e['log']}<br/><b>Peso:</b> {e['peso']}
-            </div>"""
-            folium.CircleMarker(
-                location=[e['lat'], e['lon']], radius=5, color="#dc2626",
-                fill=True, fillColor="#ef4444", fillOpacity=0.85, weight=1,
-                popup=folium.Popup(popup_html, max_width=200)
-            ).add_to(m)
+def obter_grafo_vizinhanca(dataset_id: str, cruzamentos: pd.DataFrame, raio: float, inclusivo: bool = True) -> dict:
+    """Grafo de vizinhança em cache por (dataset, raio, tipo): sliders que não mudam o raio não refazem distâncias"""
+    if dataset_id is None:
+        return construir_grafo_vizinhanca(cruzamentos, raio, inclusivo)
+    
+    cache = obter_cache('grafos', 16)
+    chave = (dataset_id, float(raio), inclusivo)
+    grafo = cache.obter(chave)
+    if grafo is None:
+        grafo = construir_grafo_vizinhanca(cruzamentos, raio, inclusivo)
+        cache.guardar(chave, grafo)
+    return grafo
+
+
+def obter_trilha_selecao(chave: tuple, df: pd.DataFrame, min_dist: float, raio_cobertura: float, grafos: dict,
+                         otimizador: str = 'ipe') -> dict:
+    """Trilha completa do otimizador em cache por (dataset, pesos, distância mínima, raio, otimizador)"""
+    cache = obter_cache('trilhas')
+    chave = chave + (otimizador,)
+    trilha = cache.obter(chave)
+    if trilha is None:
+        trilha = construir_trilha_selecao(df, min_dist, raio_cobertura, grafos, otimizador)
+        cache.guardar(chave, trilha)
+    return trilha
+
+
+# Estilos dos marcadores e popups montados no navegador (modo leve) a partir das propriedades
+ESTILO_CRUZAMENTO = {'radius': 5, 'color': "#3b82f6", 'fill': True, 'fillColor': "#3b82f6",
+                     'fillOpacity': 0.85, 'weight': 1}
+ESTILO_EQUIPAMENTO = {'radius': 5, 'color': "#dc2626", 'fill': True, 'fillColor': "#ef4444",
+                      'fillOpacity': 0.85, 'weight': 1}
+POPUP_CRUZAMENTO_JS = """function (p) {
+    return '<div style="font-size:0.8rem; min-width:180px;"><strong>Cruzamento ' + p.id + '</strong><br/>' +
+        '<b>Ruas:</b> ' + p.log1 + ' x ' + p.log2 + '<br/><b>Camera:</b> ' + p.camera_tipo + '<br/>' +
+        '<b>IPE:</b> ' + p.ipe_cruz.toFixed(4) + '<br/><b>Cobertura:</b> ' + p.cobertura.toFixed(2) + '%</div>';
+}"""
+POPUP_EQUIPAMENTO_JS = """function (p) {
+    return '<div style="font-size:0.8rem;"><strong>' + (p.tipo || 'Equipamento') + '</strong><br/>' +
+        '<b>Log:</b> ' + p.log + '<br/><b>Peso:</b> ' + p.peso + '</div>';
+}"""
+MODOS_MAPA = {'leve': "Camada leve (canvas, popups no clique)", 'classico': "Marcadores individuais (clássico)"}
+LIMITE_AGRUPAMENTO_PADRAO = 2000
+
+
+def camada_pontos(lat, lon, propriedades: dict, estilo: dict, popup_js: str,
+                  limite_agrupamento: int = LIMITE_AGRUPAMENTO_PADRAO):
+    """
+    Camada única para muitos pontos: atributos em colunas e popup montado no navegador, no clique.
     
+    Até `limite_agrupamento` pontos vira uma FeatureCollection desenhada em canvas;
+    acima disso vira um FastMarkerCluster alimentado por linhas [lat, lon, *propriedades].
+    """
+    nomes = list(propriedades)
+    colunas = [np.asarray(v).tolist() for v in propriedades.values()]
+    lat = np.round(np.asarray(lat, dtype=float), 6).tolist()
+    lon = np.round(np.asarray(lon, dtype=float), 6).tolist()
+    
+    if len(lat) > limite_agrupamento:
+        callback = f"""function (row) {{
+            var nomes = {json.dumps(nomes)}, props = {{}};
+            for (var i = 0; i < nomes.length; i++) {{ props[nomes[i]] = row[i + 2]; }}
+            var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {json.dumps(estilo)});
+            marker.bindPopup(function () {{ return ({popup_js})(props); }}, {{maxWidth: 250}});
+            return marker;
+        }}"""
+        linhas = [list(valores) for valores in zip(lat, lon, *colunas)]
+        return folium.plugins.FastMarkerCluster(linhas, callback=callback)
+    
+    feicoes = [
+        {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': [lo, la]},
+         'properties': dict(zip(nomes, valores))}
+        for la, lo, *valores in zip(lat, lon, *colunas)
+    ]
+    ao_criar = JsCode(f"""function (feature, layer) {{
+        layer.bindPopup(function () {{ return ({popup_js})(feature.properties); }}, {{maxWidth: 250}});
+    }}""")
+    return folium.GeoJson({'type': 'FeatureCollection', 'features': feicoes},
+                          marker=folium.CircleMarker(**estilo), on_each_feature=ao_criar)
+
+
+def adicionar_fronteiras(m: folium.Map, bairros_geojson, zoom_bairros: int):
+    """Adiciona o contorno dos bairros no nível de detalhe pedido (aceita também GeoJSON cru)"""
+    if bairros_geojson is None:
+        return
+    if 'niveis' not in bairros_geojson:
+        bairros_geojson = preparar_bairros(bairros_geojson)
+    niveis = bairros_geojson['niveis']
+    payload = niveis.get(str(zoom_bairros)) or niveis[max(niveis, key=int)]
+    CamadaFronteiras(payload, {'fillColor': 'transparent', 'color': '#6b7280', 'weight': 2,
+                               'fillOpacity': 0}).add_to(m)
+
+
+def criar_mapa_base(bairros_geojson=None, modo: str = 'leve', zoom_bairros: int = ZOOM_BAIRROS_PADRAO) -> folium.Map:
+    """Mapa sem os pontos: tiles e fronteiras, que só mudam com o arquivo de bairros ou o modo"""
+    m = folium.Map(location=[-8.05, -34.91], zoom_start=12, tiles='OpenStreetMap', prefer_canvas=(modo == 'leve'))
+    adicionar_fronteiras(m, bairros_geojson, zoom_bairros)
     return m
 
 
-def gerar_csv_download(df_calculados: pd.DataFrame, df_selecionados: pd.DataFrame) -> bytes:
-    """Gera CSV para download"""
-    if df_calculados.empty:
-        return b""
+def criar_camada_cruzamentos(cruzamentos_selecionados: pd.DataFrame, modo: str = 'leve',
+                             limite_agrupamento: int = LIMITE_AGRUPAMENTO_PADRAO) -> folium.FeatureGroup:
+    """Camada dos cruzamentos selecionados (leve: ver camada_pontos; classico: um CircleMarker por linha)"""
+    grupo = folium.FeatureGroup(name="Cruzamentos")
+    c = cruzamentos_selecionados
+    if c.empty:
+        return grupo
     
-    ids_sel = set(df_selecionados['id'].values) if not df_selecionados.empty else set()
-    df_export = df_calculados.copy()
-    df_export['selecionado_no_mapa'] = df_export['id'].apply(lambda x: 1 if x in ids_sel else 0)
+    if modo == 'leve':
+        camada_pontos(c['lat'], c['lon'], {
+            'id': c['id'].astype(np.int64),
+            'log1': c['log1'].astype(str),
+            'log2': c['log2'].astype(str),
+            'camera_tipo': c['camera_tipo'].astype(str) if 'camera_tipo' in c else np.full(len(c), 'FIXA'),
+            'ipe_cruz': np.round(c['ipe_cruz'].to_numpy(dtype=float), 6),
+            'cobertura': np.round(c['cobertura_acum'].to_numpy(dtype=float) * 100, 4),
+        }, ESTILO_CRUZAMENTO, POPUP_CRUZAMENTO_JS, limite_agrupamento).add_to(grupo)
+        return grupo
     
-    cols = ['id', 'cod_log1', 'log1', 'cod_log2', 'log2', 'lat', 'lon',
-            'ipe_log1', 'ipe_log2', 'ipe_cruz', 'perc_ipe', 'cobertura_acum',
-            'camera_tipo', 'selecionado_no_mapa']
+    for _, c in cruzamentos_selecionados.iterrows():
+        tipo = c.get('camera_tipo', 'FIXA')
+        popup_html = f"""<div style="font-size:0.8rem; min-width:180px;">
+            <strong>Cruzamento {int(c['id'])}</strong><br/>
+            <b>Ruas:</b> {c['log1']} x {c['log2']}<br/>
+            <b>Camera:</b> {tipo}<br/>
+            <b>IPE:</b> {c['ipe_cruz']:.4f}<br/>
+            <b>Cobertura:</b> {c['cobertura_acum']*100:.2f}%
+        </div>"""
+        folium.CircleMarker(
+            location=[c['lat'], c['lon']], radius=5, color="#3b82f6",
+            fill=True, fillColor="#3b82f6", fillOpacity=0.85, weight=1,
+            popup=folium.Popup(popup_html, max_width=250)
+        ).add_to(grupo)
+    return grupo
+
+
+def criar_camada_equipamentos(equipamentos: pd.DataFrame, nota_min_equip: int, modo: str = 'leve',
+                              limite_agrupamento: int = LIMITE_AGRUPAMENTO_PADRAO) -> folium.FeatureGroup:
+    """Camada dos equipamentos com peso >= nota_min_equip"""
+    grupo = folium.FeatureGroup(name="Equipamentos")
+    if equipamentos.empty:
+        return grupo
+    filtrados = equipamentos[equipamentos['peso'] >= nota_min_equip]
+    if filtrados.empty:
+        return grupo
     
-    df_export = df_export[cols]
-    for col in ['ipe_log1', 'ipe_log2', 'ipe_cruz', 'perc_ipe', 'cobertura_acum']:
-        df_export[col] = df_export[col].apply(lambda x: f"{x:.6f}")
+    if modo == 'leve':
+        camada_pontos(filtrados['lat'], filtrados['lon'], {
+            'tipo': filtrados['tipo'].astype(object).fillna('').astype(str),
+            'log': filtrados['log'].astype(str),
+            'peso': filtrados['peso'].tolist(),
+        }, ESTILO_EQUIPAMENTO, POPUP_EQUIPAMENTO_JS, limite_agrupamento).add_to(grupo)
+        return grupo
     
-    return df_export.to_csv(index=False, sep=';').encode('utf-8')
+    for _, e in filtrados.iterrows():
+        popup_html = f"""<div style="font-size:0.8rem;">
+            <strong>{e['tipo'] or 'Equipamento'}</strong><br/>
+            <b>Log:</b> {e['log']}<br/><b>Peso:</b> {e['peso']}
+        </div>"""
+        folium.CircleMarker(
+            location=[e['lat'], e['lon']], radius=5, color="#dc2626",
+            fill=True, fillColor="#ef4444", fillOpacity=0.85, weight=1,
+            popup=folium.Popup(popup_html, max_width=200)
+        ).add_to(grupo)
+    return grupo
+
+
+def criar_mapa(cruzamentos_selecionados: pd.DataFrame, equipamentos: pd.DataFrame, 
+               nota_min_equip: int, bairros_geojson=None, modo: str = 'leve',
+               limite_agrupamento: int = LIMITE_AGRUPAMENTO_PADRAO,
+               zoom_bairros: int = ZOOM_BAIRROS_PADRAO) -> folium.Map:
+    """
+    Cria o mapa completo com os cruzamentos e equipamentos.
+    
+    modo='leve' usa uma camada compacta por tipo de ponto (ver camada_pontos);
+    modo='classico' mantém um CircleMarker com popup pré-renderizado por linha.
+    As fronteiras usam o nível de simplificação de `zoom_bairros` preparado no upload.
+    No app, o mapa base e as camadas são montados separadamente para que só as camadas alteradas
+    sejam reenviadas ao navegador.
+    """
+    m = criar_mapa_base(bairros_geojson, modo, zoom_bairros)
+    criar_camada_cruzamentos(cruzamentos_selecionados, modo, limite_agrupamento).add_to(m)
+    criar_camada_equipamentos(equipamentos, nota_min_equip, modo, limite_agrupamento).add_to(m)
+    return m
 
 
-def gerar_estatisticas_equipamentos(df_equipamentos: pd.DataFrame, nota_min: int) -> dict:
-    """Gera estatísticas detalhadas dos equipamentos"""
-    if df_equipamentos.empty:
+def contar_equipamentos(equipamentos: pd.DataFrame) -> pd.DataFrame:
+    """Contagem de equipamentos por (eixo_norm, peso, tipo, agrupado): base de todas as estatísticas"""
+    return (equipamentos.groupby(['eixo_norm', 'peso', 'tipo', 'agrupado'], observed=True, sort=False)
+                        .size().rename('qtd').reset_index())
+
+
+def _contagem_ordenada(contagens: pd.DataFrame, coluna: str) -> dict:
+    """Soma de `qtd` por `coluna`, em ordem decrescente de quantidade (empates em ordem alfabética)"""
+    soma = contagens.groupby(coluna, observed=True)['qtd'].sum()
+    return soma.sort_index().sort_values(ascending=False, kind='stable').to_dict()
+
+
+def gerar_estatisticas_equipamentos(contagens: pd.DataFrame, nota_min: int) -> dict:
+    """Gera estatísticas detalhadas dos equipamentos a partir da tabela de contagens (ver contar_equipamentos)"""
+    if contagens.empty:
         return None
     
-    df_eq = df_equipamentos[df_equipamentos['peso'] >= nota_min].copy()
-    total_filtrado = len(df_eq)
+    filtradas = contagens[contagens['peso'] >= nota_min]
+    total_filtrado = int(filtradas['qtd'].sum())
     
     if total_filtrado == 0:
         return {'total': 0, 'tipos': {}, 'agrupados': {}, 'prioridades': {}}
     
-    # Tratamentos
-    df_eq['primeira_palavra'] = df_eq['tipo'].astype(str).apply(
-        lambda x: x.split(' ')[0] if len(x) > 0 else "Outros"
-    )
-    
-    mapa_semelhantes = {
-        "2ª": "2ª Jardim", "Primeira": "Parque", "Maria": "Rua", "Skate,": "Skatepark",
-        "3ª": "3ª Jardim", "1º": "1ª Jardim", "Administração": "Pátio", "AVENIDA": "AVENIDA",
-        "CAIXA": "Caixa Cultural", "Casa": "Casa dos Patrimônios", "Novo": "Skatepark",
-        "ANTIGO": "Hotel", "CASA": "Casa da Cultura", "BURACO": "Praia", "POLO": "Polo",
-        "Numa": "Rua", "PARQUE": "Parque"
-    }
-    df_eq['agrupado'] = df_eq['primeira_palavra'].apply(lambda x: mapa_semelhantes.get(x, x))
-    
-    contagem_tipos = df_eq['tipo'].value_counts().to_dict()
-    contagem_agrupada = df_eq['agrupado'].value_counts().to_dict()
-    contagem_pesos = df_eq['peso'].value_counts().sort_index(ascending=False).to_dict()
-    
     return {
         'total': total_filtrado,
-        'tipos': contagem_tipos,
-        'agrupados': contagem_agrupada,
-        'prioridades': contagem_pesos
+        'tipos': _contagem_ordenada(filtradas, 'tipo'),
+        'agrupados': _contagem_ordenada(filtradas, 'agrupado'),
+        'prioridades': filtradas.groupby('peso')['qtd'].sum().sort_index(ascending=False).to_dict()
     }
 
 
+def obter_estatisticas_equipamentos(equipamentos_id: str, equipamentos: pd.DataFrame, nota_min: int) -> dict:
+    """
+    Estatísticas por grupo de GRUPOS_EQUIPAMENTOS em cache por (equipamentos, nota_min).
+    
+    A contagem agrupada é feita uma vez por arquivo; cada nota mínima só filtra essa tabela.
+    """
+    cache = obter_cache('estatisticas_equipamentos', 5 * CACHE_MAX_ITENS)
+    estatisticas = cache.obter((equipamentos_id, nota_min))
+    if estatisticas is None:
+        cache_contagens = obter_cache('contagens_equipamentos')
+        contagens = cache_contagens.obter(equipamentos_id)
+        if contagens is None:
+            contagens = contar_equipamentos(equipamentos)
+            cache_contagens.guardar(equipamentos_id, contagens)
+        estatisticas = {
+            grupo: gerar_estatisticas_equipamentos(contagens[contagens['eixo_norm'].isin(eixos)], nota_min)
+            for grupo, eixos in GRUPOS_EQUIPAMENTOS.items()
+        }
+        cache.guardar((equipamentos_id, nota_min), estatisticas)
+    return estatisticas
+
+
+# ============================================================
+# EXPORTAÇÃO - CSV, PARQUET E GEOJSON EM BLOCOS
+# ============================================================
+COLUNAS_EXPORTACAO = ['id', 'cod_log1', 'log1', 'cod_log2', 'log2', 'lat', 'lon',
+                      'ipe_log1', 'ipe_log2', 'ipe_cruz', 'perc_ipe', 'cobertura_acum',
+                      'camera_tipo', 'selecionado_no_mapa']
+COLUNAS_SEIS_CASAS = ['ipe_log1', 'ipe_log2', 'ipe_cruz', 'perc_ipe', 'cobertura_acum']
+BLOCO_EXPORTACAO = 50_000
+
+
+def tabela_exportacao(df_calculados: pd.DataFrame, df_selecionados: pd.DataFrame) -> pd.DataFrame:
+    """Colunas exportadas, sem copiar o frame calculado, com a marcação dos selecionados (0/1)"""
+    ids_sel = df_selecionados['id'] if not df_selecionados.empty else []
+    colunas = {c: df_calculados[c] for c in COLUNAS_EXPORTACAO[:-1]}
+    colunas['selecionado_no_mapa'] = df_calculados['id'].isin(ids_sel).astype(np.int8)
+    return pd.DataFrame(colunas, copy=False)
+
+
+def _blocos(tabela: pd.DataFrame, tamanho_bloco: int):
+    for inicio in range(0, len(tabela), tamanho_bloco):
+        yield tabela.iloc[inicio:inicio + tamanho_bloco]
+
+
+def gerar_csv_download(df_calculados: pd.DataFrame, df_selecionados: pd.DataFrame,
+                       tamanho_bloco: int = BLOCO_EXPORTACAO) -> bytes:
+    """
+    Gera CSV para download (';', IPEs com 6 casas), escrito em blocos.
+    
+    As 6 casas são aplicadas pelo float_format na escrita; os demais floats (códigos, lat/lon)
+    são convertidos antes para texto pelo numpy, mantendo a representação padrão do pandas.
+    """
+    if df_calculados.empty:
+        return b""
+    
+    tabela = tabela_exportacao(df_calculados, df_selecionados)
+    for col in tabela.columns.difference(COLUNAS_SEIS_CASAS):
+        if tabela[col].dtype.kind == 'f':
+            tabela[col] = tabela[col].to_numpy().astype(str)
+    
+    saida = io.StringIO()
+    for i, bloco in enumerate(_blocos(tabela, tamanho_bloco)):
+        bloco.to_csv(saida, index=False, sep=';', float_format='%.6f', header=(i == 0))
+    return saida.getvalue().encode('utf-8')
+
+
+def gerar_parquet_download(df_calculados: pd.DataFrame, df_selecionados: pd.DataFrame,
+                           tamanho_bloco: int = BLOCO_EXPORTACAO) -> bytes:
+    """Gera Parquet (tipos nativos, sem arredondamento) em row groups de `tamanho_bloco` linhas"""
+    if df_calculados.empty:
+        return b""
+    saida = io.BytesIO()
+    tabela_exportacao(df_calculados, df_selecionados).to_parquet(saida, index=False, row_group_size=tamanho_bloco)
+    return saida.getvalue()
+
+
+def gerar_geojson_download(df_calculados: pd.DataFrame, df_selecionados: pd.DataFrame,
+                           tamanho_bloco: int = BLOCO_EXPORTACAO) -> bytes:
+    """
+    Gera GeoJSON (FeatureCollection de pontos, WGS84) com as mesmas colunas do CSV como propriedades.
+    
+    As propriedades de cada bloco são serializadas de uma vez (to_json em linhas) e só
+    encaixadas no envelope de cada feição.
+    """
+    if df_calculados.empty:
+        return b""
+    
+    saida = io.StringIO()
+    saida.write('{"type":"FeatureCollection","features":[')
+    primeiro = True
+    for bloco in _blocos(tabela_exportacao(df_calculados, df_selecionados), tamanho_bloco):
+        propriedades = bloco.to_json(orient='records', lines=True, force_ascii=False, double_precision=15).splitlines()
+        lon = bloco['lon'].to_numpy().astype(str)
+        lat = bloco['lat'].to_numpy().astype(str)
+        if not primeiro:
+            saida.write(',')
+        saida.write(','.join(
+            f'{{"type":"Feature","geometry":{{"type":"Point","coordinates":[{x},{y}]}},"properties":{p}}}'
+            for x, y, p in zip(lon, lat, propriedades)
+        ))
+        primeiro = False
+    saida.write(']}')
+    return saida.getvalue().encode('utf-8')
+
+
+# Formato -> (arquivo, MIME, gerador)
+FORMATOS_EXPORTACAO = {
+    'CSV': ("ipe_cruzamentos.csv", "text/csv", gerar_csv_download),
+    'Parquet': ("ipe_cruzamentos.parquet", "application/vnd.apache.parquet", gerar_parquet_download),
+    'GeoJSON': ("ipe_cruzamentos.geojson", "application/geo+json", gerar_geojson_download),
+}
+
+
+def obter_exportacao(chave, formato: str, df_calculados: pd.DataFrame, df_selecionados: pd.DataFrame) -> bytes:
+    """Arquivo exportado em cache por (seleção, formato); gerado só quando pedido"""
+    cache = obter_cache('exportacao', 4)
+    dados = cache.obter((chave, formato))
+    if dados is None:
+        dados = FORMATOS_EXPORTACAO[formato][2](df_calculados, df_selecionados)
+        cache.guardar((chave, formato), dados)
+    return dados
+
+
 # ============================================================
 # SIDEBAR - CONTROLES
 # ============================================================
@@ -828,10 +1652,14 @@ with st.sidebar:
     st.markdown('<div class="section-title">1a. Excel de cruzamentos</div>', unsafe_allow_html=True)
     file_cruz = st.file_uploader("Cruzamentos", type=['xlsx', 'xls'], key='file_cruz', label_visibility='collapsed')
     if file_cruz:
-        logs, cruzamentos, msg = carregar_excel_cruzamentos(file_cruz)
+        with medir_etapa('ingestao_cruzamentos') as etapa:
+            digest_cruz = hash_arquivo(file_cruz)
+            logs, cruzamentos, msg = carregar_com_cache(file_cruz, 'cruzamentos', carregar_excel_cruzamentos, digest_cruz)
+            etapa['linhas'] = len(cruzamentos) if cruzamentos is not None else 0
         if logs is not None:
             st.session_state.logs = logs
             st.session_state.cruzamentos = cruzamentos
+            st.session_state.dataset_id = f"v{CACHE_VERSAO}_{digest_cruz}"
             st.success(msg)
         else:
             st.error(msg)
@@ -840,24 +1668,56 @@ with st.sidebar:
     st.markdown('<div class="section-title">1b. Excel de equipamentos</div>', unsafe_allow_html=True)
     file_equip = st.file_uploader("Equipamentos", type=['xlsx', 'xls'], key='file_equip', label_visibility='collapsed')
     if file_equip:
-        equip, msg = carregar_excel_equipamentos(file_equip)
+        with medir_etapa('ingestao_equipamentos') as etapa:
+            digest_equip = hash_arquivo(file_equip)
+            equip, msg = carregar_com_cache(file_equip, 'equipamentos', carregar_excel_equipamentos, digest_equip)
+            etapa['linhas'] = len(equip) if equip is not None else 0
         if equip is not None:
             st.session_state.equipamentos = equip
+            st.session_state.equipamentos_id = digest_equip
             st.success(msg)
         else:
             st.error(msg)
     
     nota_min_equip = st.slider("Nota minima equipamentos", 1, 5, 4, key='nota_equip')
+    raio_equipamentos = st.number_input("Raio de proximidade dos equipamentos (m)", 50, 2000, RAIO_EQUIPAMENTOS_PADRAO, 50,
+                                        key='raio_equipamentos',
+                                        help="Equipamentos a ate esta distancia somam seu peso ao eixo de proximidade do cruzamento")
     
     # 1c. GeoJSON
     st.markdown('<div class="section-title">1c. Bairros (GeoJSON)</div>', unsafe_allow_html=True)
     file_bairros = st.file_uploader("GeoJSON", type=['json', 'geojson'], key='file_bairros', label_visibility='collapsed')
     if file_bairros:
-        try:
-            st.session_state.bairros_geojson = json.load(file_bairros)
-            st.success("✓ Fronteira carregada")
-        except Exception as e:
-            st.error(f"Erro: {str(e)}")
+        with medir_etapa('ingestao_bairros'):
+            bairros, msg = carregar_com_cache(file_bairros, 'bairros', carregar_geojson_bairros)
+        if bairros is not None:
+            st.session_state.bairros_geojson = bairros
+            st.success(msg)
+        else:
+            st.error(msg)
+    
+    # 1d. Camadas de risco
+    st.markdown('<div class="section-title">1d. Camadas de risco (opcional)</div>', unsafe_allow_html=True)
+    for camada_tipo, rotulo in (('alagamentos', "Alagamentos"), ('sinistros', "Sinistros")):
+        file_risco = st.file_uploader(rotulo, type=['xlsx', 'xls', 'csv'], key=f'file_{camada_tipo}',
+                                      help="Pontos (LATITUDE/LONGITUDE) ou logradouros ('RUA A' ou 'RUA A / RUA B'), "
+                                           "com QUANTIDADE e DATA opcionais")
+        if file_risco:
+            with medir_etapa(f'ingestao_{camada_tipo}') as etapa:
+                digest_risco = hash_arquivo(file_risco)
+                camada, msg = carregar_com_cache(file_risco, 'risco', carregar_camada_risco, digest_risco)
+                etapa['linhas'] = len(camada) if camada is not None else 0
+            if camada is not None:
+                st.session_state[f'camada_{camada_tipo}'] = camada
+                st.session_state[f'camada_{camada_tipo}_id'] = f"risco_{digest_risco}"
+                st.success(msg)
+            else:
+                st.error(msg)
+        else:
+            st.session_state[f'camada_{camada_tipo}'] = None
+            st.session_state[f'camada_{camada_tipo}_id'] = f'padrao_{camada_tipo}'
+    raio_risco = st.number_input("Raio de associação dos pontos de risco (m)", 5, 500, RAIO_RISCO_PADRAO, 5,
+                                 key='raio_risco')
     
     # 2. Cobertura
     st.markdown('<div class="section-title">2a. Alvo de Cobertura IPE</div>', unsafe_allow_html=True)
@@ -872,6 +1732,51 @@ with st.sidebar:
     else:
         max_cruzamentos = None
     
+    # 2c. Otimizador
+    st.markdown('<div class="section-title">2c. Otimizador</div>', unsafe_allow_html=True)
+    otimizador = st.selectbox("Motor de selecao", list(OTIMIZADORES), format_func=OTIMIZADORES.get, key='otimizador',
+                              help="Ganho marginal escolhe a cada passo o ponto que mais acrescenta IPE coberto, "
+                                   "evitando cameras redundantes em areas ja cobertas")
+    busca_local = st.checkbox("Refinar com busca local", value=False, key='busca_local',
+                              help="Remove cameras dispensaveis e troca pontos por vizinhos melhores apos a selecao")
+    tempo_busca_local = st.number_input("Tempo da busca (s)", min_value=0.5, max_value=30.0, value=2.0, step=0.5,
+                                        key='tempo_busca_local', disabled=not busca_local)
+    modo_exato = st.checkbox("Modo exato (MILP)", value=False, key='modo_exato', disabled=milp is None,
+                             help="Resolve o programa inteiro (HiGHS) a partir da selecao heuristica, ate o tempo "
+                                  "ou o gap definidos, e mostra a distancia da heuristica ao otimo"
+                                  + ("" if milp is not None else " (requer scipy)"))
+    if modo_exato:
+        col_tempo, col_gap = st.columns(2)
+        tempo_exato = col_tempo.number_input("Tempo (s)", min_value=5, max_value=600, value=30, step=5, key='tempo_exato')
+        gap_exato = col_gap.number_input("Gap (%)", min_value=0.0, max_value=20.0, value=1.0, step=0.5, key='gap_exato')
+    else:
+        tempo_exato = gap_exato = None
+    
+    # 2d. Orcamento e modelo de custo
+    st.markdown('<div class="section-title">2d. Orcamento (opcional)</div>', unsafe_allow_html=True)
+    usar_orcamento = st.checkbox("Limitar por orcamento", value=False, key='usar_orcamento',
+                                 help="Maximiza o IPE coberto sem ultrapassar o orcamento, pelo custo de cada ponto "
+                                      "(cameras do tipo sugerido x preco); o alvo de cobertura e ignorado e os dois "
+                                      "motores usam o mesmo guloso por ganho por real (ou ganho puro, se cobrir mais)")
+    if usar_orcamento:
+        orcamento = st.number_input("Orcamento (R$)", min_value=1000.0, max_value=1e9, value=1_000_000.0,
+                                    step=50_000.0, key='orcamento')
+    else:
+        orcamento = None
+    with st.expander("Modelo de custo"):
+        modelo_custo = st.radio("Cameras por ponto", list(MODELOS_CUSTO), format_func=MODELOS_CUSTO.get,
+                                key='modelo_custo', disabled=usar_orcamento)
+        precos_camera, cameras_por_tipo = {}, {}
+        for tipo in TIPOS_CAMERA:
+            col_preco, col_qtd = st.columns(2)
+            precos_camera[tipo] = col_preco.number_input(f"Preco {tipo} (R$)", min_value=1.0, max_value=1e6,
+                                                         value=PRECO_CAMERA_PADRAO, step=50.0, key=f'preco_{tipo}')
+            cameras_por_tipo[tipo] = col_qtd.number_input(f"Cameras {tipo}", min_value=1, max_value=8,
+                                                          value=CAMERAS_POR_TIPO_PADRAO[tipo], key=f'cameras_{tipo}')
+    # O orçamento só faz sentido com o custo de cada ponto
+    if usar_orcamento:
+        modelo_custo = 'tipo'
+    
     # 3. Distancia minima
     st.markdown('<div class="section-title">3a. Distancia minima entre câmeras</div>', unsafe_allow_html=True)
     dist_min = st.slider("Distancia (m)", 0, 1000, 150, step=50, key='dist_min', help="Distancia minima entre câmeras que compartilham o mesmo logradouro")
@@ -899,17 +1804,44 @@ with st.sidebar:
     peso_lct = st.slider("LCT", 0, 100, 20, key='peso_lct')
     peso_com = st.slider("Comercial", 0, 100, 15, key='peso_com')
     peso_mob = st.slider("Mobilidade", 0, 100, 15, key='peso_mob')
+    peso_alag = st.slider("Alagamento", 0, 100, 0, key='peso_alag',
+                          help="Ocorrências da camada de alagamentos associadas a cada cruzamento")
+    peso_sin = st.slider("Sinistros", 0, 100, 0, key='peso_sin',
+                         help="Ocorrências da camada de sinistros associadas a cada cruzamento")
+    peso_equip = st.slider("Equipamentos proximos", 0, 100, 0, key='peso_equip',
+                           help="Soma dos pesos dos equipamentos proximos ao cruzamento (SEG, LCT e COM)")
     
-    soma_pesos = peso_seg + peso_lct + peso_com + peso_mob or 1
+    soma_pesos = peso_seg + peso_lct + peso_com + peso_mob + peso_alag + peso_sin + peso_equip or 1
     w_seg, w_lct = peso_seg / soma_pesos, peso_lct / soma_pesos
     w_com, w_mob = peso_com / soma_pesos, peso_mob / soma_pesos
+    w_equip = peso_equip / soma_pesos
+    pesos_extra = {'alag': peso_alag / soma_pesos, 'sin': peso_sin / soma_pesos,
+                   **{f'eq_{eixo}': w_equip for eixo in EIXOS_EQUIPAMENTO}}
     
+    chips_risco = "".join(f'<span class="chip">{rotulo} {pesos_extra[eixo]*100:.0f}%</span>'
+                          for eixo, rotulo in (('alag', "Alag"), ('sin', "Sin"), ('eq_seg', "Equip"))
+                          if pesos_extra[eixo] > 0)
     st.markdown(f"""<div class="stat-box">
         <span class="chip">Seg {w_seg*100:.0f}%</span>
         <span class="chip">LCT {w_lct*100:.0f}%</span>
         <span class="chip">Com {w_com*100:.0f}%</span>
         <span class="chip">Mob {w_mob*100:.0f}%</span>
+        {chips_risco}
     </div>""", unsafe_allow_html=True)
+    
+    # 6. Mapa
+    st.markdown('<div class="section-title">6. Renderizacao do mapa</div>', unsafe_allow_html=True)
+    modo_mapa = st.selectbox("Modo", list(MODOS_MAPA), format_func=MODOS_MAPA.get, key='modo_mapa')
+    limite_agrupamento = st.number_input(
+        "Agrupar pontos acima de", min_value=100, max_value=100000, value=LIMITE_AGRUPAMENTO_PADRAO,
+        step=500, key='limite_agrupamento', disabled=modo_mapa != 'leve',
+        help="Acima desse numero de pontos por camada, os marcadores sao agrupados (cluster)"
+    )
+    zoom_bairros = st.select_slider(
+        "Detalhe das fronteiras", options=list(ZOOMS_BAIRROS), value=ZOOM_BAIRROS_PADRAO, key='zoom_bairros',
+        format_func=lambda z: f"zoom {z} (~{0.5 * metros_por_pixel(z):.0f} m)",
+        help="Fronteiras simplificadas no upload com tolerancia de meio pixel no zoom escolhido"
+    )
 
 
 # ============================================================
@@ -918,18 +1850,134 @@ with st.sidebar:
 cobertura_real = 0.0
 alvo_atingido = True
 motivo_limite = None
-ids_cobertos = set()
+ids_cobertos = np.zeros(0, dtype=np.int32)
+chave_selecao = None
+chave_exibida = None
+comparacao_otimizador = None
+pontos_antes_busca = None
+diagnostico_exato = None
+custos_orcamento = None
+cruzamentos_selecionados = pd.DataFrame()
 
 if not st.session_state.logs.empty and not st.session_state.cruzamentos.empty:
-    st.session_state.cruzamentos_calculados = calcular_ipe_cruzamentos(
-        st.session_state.logs, st.session_state.cruzamentos, w_seg, w_lct, w_com, w_mob
-    )
+    # IPE é linear nos pesos: a base por dataset fica em cache e só pesos novos disparam o recálculo.
+    # Eixos de risco só entram (e só são associados) quando têm peso; a associação fica em cache.
+    riscos_ativos = tuple(eixo for eixo in EIXOS_RISCO if pesos_extra[eixo] > 0)
+    chave_riscos = (st.session_state.dataset_id, riscos_ativos, raio_risco,
+                    st.session_state.camada_alagamentos_id, st.session_state.camada_sinistros_id)
+    equipamentos_ativos = w_equip > 0 and not st.session_state.equipamentos.empty
+    chave_equipamentos = (st.session_state.dataset_id, st.session_state.equipamentos_id, raio_equipamentos)
+    chave_ipe = (st.session_state.dataset_id, w_seg, w_lct, w_com, w_mob,
+                 tuple(pesos_extra[eixo] for eixo in riscos_ativos), chave_riscos if riscos_ativos else None,
+                 w_equip if equipamentos_ativos else 0, chave_equipamentos if equipamentos_ativos else None)
+    
+    def eixos_extra_ativos(base_ipe: dict) -> dict:
+        """Eixos extras com peso (risco e equipamentos) associados ao dataset (em cache)"""
+        eixos_extra = {}
+        if riscos_ativos:
+            camadas = {'alag': 'alagamentos', 'sin': 'sinistros'}
+            eixos_extra.update(obter_eixos_risco(
+                chave_riscos, base_ipe, {eixo: indice_risco(camadas[eixo]) for eixo in riscos_ativos}, raio_risco
+            ))
+        if equipamentos_ativos:
+            eixos_extra.update(obter_eixos_equipamentos(
+                chave_equipamentos, base_ipe, st.session_state.equipamentos, raio_equipamentos
+            ))
+        return eixos_extra
+    
+    if st.session_state.chave_ipe != chave_ipe:
+        with medir_etapa('calcular_ipe', len(st.session_state.cruzamentos)):
+            base_ipe = obter_base_ipe(st.session_state.logs, st.session_state.cruzamentos, st.session_state.dataset_id)
+            st.session_state.cruzamentos_calculados = calcular_ipe_base(
+                base_ipe, w_seg, w_lct, w_com, w_mob, eixos_extra_ativos(base_ipe), pesos_extra
+            )
+        st.session_state.chave_ipe = chave_ipe
+
+def grafos_selecao() -> dict:
+    """Vizinhanças de cobertura e de conflito: dependem só do dataset e dos raios (em cache)"""
+    with medir_etapa('grafos_vizinhanca', len(st.session_state.cruzamentos_calculados)):
+        base_ipe = obter_base_ipe(st.session_state.logs, st.session_state.cruzamentos, st.session_state.dataset_id)
+        return {
+            'cobertura': obter_grafo_vizinhanca(st.session_state.dataset_id, base_ipe['cruzamentos'], raio_cobertura, True),
+            'conflito': obter_grafo_vizinhanca(st.session_state.dataset_id, base_ipe['cruzamentos'], dist_min, False)
+                        if dist_min > 0 else None
+        }
+
+
+def selecionar_cruzamentos(otimizador: str):
+    """Etapa de seleção: grafos de vizinhança (em cache por dataset e raio) e otimizador escolhido"""
+    grafos = grafos_selecao()
+    with medir_etapa('filtrar_por_cobertura_e_distancia') as etapa:
+        # Sem limite por rua, alvo de cobertura e quantidade viram busca no prefixo da execução completa
+        trilha = None
+        if limite_cob_log is None and orcamento is None:
+            trilha = obter_trilha_selecao(
+                (st.session_state.chave_ipe, dist_min, raio_cobertura),
+                st.session_state.cruzamentos_calculados, dist_min, raio_cobertura, grafos, otimizador
+            )
+        resultado = otimizar_selecao(
+            st.session_state.cruzamentos_calculados, cobertura_pct / 100, dist_min, 
+            max_cruzamentos, raio_cobertura, limite_cob_log, grafos, trilha, otimizador, custos_orcamento, orcamento
+        )
+        etapa['linhas'] = len(resultado[0])
+    return resultado
+
+
+def refinar_selecao(resultado: tuple) -> tuple:
+    """Etapa de busca local sobre a seleção memorizada (mesmos grafos em cache)"""
+    grafos = grafos_selecao()
+    with medir_etapa('busca_local', len(resultado[0])):
+        return melhorar_selecao(
+            st.session_state.cruzamentos_calculados, resultado, cobertura_pct / 100, dist_min,
+            max_cruzamentos, raio_cobertura, limite_cob_log, grafos, tempo_busca_local, custos_orcamento, orcamento
+        )
+
+
+def resolver_selecao_exata(resultado: tuple) -> tuple:
+    """Etapa do modo exato: programa inteiro partindo da seleção heurística (mesmos grafos em cache)"""
+    grafos = grafos_selecao()
+    with medir_etapa('modo_exato', len(st.session_state.cruzamentos_calculados)):
+        return resolver_exato(
+            st.session_state.cruzamentos_calculados, resultado, cobertura_pct / 100, dist_min, max_cruzamentos,
+            raio_cobertura, limite_cob_log, grafos, custos_orcamento, orcamento, tempo_exato, gap_exato / 100
+        )
+
 
 if not st.session_state.cruzamentos_calculados.empty:
-    st.session_state.ultimo_selecionados, cobertura_real, alvo_atingido, motivo_limite, ids_cobertos = filtrar_por_cobertura_e_distancia(
-        st.session_state.cruzamentos_calculados, cobertura_pct / 100, dist_min, 
-        max_cruzamentos, raio_cobertura, limite_cob_log
-    )
+    # Dependências explícitas: mudar só equipamentos, mapa ou estatísticas não refaz a seleção
+    chave_orcamento = None
+    if orcamento is not None:
+        custos_orcamento = custo_por_ponto(
+            st.session_state.cruzamentos_calculados['camera_tipo'], precos_camera, cameras_por_tipo
+        )
+        chave_orcamento = (orcamento, tuple(precos_camera.values()), tuple(cameras_por_tipo.values()))
+    chave_selecao = (st.session_state.chave_ipe, cobertura_pct, max_cruzamentos, dist_min, raio_cobertura, limite_cob_log,
+                     chave_orcamento, otimizador)
+    resultado_selecao = etapa_memorizada('selecao', chave_selecao, lambda: selecionar_cruzamentos(otimizador))
+    # Busca local memorizada à parte: ligar/desligar não refaz a seleção
+    if busca_local:
+        pontos_antes_busca = len(resultado_selecao[0])
+        resultado_selecao = etapa_memorizada(
+            'busca_local', chave_selecao + (tempo_busca_local,), lambda: refinar_selecao(resultado_selecao)
+        )
+    if modo_exato:
+        resultado_selecao, diagnostico_exato = etapa_memorizada(
+            'modo_exato', chave_selecao + (busca_local and tempo_busca_local, tempo_exato, gap_exato),
+            lambda: resolver_selecao_exata(resultado_selecao)
+        )
+    st.session_state.selecao, cobertura_real, alvo_atingido, motivo_limite, ids_cobertos = resultado_selecao
+    # Etapas a jusante (exportação, alagamentos, sinistros) usam o conteúdo da seleção exibida, não os
+    # parâmetros: a busca local e o modo exato dependem do prazo e podem mudar a seleção com a mesma chave
+    chave_exibida = (st.session_state.chave_ipe, hashlib.sha256(
+        np.asarray(st.session_state.selecao, dtype=np.int64).tobytes()).hexdigest())
+    # Referência para o otimizador alternativo: o guloso por IPE com os mesmos parâmetros
+    if otimizador != 'ipe':
+        selecao_ipe, cobertura_ipe = etapa_memorizada(
+            'selecao_referencia', chave_selecao[:-1], lambda: selecionar_cruzamentos('ipe')[:2]
+        )
+        comparacao_otimizador = {'pontos': len(selecao_ipe), 'cobertura': cobertura_ipe}
+    # Linhas selecionadas montadas a cada rerun a partir das posições (não ficam no session state)
+    cruzamentos_selecionados = tabela_selecionados(st.session_state.cruzamentos_calculados, st.session_state.selecao)
 
 # ============================================================
 # AREA PRINCIPAL - MAPA E RESUMOS
@@ -937,7 +1985,8 @@ if not st.session_state.cruzamentos_calculados.empty:
 st.markdown('<h1 class="main-header">Otimizador do Videomonitoramento - Recife</h1>', unsafe_allow_html=True)
 
 # Alerta se cobertura alvo nao foi atingida
-if not st.session_state.cruzamentos_calculados.empty and not alvo_atingido and max_cruzamentos is None:
+if not st.session_state.cruzamentos_calculados.empty and not alvo_atingido and max_cruzamentos is None \
+        and orcamento is None:
     restricoes_ativas = []
     if dist_min > 0:
         restricoes_ativas.append(f"distancia minima de {dist_min}m")
@@ -955,13 +2004,18 @@ if not st.session_state.cruzamentos_calculados.empty and not alvo_atingido and m
 col_mapa, col_stats = st.columns([2, 1])
 
 with col_mapa:
-    mapa = criar_mapa(
-        st.session_state.ultimo_selecionados,
-        st.session_state.equipamentos,
-        nota_min_equip,
-        st.session_state.bairros_geojson
-    )
-    st_folium(mapa, width=None, height=520, returned_objects=[])
+    # O mapa base (tiles e fronteiras) gera o mesmo script entre reruns, então o componente não é remontado:
+    # as camadas vão em feature_group_to_add e o navegador só substitui as que mudaram de conteúdo.
+    # Os objetos folium são refeitos a cada rerun (reutilizá-los deixa ids antigos no script gerado).
+    with medir_etapa('criar_mapa', len(cruzamentos_selecionados) + len(st.session_state.equipamentos)):
+        mapa = criar_mapa_base(st.session_state.bairros_geojson, modo_mapa, zoom_bairros)
+        camada_cruz = criar_camada_cruzamentos(cruzamentos_selecionados, modo_mapa, int(limite_agrupamento))
+        camada_equip = criar_camada_equipamentos(
+            st.session_state.equipamentos, nota_min_equip, modo_mapa, int(limite_agrupamento)
+        )
+    with medir_etapa('st_folium'):
+        st_folium(mapa, key='mapa', width=None, height=520, returned_objects=[],
+                  feature_group_to_add=[camada_cruz, camada_equip])
 
 with col_stats:
     # ============================================================
@@ -969,7 +2023,7 @@ with col_stats:
     # ============================================================
     if not st.session_state.cruzamentos_calculados.empty:
         df_calc = st.session_state.cruzamentos_calculados
-        df_sel = st.session_state.ultimo_selecionados
+        df_sel = cruzamentos_selecionados
         
         total_cruz = len(df_calc)
         total_sel = len(df_sel)
@@ -981,7 +2035,7 @@ with col_stats:
         t_com = df_calc['ipe_cruz_com'].sum() or 1
         t_mob = df_calc['ipe_cruz_mob'].sum() or 1
         
-        if ids_cobertos:
+        if len(ids_cobertos):
             df_cobertos = df_calc[df_calc['id'].isin(ids_cobertos)]
             cov_seg = df_cobertos['ipe_cruz_seg'].sum() / t_seg * 100
             cov_lct = df_cobertos['ipe_cruz_lct'].sum() / t_lct * 100
@@ -990,22 +2044,36 @@ with col_stats:
         else:
             cov_seg = cov_lct = cov_com = cov_mob = 0
         
+        # Eixos do cruzamento com peso (risco etc.) entram como linhas extras
+        html_eixos_extra = ""
+        for eixo, rotulo in ROTULOS_EIXOS_EXTRA.items():
+            t_extra = df_calc[f'ipe_cruz_{eixo}'].sum() if f'ipe_cruz_{eixo}' in df_calc else 0
+            if t_extra > 0:
+                cov_extra = df_cobertos[f'ipe_cruz_{eixo}'].sum() / t_extra * 100 if len(ids_cobertos) else 0
+                html_eixos_extra += f'<div class="stat-row"><span>{rotulo}:</span><span class="stat-value">{cov_extra:.1f}%</span></div>'
+        
         # ============================================================
-        # CÁLCULO DE CUSTO (Lógica 50/30/20)
+        # CÁLCULO DE CUSTO (por tipo de câmera ou Lógica 50/30/20)
         # ============================================================
-        
-        # Definição das quantidades de pontos por categoria
-        qtd_pontos_3cam = int(total_cobertos * 0.50)
-        qtd_pontos_2cam = int(total_cobertos * 0.30)
-        # O restante vai para 1 câmera para garantir que a soma bata com o total exato
-        qtd_pontos_1cam = total_cobertos - qtd_pontos_3cam - qtd_pontos_2cam
-
-        # Cálculo do total de câmeras físicas
-        total_cameras_fisicas = (qtd_pontos_3cam * 3) + (qtd_pontos_2cam * 2) + (qtd_pontos_1cam * 1)
-        
-        # Cálculo financeiro
-        custo_unitario = 838
-        custo_total_geral = total_cameras_fisicas * custo_unitario
+        tipos_selecionados = df_sel['camera_tipo'] if total_sel else pd.Series([], dtype=object)
+        if modelo_custo == 'tipo':
+            # Cada ponto com câmera recebe as câmeras físicas do seu tipo sugerido
+            quantitativo = quantitativo_por_tipo(tipos_selecionados, precos_camera, cameras_por_tipo)
+            total_cameras_fisicas = int(quantitativo['cameras'].sum())
+            custo_total_geral = float(quantitativo['custo'].sum())
+        else:
+            # Definição das quantidades de pontos por categoria
+            qtd_pontos_3cam, qtd_pontos_2cam, qtd_pontos_1cam = pontos_regra_50_30_20(total_cobertos)
+
+            # Cálculo do total de câmeras físicas
+            total_cameras_fisicas = (qtd_pontos_3cam * 3) + (qtd_pontos_2cam * 2) + (qtd_pontos_1cam * 1)
+            
+            # Cálculo financeiro: preço médio dos tipos sugeridos nos pontos com câmera
+            custo_unitario = PRECO_CAMERA_PADRAO
+            if total_sel:
+                custo_unitario = custo_por_ponto(tipos_selecionados, precos_camera,
+                                                 dict.fromkeys(TIPOS_CAMERA, 1)).mean()
+            custo_total_geral = total_cameras_fisicas * custo_unitario
 
         # ============================================================
         # EXIBIÇÃO - Pontos Monitorados
@@ -1025,6 +2093,53 @@ with col_stats:
             </div>
             <div class="stat-row"><span>Raio de cobertura:</span><span class="stat-value">{raio_cobertura}m</span></div>"""
         
+        if comparacao_otimizador is not None:
+            diferenca = comparacao_otimizador['pontos'] - total_sel
+            texto_diferenca = f"{diferenca:,} a menos" if diferenca >= 0 else f"{-diferenca:,} a mais"
+            stats_html += f"""
+            <div class="stat-row"><span>Pontos com camera:</span><span class="stat-value">{total_sel:,}</span></div>
+            <div class="stat-row" style="font-size: 0.75rem; color: #94a3b8;">
+                <span>Guloso por IPE: {comparacao_otimizador['pontos']:,} pts ({comparacao_otimizador['cobertura']*100:.1f}%)</span>
+                <span class="stat-value" style="color: {'#4ade80' if diferenca >= 0 else '#fbbf24'};">{texto_diferenca}</span>
+            </div>"""
+        
+        if pontos_antes_busca is not None:
+            economia = pontos_antes_busca - total_sel
+            stats_html += f"""
+            <div class="stat-row" style="font-size: 0.75rem; color: #94a3b8;">
+                <span>Busca local: {pontos_antes_busca:,} → {total_sel:,} pts</span>
+                <span class="stat-value" style="color: #4ade80;">{f'-{economia:,}' if economia > 0 else '='}</span>
+            </div>"""
+        
+        if diagnostico_exato is not None and diagnostico_exato['limitante'] is not None:
+            # Distância da heurística ao ótimo, medida pelo limitante do resolvedor
+            heuristica, limitante = diagnostico_exato['heuristica'], diagnostico_exato['limitante']
+            if diagnostico_exato['modo'] == 'cameras':
+                distancia = (heuristica - limitante) / heuristica if heuristica else 0.0
+                texto_limitante = f"ótimo ≥ {math.ceil(limitante - 1e-6):,} pts"
+            else:
+                distancia = (limitante - heuristica) / limitante if limitante > 0 else 0.0
+                texto_limitante = f"ótimo ≤ {limitante*100:.1f}%"
+            situacao = "tempo esgotado"
+            if diagnostico_exato['status'] == 0:
+                situacao = "ótimo" if not diagnostico_exato['gap'] else f"gap {diagnostico_exato['gap']*100:.1f}%"
+            # Heurística fora do alvo ou do modelo (limite por rua): o limitante não mede a distância dela
+            comparacao = diagnostico_exato['sem_comparacao']
+            cor_comparacao = '#fbbf24'
+            if comparacao is None:
+                comparacao = f"heurística a ≤{max(distancia, 0)*100:.1f}%"
+                cor_comparacao = '#4ade80' if distancia <= 0.01 else '#fbbf24'
+            stats_html += f"""
+            <div class="stat-row" style="font-size: 0.75rem; color: #94a3b8;">
+                <span>Modo exato ({situacao}, {diagnostico_exato['tempo']:.0f}s): {texto_limitante}</span>
+                <span class="stat-value" style="color: {cor_comparacao};">{comparacao}</span>
+            </div>"""
+        elif diagnostico_exato is not None:
+            stats_html += f"""
+            <div class="stat-row" style="font-size: 0.75rem; color: #fbbf24;">
+                <span>Modo exato sem solução: {diagnostico_exato['mensagem'][:60]}</span>
+            </div>"""
+        
         if limite_cob_log is not None:
             stats_html += f"""
             <div class="stat-row"><span>Limite por logradouro:</span><span class="stat-value">{limite_cob_log*100:.0f}%</span></div>"""
@@ -1041,6 +2156,7 @@ with col_stats:
             <div class="stat-row"><span>LCT:</span><span class="stat-value">{cov_lct:.1f}%</span></div>
             <div class="stat-row"><span>Comercial:</span><span class="stat-value">{cov_com:.1f}%</span></div>
             <div class="stat-row"><span>Mobilidade:</span><span class="stat-value">{cov_mob:.1f}%</span></div>
+            {html_eixos_extra}
         </div>""", unsafe_allow_html=True)
 
         # ============================================================
@@ -1051,9 +2167,19 @@ with col_stats:
         # Formatando valor para moeda BRL
         custo_formatado = f"R$ {custo_total_geral:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
         
-        html_custos = f"""
-        <div class="stat-box">
-            <div class="stat-row" style="font-size: 0.75rem; color: #94a3b8; margin-bottom: 5px;">
+        if modelo_custo == 'tipo':
+            html_distribuicao = """<div class="stat-row" style="font-size: 0.75rem; color: #94a3b8; margin-bottom: 5px;">
+                Câmeras por tipo sugerido do ponto:
+            </div>"""
+            for tipo, linha in quantitativo.iterrows():
+                html_distribuicao += f"""
+            <div class="stat-row">
+                <span>{tipo} ({int(linha['pontos'])} pts x {cameras_por_tipo[tipo]}):</span>
+                <span class="stat-value">{int(linha['cameras'])} cams</span>
+            </div>"""
+            html_base = "Base: preço e câmeras por tipo (Modelo de custo)"
+        else:
+            html_distribuicao = f"""<div class="stat-row" style="font-size: 0.75rem; color: #94a3b8; margin-bottom: 5px;">
                 Distribuição Estimada (Regra 50-30-20):
             </div>
             <div class="stat-row">
@@ -1067,7 +2193,21 @@ with col_stats:
             <div class="stat-row">
                 <span>1 Câmera ({qtd_pontos_1cam} pts):</span>
                 <span class="stat-value">{qtd_pontos_1cam * 1} cams</span>
-            </div>
+            </div>"""
+            html_base = f"Base: Custo unitário de {custo_unitario:,.0f}"
+        
+        html_orcamento = ""
+        if orcamento is not None:
+            orcamento_formatado = f"R$ {orcamento:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+            html_orcamento = f"""
+            <div class="stat-row">
+                <span>Orçamento ({custo_total_geral / orcamento * 100:.1f}% usado):</span>
+                <span class="stat-value">{orcamento_formatado}</span>
+            </div>"""
+        
+        html_custos = f"""
+        <div class="stat-box">
+            {html_distribuicao}
             <div class="stat-row" style="border-top: 1px solid rgba(255,255,255,0.1); margin-top: 5px; padding-top: 5px;">
                 <span><b>Total de Câmeras:</b></span>
                 <span class="stat-value" style="color: #60a5fa;">{total_cameras_fisicas:,}</span>
@@ -1075,17 +2215,23 @@ with col_stats:
             <div class="stat-row" style="margin-top: 5px; font-size: 1rem;">
                 <span><b>Custo Total:</b></span>
                 <span class="stat-value" style="color: #4ade80;">{custo_formatado}</span>
-            </div>
+            </div>{html_orcamento}
              <div class="stat-row" style="font-size: 0.7rem; color: #64748b;">
-                Base: Custo unitário de {custo_unitario}
+                {html_base}
             </div>
         </div>
         """
         st.markdown(html_custos, unsafe_allow_html=True)
 
         # Download
-        csv_data = gerar_csv_download(df_calc, df_sel)
-        st.download_button("📥 Baixar CSV", csv_data, "ipe_cruzamentos.csv", "text/csv", use_container_width=True)
+        # Download: o arquivo só é gerado no clique (em outra thread) e fica em cache por seleção e formato
+        formato = st.radio("Formato", list(FORMATOS_EXPORTACAO), horizontal=True, key='formato_exportacao',
+                           label_visibility='collapsed')
+        nome_arquivo, mime, _ = FORMATOS_EXPORTACAO[formato]
+        st.download_button(
+            f"📥 Baixar {formato}", lambda: obter_exportacao(chave_exibida, formato, df_calc, df_sel),
+            nome_arquivo, mime, on_click='ignore', use_container_width=True
+        )
     else:
         st.info("👆 Carregue o Excel de cruzamentos na sidebar para iniciar.")
 
@@ -1100,19 +2246,13 @@ col_equip, col_alag, col_sinist = st.columns(3)
 # Coluna 1: Equipamentos (Dividido em LCT/SEG e COMERCIAL)
 with col_equip:
     if not st.session_state.equipamentos.empty:
-        # Preparação dos dados: filtrar por EIXO
-        df_full = st.session_state.equipamentos
-        
-        # Normaliza para garantir que a comparação funcione (maiusculo e sem espaços)
-        df_full['eixo_norm'] = df_full['eixo'].astype(str).str.strip().str.upper()
-        
-        # Separa os DataFrames
-        df_lct_seg = df_full[df_full['eixo_norm'].isin(['LCT', 'SEG'])].copy()
-        df_comercial = df_full[df_full['eixo_norm'] == 'COM'].copy()
-        
-        # Gera estatísticas para ambos ANTES de renderizar, para ter o Total Geral
-        stats_main = gerar_estatisticas_equipamentos(df_lct_seg, nota_min_equip)
-        stats_com = gerar_estatisticas_equipamentos(df_comercial, nota_min_equip)
+        # Estatísticas por grupo de eixo (LCT/SEG e COM) ANTES de renderizar, para ter o Total Geral.
+        # Eixo e categorias já vêm normalizados da carga; cada nota mínima é uma consulta em cache.
+        with medir_etapa('estatisticas_equipamentos', len(st.session_state.equipamentos)):
+            estatisticas = obter_estatisticas_equipamentos(
+                st.session_state.equipamentos_id, st.session_state.equipamentos, nota_min_equip
+            )
+        stats_main, stats_com = estatisticas['main'], estatisticas['com']
         
         # Totais absolutos
         total_main = stats_main['total'] if stats_main else 0
@@ -1176,13 +2316,19 @@ with col_equip:
 # Coluna 2: Alagamentos
 with col_alag:
     if not st.session_state.cruzamentos_calculados.empty:
-        df_sel = st.session_state.ultimo_selecionados
-        alagamentos_encontrados = verificar_alagamentos(df_sel)
+        df_sel = cruzamentos_selecionados
+        def alagamentos_da_selecao():
+            with medir_etapa('verificar_alagamentos', len(df_sel)):
+                return verificar_riscos(df_sel, indice_risco('alagamentos'), raio_risco)
+        riscos_alag = etapa_memorizada(
+            'alagamentos', (chave_exibida, st.session_state.camada_alagamentos_id, raio_risco), alagamentos_da_selecao
+        )
+        alagamentos_encontrados = riscos_alag['rotulos']
         
-        # Cálculo da porcentagem em relação ao TOTAL de alvos possíveis
-        total_alvos_alagamento = len(ALAGAMENTOS_ALVO)
-        qtd_alag = len(alagamentos_encontrados)
-        pct_alag = (qtd_alag / total_alvos_alagamento * 100) if total_alvos_alagamento > 0 else 0
+        # Porcentagem sobre o TOTAL de ocorrências da camada (cada alvo das listas padrão vale 1)
+        total_alvos_alagamento = riscos_alag['total']
+        qtd_alag = riscos_alag['atingidos']
+        pct_alag = riscos_alag['fracao'] * 100
         
         html_alagamentos = ""
         if alagamentos_encontrados:
@@ -1197,7 +2343,7 @@ with col_alag:
                 <span><b>Cobertura de Alagamentos:</b></span><span class="stat-value">{qtd_alag} ({pct_alag:.1f}%)</span>
             </div>
             <div style="font-size: 0.7rem; color: #64748b; margin-bottom: 5px;">
-                Calculado sobre {total_alvos_alagamento} pontos mapeados.
+                Calculado sobre {total_alvos_alagamento} registros mapeados.
             </div>
             <div style="max-height: 200px; overflow-y: auto; padding-right: 5px; font-size: 0.75rem;">
                 {html_alagamentos}
@@ -1212,13 +2358,19 @@ with col_alag:
 # Coluna 3: Sinistros
 with col_sinist:
     if not st.session_state.cruzamentos_calculados.empty:
-        df_sel = st.session_state.ultimo_selecionados
-        sinistros_encontrados = verificar_sinistros(df_sel)
+        df_sel = cruzamentos_selecionados
+        def sinistros_da_selecao():
+            with medir_etapa('verificar_sinistros', len(df_sel)):
+                return verificar_riscos(df_sel, indice_risco('sinistros'), raio_risco)
+        riscos_sinist = etapa_memorizada(
+            'sinistros', (chave_exibida, st.session_state.camada_sinistros_id, raio_risco), sinistros_da_selecao
+        )
+        sinistros_encontrados = sorted(riscos_sinist['rotulos'])
         
-        # Cálculo da porcentagem em relação ao TOTAL de ruas alvo (usando set para garantir unicidade)
-        total_ruas_sinistros = len(set([x.strip().upper() for x in RUAS_SINISTROS_ALVO]))
-        qtd_sinist = len(sinistros_encontrados)
-        pct_sinist = (qtd_sinist / total_ruas_sinistros * 100) if total_ruas_sinistros > 0 else 0
+        # Porcentagem sobre o TOTAL de ocorrências da camada (ruas da lista padrão já sem repetição)
+        total_ruas_sinistros = riscos_sinist['total']
+        qtd_sinist = riscos_sinist['atingidos']
+        pct_sinist = riscos_sinist['fracao'] * 100
         
         html_sinistros = ""
         if sinistros_encontrados:
@@ -1233,7 +2385,7 @@ with col_sinist:
                 <span><b>Cobertura de Sinistros:</b></span><span class="stat-value">{qtd_sinist} ({pct_sinist:.1f}%)</span>
             </div>
             <div style="font-size: 0.7rem; color: #64748b; margin-bottom: 5px;">
-                Calculado sobre {total_ruas_sinistros} ruas mapeadas.
+                Calculado sobre {total_ruas_sinistros} registros mapeados.
             </div>
             <div style="max-height: 200px; overflow-y: auto; padding-right: 5px; font-size: 0.75rem;">
                 {html_sinistros}
@@ -1244,3 +2396,115 @@ with col_sinist:
         st.markdown("""<div class="stat-box">
             <div class="stat-row"><span>Carregue os dados para visualizar.</span></div>
         </div>""", unsafe_allow_html=True)
+
+# ============================================================
+# CENÁRIOS - GRADE DE PARÂMETROS EM PARALELO
+# ============================================================
+LIMITE_CENARIOS = 200
+
+
+def contexto_cenarios(faixas: dict) -> dict:
+    """Dataset, base do IPE e grafos de todas as distâncias/raios da grade, montados uma vez por varredura"""
+    base_ipe = obter_base_ipe(st.session_state.logs, st.session_state.cruzamentos, st.session_state.dataset_id)
+    grafos = {}
+    for raio in faixas['raio_cobertura']:
+        grafos[('cobertura', raio)] = obter_grafo_vizinhanca(
+            st.session_state.dataset_id, base_ipe['cruzamentos'], raio, True
+        )
+    for dist in faixas['dist_min']:
+        if dist > 0:
+            grafos[('conflito', dist)] = obter_grafo_vizinhanca(
+                st.session_state.dataset_id, base_ipe['cruzamentos'], dist, False
+            )
+    return {
+        'base': base_ipe, 'eixos_extra': eixos_extra_ativos(base_ipe), 'grafos': grafos,
+        'pesos': {'seg': w_seg, 'lct': w_lct, 'com': w_com, 'mob': w_mob, **pesos_extra},
+        'indices': {camada: indice_risco(camada) for camada in ('alagamentos', 'sinistros')},
+        'parametros': parametros_fixos_cenarios,
+    }
+
+
+if not st.session_state.cruzamentos_calculados.empty:
+    # Parâmetros fora da grade: os atuais da barra lateral
+    parametros_fixos_cenarios = {
+        'cobertura_pct': cobertura_pct, 'max_cruzamentos': max_cruzamentos, 'limite_cob_log': limite_cob_log,
+        'otimizador': otimizador, 'orcamento': orcamento, 'modelo_custo': modelo_custo, 'precos': precos_camera,
+        'cameras_por_tipo': cameras_por_tipo, 'raio_risco': raio_risco,
+        'tempo_busca_local': tempo_busca_local if busca_local else None,
+        'tempo_exato': tempo_exato if modo_exato else None, 'gap_exato': gap_exato if modo_exato else None,
+    }
+    chave_cenarios = (st.session_state.chave_ipe, tuple(
+        tuple(v.items()) if isinstance(v, dict) else v for v in parametros_fixos_cenarios.values()
+    ))
+    with st.expander("🧪 Cenários: comparar combinações de parâmetros", expanded=st.session_state.cenarios is not None):
+        st.caption("Listas separadas por virgula ou intervalos inicio-fim:passo. Os demais parametros sao os da "
+                   "barra lateral, inclusive busca local e modo exato (quando ligados, rodam em cada combinacao); "
+                   f"as combinacoes rodam em paralelo num pool de {PROCESSOS_CENARIOS} processo(s) do servidor, "
+                   f"com prazo de {prazo_cenario(parametros_fixos_cenarios):.0f}s cada.")
+        col_dist, col_raio, col_seg, col_proc = st.columns(4)
+        faixa_dist = col_dist.text_input(PARAMETROS_CENARIO['dist_min'], "100, 150, 200", key='cenarios_dist')
+        faixa_raio = col_raio.text_input(PARAMETROS_CENARIO['raio_cobertura'], "40, 50, 80", key='cenarios_raio')
+        faixa_seg = col_seg.text_input(PARAMETROS_CENARIO['peso_seg'], "40-70:15", key='cenarios_seg')
+        processos = col_proc.number_input("Processos", min_value=1, max_value=PROCESSOS_CENARIOS,
+                                          value=PROCESSOS_CENARIOS, key='cenarios_processos')
+        
+        if st.button("Rodar cenarios", key='rodar_cenarios'):
+            try:
+                faixas = {'dist_min': interpretar_faixa(faixa_dist), 'raio_cobertura': interpretar_faixa(faixa_raio),
+                          'peso_seg': interpretar_faixa(faixa_seg)}
+            except ValueError:
+                faixas = None
+                st.error("Faixa invalida: use numeros separados por virgula ou inicio-fim:passo.")
+            if faixas is not None:
+                cenarios = grade_cenarios(faixas)
+                if not cenarios:
+                    st.warning("Informe ao menos um valor em cada faixa.")
+                elif len(cenarios) > LIMITE_CENARIOS:
+                    st.warning(f"{len(cenarios)} combinacoes; o limite e {LIMITE_CENARIOS}.")
+                elif min(min(valores) for valores in faixas.values()) < 0 or max(faixas['peso_seg']) > 100:
+                    st.warning("Use valores nao negativos e peso de Seguranca ate 100%.")
+                else:
+                    with medir_etapa('cenarios', len(cenarios)), st.spinner(f"Rodando {len(cenarios)} cenarios..."):
+                        tabela = pd.DataFrame(executar_cenarios(contexto_cenarios(faixas), cenarios, int(processos)))
+                    st.session_state.cenarios = {'chave': chave_cenarios, 'tabela': tabela}
+        
+        if st.session_state.cenarios is not None:
+            if st.session_state.cenarios['chave'] != chave_cenarios:
+                st.caption("⚠️ Parametros da barra lateral mudaram desde a ultima varredura.")
+            tabela = st.session_state.cenarios['tabela']
+            sem_resultado = int(tabela["Pontos"].isna().sum()) if "Pontos" in tabela else len(tabela)
+            if sem_resultado:
+                st.caption(f"⚠️ {sem_resultado} cenario(s) ficaram sem resultado (prazo esgotado ou falha).")
+            st.dataframe(st.session_state.cenarios['tabela'], hide_index=True, use_container_width=True,
+                         column_config={"Custo (R$)": st.column_config.NumberColumn(format="%.2f")})
+
+# ============================================================
+# PAINEL DE DESEMPENHO (sidebar, opcional)
+# ============================================================
+parametros_rerun = {
+    'cobertura_pct': cobertura_pct, 'max_cruzamentos': max_cruzamentos, 'dist_min': dist_min,
+    'raio_cobertura': raio_cobertura, 'limite_cob_log': limite_cob_log, 'nota_min_equip': nota_min_equip,
+    'peso_seg': peso_seg, 'peso_lct': peso_lct, 'peso_com': peso_com, 'peso_mob': peso_mob,
+    'peso_alag': peso_alag, 'peso_sin': peso_sin, 'raio_risco': raio_risco,
+    'peso_equip': peso_equip, 'raio_equipamentos': raio_equipamentos, 'otimizador': otimizador,
+    'busca_local': busca_local, 'tempo_busca_local': tempo_busca_local,
+    'orcamento': orcamento, 'modelo_custo': modelo_custo, 'modo_exato': modo_exato,
+    'modo_mapa': modo_mapa, 'limite_agrupamento': int(limite_agrupamento), 'zoom_bairros': zoom_bairros,
+    'cruzamentos': len(st.session_state.cruzamentos)
+}
+
+with st.sidebar:
+    with st.expander("⏱️ Desempenho", expanded=PERFIL_ATIVO):
+        st.checkbox("Medir etapas (tempo, linhas, memória)", value=False, key='perfil_ativo',
+                    help=f"Grava uma linha JSON por rerun em {PERFIL_LOG.name}. O pico de memória só é medido "
+                         "com o servidor iniciado com COP_PERFIL_MEMORIA=1.")
+        if PERFIL_ATIVO and ETAPAS_RERUN:
+            df_etapas = pd.DataFrame(ETAPAS_RERUN).rename(columns={
+                'etapa': 'Etapa', 'tempo_ms': 'Tempo (ms)', 'linhas': 'Linhas', 'pico_mb': 'Pico (MB)'
+            })
+            st.dataframe(df_etapas, hide_index=True, use_container_width=True)
+            st.caption(f"Total medido: {sum(e['tempo_ms'] for e in ETAPAS_RERUN):,.1f} ms")
+
+if PERFIL_ATIVO:
+    registrar_perfil_rerun(parametros_rerun, st.session_state.get('parametros_rerun_anterior', {}))
+st.session_state.parametros_rerun_anterior = parametros_rerun
@@ -0,0 +1,1558 @@
+"""
+Núcleo de cálculo do simulador de IPE por cruzamento (sem Streamlit)
+
+Distâncias, tipos de câmera e custo, normalização de logradouros, associação de riscos, IPE,
+seleção de cruzamentos (guloso, CELF, busca local e modo exato) e varredura de cenários.
+Fica fora de app.py para ser importável pelos processos da varredura, que não herdam o script.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+import heapq
+import itertools
+import math
+import mmap
+import multiprocessing
+import os
+import pickle
+import re
+import signal
+import tempfile
+import threading
+import time
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+try:
+    from scipy import sparse
+    from scipy.optimize import Bounds, LinearConstraint, milp
+except ImportError:  # modo exato (resolver_exato) é opcional
+    milp = None
+
+# ============================================================
+# CONSTANTES
+# ============================================================
+# Eixos do IPE e câmera sugerida quando o eixo predomina (mesma ordem)
+EIXOS = ['seg', 'lct', 'com', 'mob']
+TIPOS_CAMERA = ['PTZ', '360', 'FIXA', 'LPR']
+# Modelo de custo: câmeras físicas por ponto conforme o tipo sugerido e preço unitário padrão (R$)
+CAMERAS_POR_TIPO_PADRAO = {'PTZ': 1, '360': 1, 'FIXA': 3, 'LPR': 2}
+PRECO_CAMERA_PADRAO = 838.0
+
+# Raio médio da Terra (m) e comprimento de um grau de meridiano
+RAIO_TERRA_M = 6371000
+METROS_POR_GRAU = RAIO_TERRA_M * math.pi / 180
+LAT_REF_RECIFE = -8.05
+
+# Raio padrão (m) de associação das camadas de risco aos cruzamentos
+RAIO_RISCO_PADRAO = 50
+
+
+# ============================================================
+# DISTÂNCIAS - HAVERSINE E PROJEÇÃO LOCAL EM METROS
+# ============================================================
+# Tudo acontece dentro de Recife: uma projeção equiretangular feita uma vez permite comparar
+# distâncias no plano. erro_relativo_projecao dá o limite do erro contra distancia_metros, e
+# classificar_distancias só recorre ao haversine para pares na faixa de incerteza desse limite.
+
+def distancia_metros(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Calcula distância geodésica em metros usando fórmula de Haversine"""
+    R = RAIO_TERRA_M
+    to_rad = math.pi / 180
+    d_lat = (lat2 - lat1) * to_rad
+    d_lon = (lon2 - lon1) * to_rad
+    a = (math.sin(d_lat / 2) ** 2 +
+         math.cos(lat1 * to_rad) * math.cos(lat2 * to_rad) *
+         math.sin(d_lon / 2) ** 2)
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+def distancia_metros_vetor(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Haversine vetorizado (mesma fórmula de distancia_metros) sobre arrays NumPy.
+    
+    Aceita broadcasting: um ponto contra muitos (escalares + arrays) ou pares elemento a elemento.
+    """
+    to_rad = np.pi / 180
+    lat1, lon1 = np.asarray(lat1, dtype=float), np.asarray(lon1, dtype=float)
+    lat2, lon2 = np.asarray(lat2, dtype=float), np.asarray(lon2, dtype=float)
+    d_lat = (lat2 - lat1) * to_rad
+    d_lon = (lon2 - lon1) * to_rad
+    a = (np.sin(d_lat / 2) ** 2 +
+         np.cos(lat1 * to_rad) * np.cos(lat2 * to_rad) *
+         np.sin(d_lon / 2) ** 2)
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return RAIO_TERRA_M * c
+
+
+def coordenadas_validas(lat, lon) -> np.ndarray:
+    """Máscara de coordenadas georreferenciadas (0 ou NaN indicam coordenada ausente na planilha)"""
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    return (lat != 0) & (lon != 0) & np.isfinite(lat) & np.isfinite(lon)
+
+
+def latitude_referencia(lat, lon) -> float:
+    """Latitude de referência da projeção: mediana dos pontos válidos (centro de Recife se não houver)"""
+    validas = coordenadas_validas(lat, lon)
+    return float(np.median(np.asarray(lat, dtype=float)[validas])) if validas.any() else LAT_REF_RECIFE
+
+
+def projetar_metros(lat, lon, lat_ref: float = LAT_REF_RECIFE) -> tuple:
+    """Projeção equiretangular local: (x, y) em metros, x para leste e y para norte"""
+    escala_x = METROS_POR_GRAU * math.cos(math.radians(lat_ref))
+    return np.asarray(lon, dtype=float) * escala_x, np.asarray(lat, dtype=float) * METROS_POR_GRAU
+
+
+def erro_relativo_projecao(lat_min: float, lat_max: float, lat_ref: float) -> float:
+    """
+    Limite superior de |d_plana - d_haversine| / d_haversine para pontos com latitude em [lat_min, lat_max]
+    e distâncias de até ~10 km.
+    
+    A projeção usa cos(lat_ref) como escala leste-oeste, enquanto a distância real usa o cosseno da
+    latitude dos pontos: o erro relativo é no máximo max|cos(lat_ref)/cos(lat) - 1| na faixa, mais uma
+    folga para a curvatura (ordem de (d/R)², desprezível em escala urbana).
+    """
+    cossenos = [math.cos(math.radians(lat_min)), math.cos(math.radians(lat_max))]
+    if lat_min <= 0 <= lat_max:
+        cossenos.append(1.0)
+    cos_ref = math.cos(math.radians(lat_ref))
+    return max(abs(cos_ref / c - 1) for c in cossenos) + 1e-6
+
+
+def construir_indice_grade(x: np.ndarray, y: np.ndarray, celula: float) -> dict:
+    """
+    Índice espacial em grade regular sobre coordenadas projetadas (m).
+    
+    Os pontos ficam ordenados pela chave da célula; consultas com raio <= celula olham só as 9
+    células vizinhas, por busca binária, sem comparar todos contra todos.
+    """
+    celula = max(float(celula), 1.0)
+    chaves = (np.floor(np.asarray(x) / celula).astype(np.int64) << 32) + np.floor(np.asarray(y) / celula).astype(np.int64)
+    ordem = np.argsort(chaves, kind='stable')
+    return {'celula': celula, 'ordem': ordem, 'chaves': chaves[ordem]}
+
+
+def consultar_indice_grade(indice: dict, x: np.ndarray, y: np.ndarray) -> tuple:
+    """Pares candidatos (i da consulta, j do índice) nas 9 células em torno de cada ponto consultado"""
+    cx = np.floor(np.asarray(x) / indice['celula']).astype(np.int64)
+    cy = np.floor(np.asarray(y) / indice['celula']).astype(np.int64)
+    consultas = np.arange(len(cx))
+    blocos_i, blocos_j = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            chave = ((cx + dx) << 32) + (cy + dy)
+            inicio = np.searchsorted(indice['chaves'], chave, 'left')
+            n = np.searchsorted(indice['chaves'], chave, 'right') - inicio
+            if not n.any():
+                continue
+            deslocamento = np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+            blocos_i.append(np.repeat(consultas, n))
+            blocos_j.append(indice['ordem'][np.repeat(inicio, n) + deslocamento])
+    if not blocos_i:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(blocos_i), np.concatenate(blocos_j)
+
+
+def classificar_distancias(x, y, lat, lon, i: np.ndarray, j: np.ndarray, raio: float,
+                           erro: float, confiavel: np.ndarray, inclusivo: bool = True) -> np.ndarray:
+    """
+    Máscara dos pares (i, j) a até `raio` metros (<= se inclusivo, < caso contrário), idêntica ao haversine.
+    
+    Pares com distância plana fora da faixa [raio·(1-erro), raio·(1+erro)] são decididos pela projeção;
+    os da faixa e os que envolvem pontos não confiáveis (sem coordenada válida) usam haversine.
+    """
+    d2 = (x[i] - x[j]) ** 2 + (y[i] - y[j]) ** 2
+    dentro = d2 < (raio * (1 - erro)) ** 2
+    duvida = ~dentro & (d2 <= (raio * (1 + erro)) ** 2)
+    duvida |= ~(confiavel[i] & confiavel[j])
+    if duvida.any():
+        d = distancia_metros_vetor(lat[i[duvida]], lon[i[duvida]], lat[j[duvida]], lon[j[duvida]])
+        dentro[duvida] = d <= raio if inclusivo else d < raio
+    return dentro
+
+
+# ============================================================
+# TIPOS DE CÂMERA E CUSTO
+# ============================================================
+
+def sugerir_tipo_camera(eixos: np.ndarray) -> np.ndarray:
+    """Sugere tipo de câmera pelo eixo predominante de cada linha da matriz (N×4, ordem de EIXOS)"""
+    tipos = np.array(TIPOS_CAMERA, dtype=object)
+    if len(eixos) == 0:
+        return tipos[:0]
+    predominante = eixos.argmax(axis=1)
+    return np.where(eixos.max(axis=1) > 0, tipos[predominante], "FIXA")
+
+
+def custo_por_ponto(camera_tipo, precos: dict, cameras_por_tipo: dict) -> np.ndarray:
+    """Custo (R$) de equipar cada ponto: câmeras físicas do seu tipo × preço unitário do tipo"""
+    codigos = pd.Categorical(camera_tipo, categories=TIPOS_CAMERA).codes
+    custo_tipo = np.array([cameras_por_tipo[t] * precos[t] for t in TIPOS_CAMERA], dtype=float)
+    # Tipo desconhecido (código -1) conta como FIXA, o padrão de sugerir_tipo_camera
+    return custo_tipo[np.where(codigos >= 0, codigos, TIPOS_CAMERA.index('FIXA'))]
+
+
+def pontos_regra_50_30_20(pontos: int) -> tuple:
+    """Pontos com 3, 2 e 1 câmera pela regra 50/30/20 (o resto vai para 1 câmera, fechando o total)"""
+    qtd_3cam = int(pontos * 0.50)
+    qtd_2cam = int(pontos * 0.30)
+    return qtd_3cam, qtd_2cam, pontos - qtd_3cam - qtd_2cam
+
+
+def quantitativo_por_tipo(camera_tipo, precos: dict, cameras_por_tipo: dict) -> pd.DataFrame:
+    """Pontos, câmeras físicas e custo (R$) por tipo de câmera; tipos sem pontos ficam de fora"""
+    pontos = pd.Series(pd.Categorical(camera_tipo, categories=TIPOS_CAMERA)).fillna('FIXA').value_counts()
+    pontos = pontos.reindex(TIPOS_CAMERA, fill_value=0)
+    cameras = pontos * pd.Series(cameras_por_tipo).reindex(TIPOS_CAMERA)
+    tabela = pd.DataFrame({'pontos': pontos, 'cameras': cameras,
+                           'custo': cameras * pd.Series(precos).reindex(TIPOS_CAMERA)})
+    return tabela[tabela['pontos'] > 0]
+
+
+# ============================================================
+# LOGRADOUROS - NORMALIZAÇÃO DE NOMES
+# ============================================================
+# Abreviações comuns nos nomes de logradouro (após remover acentos e pontuação) -> forma por extenso
+ABREVIACOES_LOGRADOURO = {
+    'AV': 'AVENIDA', 'AVEN': 'AVENIDA', 'R': 'RUA', 'TV': 'TRAVESSA', 'TRAV': 'TRAVESSA',
+    'EST': 'ESTRADA', 'ESTR': 'ESTRADA', 'PC': 'PRACA', 'PCA': 'PRACA', 'VD': 'VIADUTO',
+    'GOV': 'GOVERNADOR', 'DR': 'DOUTOR', 'DRA': 'DOUTORA', 'ENG': 'ENGENHEIRO', 'ENGO': 'ENGENHEIRO', 'PROF': 'PROFESSOR',
+    'PROFA': 'PROFESSORA', 'CONS': 'CONSELHEIRO', 'MAL': 'MARECHAL', 'GAL': 'GENERAL', 'GEN': 'GENERAL',
+    'CAP': 'CAPITAO', 'CEL': 'CORONEL', 'PE': 'PADRE', 'STA': 'SANTA', 'STO': 'SANTO', 'PRES': 'PRESIDENTE',
+    'DES': 'DESEMBARGADOR', 'VISC': 'VISCONDE',
+}
+
+
+@lru_cache(maxsize=65536)
+def normalizar_logradouro(nome) -> str:
+    """Chave de comparação de logradouro: sem acentos, maiúscula, sem pontuação e com abreviações expandidas"""
+    texto = unicodedata.normalize('NFKD', str(nome))
+    texto = ''.join(ch for ch in texto if not unicodedata.combining(ch)).upper()
+    texto = re.sub(r"[^0-9A-Z]+", ' ', texto)
+    return ' '.join(ABREVIACOES_LOGRADOURO.get(p, p) for p in texto.split())
+
+
+def chave_par(a, b):
+    """Chave de cruzamento independente da ordem das ruas (escalar ou vetorizada em arrays de str)"""
+    a, b = np.asarray(a, dtype=object), np.asarray(b, dtype=object)
+    return np.where(a <= b, a + '|' + b, b + '|' + a)
+
+
+def normalizar_serie_logradouros(nomes: pd.Series) -> np.ndarray:
+    """Normaliza só os nomes distintos da série e espalha o resultado (factorize)"""
+    codigos, unicos = pd.factorize(nomes.astype(object).fillna('').astype(str))
+    normalizados = np.array([normalizar_logradouro(n) for n in unicos], dtype=object)
+    return normalizados[codigos] if len(unicos) else np.array([], dtype=object)
+
+
+# ============================================================
+# RISCOS - ALAGAMENTOS E SINISTROS POR CRUZAMENTO
+# ============================================================
+
+def associar_riscos(indice: dict, df: pd.DataFrame, raio: float = RAIO_RISCO_PADRAO) -> pd.DataFrame:
+    """
+    Pares (pos, linha): cruzamento na posição `pos` de `df` x registro `linha` da camada.
+    
+    Nomes casam pela chave normalizada (par de ruas ou rua isolada); pontos casam quando estão a até
+    `raio` metros do cruzamento, com candidatos vindos da grade espacial e distância exata (haversine).
+    """
+    vazio = pd.DataFrame({'pos': np.zeros(0, dtype=np.int64), 'linha': np.zeros(0, dtype=np.int64)})
+    if df.empty:
+        return vazio
+    
+    blocos = [vazio]
+    if len(indice['pares']) or len(indice['ruas']):
+        l1 = normalizar_serie_logradouros(df['log1'])
+        l2 = normalizar_serie_logradouros(df['log2'])
+        posicoes = np.arange(len(df))
+        consultas = [
+            (pd.DataFrame({'chave': chave_par(l1, l2), 'pos': posicoes}), indice['pares']),
+            (pd.DataFrame({'chave': l1, 'pos': posicoes}), indice['ruas']),
+            (pd.DataFrame({'chave': l2, 'pos': posicoes}), indice['ruas']),
+        ]
+        for consulta, alvo in consultas:
+            if len(alvo):
+                blocos.append(consulta.merge(alvo, on='chave')[['pos', 'linha']])
+    
+    if len(indice['pontos']):
+        lat, lon = df['lat'].to_numpy(dtype=float), df['lon'].to_numpy(dtype=float)
+        validos = np.flatnonzero(coordenadas_validas(lat, lon))
+        x, y = projetar_metros(lat[validos], lon[validos], indice['lat_ref'])
+        grade = construir_indice_grade(indice['x'], indice['y'], raio * 1.01 + 1)
+        i, j = consultar_indice_grade(grade, x, y)
+        camada = indice['camada']
+        linhas = indice['pontos'][j]
+        d = distancia_metros_vetor(lat[validos[i]], lon[validos[i]],
+                                   camada['lat'].to_numpy()[linhas], camada['lon'].to_numpy()[linhas])
+        perto = d <= raio
+        blocos.append(pd.DataFrame({'pos': validos[i[perto]], 'linha': linhas[perto]}))
+    
+    return pd.concat(blocos, ignore_index=True).drop_duplicates()
+
+
+def verificar_riscos(df_selecionados: pd.DataFrame, indice: dict, raio: float = RAIO_RISCO_PADRAO) -> dict:
+    """
+    Registros da camada atingidos pelos cruzamentos selecionados.
+    
+    Retorna {'rotulos': nomes distintos atingidos (ordem da camada), 'atingidos': nº de registros,
+    'total': nº de registros, 'fracao': fração da quantidade total de ocorrências atingida}.
+    """
+    linhas = np.unique(associar_riscos(indice, df_selecionados, raio)['linha'].to_numpy())
+    quantidade = indice['camada']['quantidade'].to_numpy(dtype=float)
+    total = quantidade.sum()
+    return {
+        'rotulos': list(dict.fromkeys(indice['rotulos'][linhas])),
+        'atingidos': len(linhas),
+        'total': len(quantidade),
+        'fracao': quantidade[linhas].sum() / total if total > 0 else 0.0,
+    }
+
+
+# ============================================================
+# IPE - PESOS SOBRE A BASE PRÉ-CALCULADA
+# ============================================================
+
+def calcular_ipe_base(base: dict, w_seg: float, w_lct: float, w_com: float, w_mob: float,
+                      eixos_extra: dict = None, pesos_extra: dict = None) -> pd.DataFrame:
+    """
+    Aplica os pesos sobre a base pré-calculada: IPE por cruzamento, ordenação e cobertura acumulada.
+    
+    `eixos_extra` ({nome: array N}, na ordem de base['cruzamentos']) são eixos do próprio cruzamento,
+    como os de risco; entram no ipe_cruz com o peso de `pesos_extra` e não no IPE de cada rua.
+    """
+    if len(base['cruzamentos']) == 0:
+        return pd.DataFrame()
+    
+    eixos_extra = eixos_extra or {}
+    pesos_extra = pesos_extra or {}
+    pesos = (w_seg, w_lct, w_com, w_mob)
+    ipe_log1 = sum(w * base['eixos_log1'][:, i] for i, w in enumerate(pesos))
+    ipe_log2 = sum(w * base['eixos_log2'][:, i] for i, w in enumerate(pesos))
+    ipe_cruz = ipe_log1 + ipe_log2
+    for nome, valores in eixos_extra.items():
+        ipe_cruz = ipe_cruz + pesos_extra.get(nome, 0.0) * valores
+    ordem = np.argsort(-ipe_cruz)
+    eixos = base['eixos'][ordem]
+    
+    # .array preserva as categóricas (nomes de logradouro) da base
+    colunas = {nome: serie.array[ordem] for nome, serie in base['cruzamentos'].items()}
+    colunas.update({'ipe_log1': ipe_log1[ordem], 'ipe_log2': ipe_log2[ordem], 'ipe_cruz': ipe_cruz[ordem]})
+    # Decomposição por eixo só é exibida (percentuais): float32 basta
+    colunas.update({f'{eixo}_tot': eixos[:, i].astype(np.float32) for i, eixo in enumerate(EIXOS)})
+    colunas.update({f'ipe_cruz_{eixo}': (pesos[i] * eixos[:, i]).astype(np.float32) for i, eixo in enumerate(EIXOS)})
+    for nome, valores in eixos_extra.items():
+        colunas[f'{nome}_tot'] = valores[ordem].astype(np.float32)
+        colunas[f'ipe_cruz_{nome}'] = (pesos_extra.get(nome, 0.0) * valores[ordem]).astype(np.float32)
+    colunas['camera_tipo'] = base['camera_tipo'][ordem]
+    
+    total_ipe = ipe_cruz.sum()
+    if total_ipe > 0:
+        colunas['perc_ipe'] = colunas['ipe_cruz'] / total_ipe
+        colunas['cobertura_acum'] = np.cumsum(colunas['ipe_cruz']) / total_ipe
+    else:
+        colunas['perc_ipe'] = 0
+        colunas['cobertura_acum'] = 0
+    
+    return pd.DataFrame(colunas, copy=False)
+
+
+# ============================================================
+# SELEÇÃO - GRAFOS, GULOSO, CELF, BUSCA LOCAL E MODO EXATO
+# ============================================================
+
+def indexar_cruzamentos_por_logradouro(cod_log1: np.ndarray, cod_log2: np.ndarray,
+                                       lat: np.ndarray, lon: np.ndarray) -> dict:
+    """
+    Índice espacial por logradouro para consultas de raio.
+    
+    Cada rua é projetada em metros (projetar_metros) e seus cruzamentos são ordenados ao longo do eixo
+    de maior extensão da rua. Como |Δ no eixo| <= distância plana, uma janela de busca binária nesse eixo
+    contém todos os cruzamentos dentro do raio, e o custo da consulta depende só da densidade local.
+    
+    Cada cruzamento aparece duas vezes no índice (uma por logradouro).
+    Retorna: {'pos': posições ordenadas, 'proj': projeções ordenadas (m),
+              'grupo': número da rua de cada entrada, 'inicios': primeira entrada de cada rua,
+              'x', 'y': coordenadas projetadas por posição}
+    """
+    lat = np.nan_to_num(np.asarray(lat, dtype=float))
+    lon = np.nan_to_num(np.asarray(lon, dtype=float))
+    x, y = projetar_metros(lat, lon, latitude_referencia(lat, lon))
+    
+    n = len(lat)
+    pos = np.concatenate([np.arange(n), np.arange(n)])
+    cods = np.concatenate([np.asarray(cod_log1), np.asarray(cod_log2)])
+    
+    # Eixo de maior extensão de cada rua (coordenadas zeradas = sem georreferência, fora da medida)
+    com_coord = coordenadas_validas(lat, lon)[pos]
+    extensoes = pd.DataFrame({'cod': cods, 'x': x[pos], 'y': y[pos]})[com_coord].groupby('cod').agg(['min', 'max'])
+    usa_x_por_cod = (extensoes['x']['max'] - extensoes['x']['min']) >= (extensoes['y']['max'] - extensoes['y']['min'])
+    usa_x_por_cod = usa_x_por_cod.reindex(np.unique(cods), fill_value=True)
+    usa_x = usa_x_por_cod.reindex(cods).to_numpy()
+    proj = np.where(usa_x, x[pos], y[pos])
+    
+    ordem = np.lexsort((proj, cods))
+    cods_ordenados = cods[ordem]
+    nova_rua = np.r_[True, cods_ordenados[1:] != cods_ordenados[:-1]]
+    
+    return {
+        'pos': pos[ordem],
+        'proj': proj[ordem],
+        'grupo': np.cumsum(nova_rua) - 1,
+        'inicios': np.flatnonzero(nova_rua),
+        'x': x,
+        'y': y
+    }
+
+
+def construir_grafo_vizinhanca(cruzamentos: pd.DataFrame, raio: float, inclusivo: bool = True,
+                               max_pares_lote: int = 2_000_000) -> dict:
+    """
+    Vizinhança por logradouro em formato CSR.
+    
+    Para cada cruzamento i (posição em `cruzamentos`), indices[indptr[i]:indptr[i+1]] são os cruzamentos
+    que compartilham algum logradouro com i e estão a até `raio` metros (<= se inclusivo, < caso contrário).
+    O próprio i sempre faz parte da vizinhança. Com inclusivo=True é a área coberta por uma câmera em i;
+    com inclusivo=False e raio = distância mínima, são os conflitos de espaçamento.
+    """
+    ids = cruzamentos['id'].to_numpy()
+    lat = np.nan_to_num(cruzamentos['lat'].to_numpy(dtype=float))
+    lon = np.nan_to_num(cruzamentos['lon'].to_numpy(dtype=float))
+    n = len(ids)
+    if n == 0:
+        return {'ids': ids, 'indptr': np.zeros(1, dtype=np.int64), 'indices': np.zeros(0, dtype=np.int32)}
+    
+    indice = indexar_cruzamentos_por_logradouro(
+        cruzamentos['cod_log1'].to_numpy(), cruzamentos['cod_log2'].to_numpy(), lat, lon
+    )
+    validas = coordenadas_validas(lat, lon)
+    erro = (erro_relativo_projecao(lat[validas].min(), lat[validas].max(), latitude_referencia(lat, lon))
+            if validas.any() else 0.0)
+    janela = raio * max(1 + erro, 1.01) + 1.0  # folga para a diferença entre a projeção plana e o haversine
+    
+    # Chave única e ordenada: ruas separadas por lacunas maiores que a janela de busca
+    rel = indice['proj'] - indice['proj'][indice['inicios']][indice['grupo']]
+    passo = rel.max() + 2 * janela + 1
+    chave = indice['grupo'] * passo + rel
+    lo = np.searchsorted(chave, chave - janela, side='left')
+    hi = np.searchsorted(chave, chave + janela, side='right')
+    cont = hi - lo
+    
+    # Pares candidatos em lotes, para limitar a memória com raios grandes
+    pares_i, pares_j = [np.arange(n)], [np.arange(n)]
+    acumulado = np.cumsum(cont)
+    inicio = 0
+    while inicio < len(chave):
+        fim = max(int(np.searchsorted(acumulado, acumulado[inicio] - cont[inicio] + max_pares_lote, side='right')),
+                  inicio + 1)
+        c = cont[inicio:fim]
+        src = np.repeat(np.arange(inicio, fim), c)
+        dst = np.repeat(lo[inicio:fim], c) + (np.arange(c.sum()) - np.repeat(np.cumsum(c) - c, c))
+        i, j = indice['pos'][src], indice['pos'][dst]
+        dentro = classificar_distancias(indice['x'], indice['y'], lat, lon, i, j, raio, erro, validas, inclusivo)
+        pares_i.append(i[dentro])
+        pares_j.append(j[dentro])
+        inicio = fim
+    
+    pares = np.unique(np.concatenate(pares_i).astype(np.int64) * n + np.concatenate(pares_j))
+    origem = pares // n
+    return {
+        'ids': ids,
+        'indptr': np.r_[0, np.cumsum(np.bincount(origem, minlength=n))],
+        'indices': (pares % n).astype(np.int32)
+    }
+
+
+def _contexto_selecao(df: pd.DataFrame, min_dist: float, raio_cobertura: float,
+                      limite_cobertura_logradouro: float, grafos: dict, custos: np.ndarray = None) -> dict:
+    """
+    Estruturas comuns aos otimizadores, indexadas pela posição no grafo (ordem do dataset).
+    
+    'pos_df' leva cada linha de `df` à sua posição no grafo; cruzamentos fora de `df` têm IPE 0 e não
+    contam cobertura. Logradouros viram inteiros ('logs_pos', duas colunas) para o limite por rua.
+    `custos` (R$ por linha de `df`, opcional) vira 'custo' por posição, para o modo orçamento.
+    """
+    if grafos is None:
+        grafos = {
+            'cobertura': construir_grafo_vizinhanca(df, raio_cobertura, inclusivo=True),
+            'conflito': construir_grafo_vizinhanca(df, min_dist, inclusivo=False) if min_dist > 0 else None
+        }
+    
+    ids_grafo = grafos['cobertura']['ids']
+    pos_df = pd.Index(ids_grafo).get_indexer(df['id'].to_numpy())
+    n_grafo = len(ids_grafo)
+    em_df = np.zeros(n_grafo, dtype=bool)
+    em_df[pos_df] = True
+    ipe = np.zeros(n_grafo)
+    ipe[pos_df] = df['ipe_cruz'].to_numpy(dtype=float)
+    
+    cods, logs_cruz = np.unique(np.concatenate([df['cod_log1'].to_numpy(), df['cod_log2'].to_numpy()]),
+                                return_inverse=True)
+    logs_pos = np.zeros((n_grafo, 2), dtype=np.int64)
+    logs_pos[pos_df] = logs_cruz.reshape(2, -1).T
+    ipe_por_logradouro = np.zeros(len(cods))
+    if limite_cobertura_logradouro is not None:
+        np.add.at(ipe_por_logradouro, logs_pos[pos_df].ravel(), np.repeat(ipe[pos_df], 2))
+    
+    custo = None
+    if custos is not None:
+        custo = np.zeros(n_grafo)
+        custo[pos_df] = custos
+    
+    return {
+        'ids': ids_grafo, 'pos_df': pos_df, 'em_df': em_df, 'ipe': ipe, 'ipe_total': df['ipe_cruz'].sum(),
+        'custo': custo,
+        'cob_ptr': grafos['cobertura']['indptr'], 'cob_ind': grafos['cobertura']['indices'],
+        'conflito': grafos['conflito'] if min_dist > 0 else None,
+        'logs_pos': logs_pos, 'ipe_por_logradouro': ipe_por_logradouro, 'limite': limite_cobertura_logradouro
+    }
+
+
+def _area_nova(ctx: dict, pos: int, coberto: np.ndarray) -> np.ndarray:
+    """Posições que uma câmera em `pos` passaria a cobrir"""
+    area = ctx['cob_ind'][ctx['cob_ptr'][pos]:ctx['cob_ptr'][pos + 1]]
+    return area[ctx['em_df'][area] & ~coberto[area]]
+
+
+def _em_conflito(ctx: dict, pos: int, tem_camera: np.ndarray) -> bool:
+    """Há câmera a menos de min_dist de `pos` num logradouro em comum?"""
+    conflito = ctx['conflito']
+    if conflito is None:
+        return False
+    return bool(tem_camera[conflito['indices'][conflito['indptr'][pos]:conflito['indptr'][pos + 1]]].any())
+
+
+def _ipe_adicional_logradouros(ctx: dict, pos: int, novos: np.ndarray) -> np.ndarray:
+    """IPE acrescentado a cada logradouro: o do cruzamento da câmera mais o dos novos cobertos"""
+    ipe, logs_pos = ctx['ipe'], ctx['logs_pos']
+    adicional = np.zeros(len(ctx['ipe_por_logradouro']))
+    np.add.at(adicional, logs_pos[pos], ipe[pos])
+    outros = novos[novos != pos]
+    np.add.at(adicional, logs_pos[outros].ravel(), np.repeat(ipe[outros], 2))
+    return adicional
+
+
+def _violaria_limite_logradouro(ctx: dict, pos: int, adicional: np.ndarray,
+                                cobertura_por_logradouro: np.ndarray) -> bool:
+    for log in ctx['logs_pos'][pos]:
+        ipe_total_log = ctx['ipe_por_logradouro'][log]
+        if ipe_total_log <= 0:
+            continue
+        if (cobertura_por_logradouro[log] + adicional[log]) / ipe_total_log > ctx['limite']:
+            return True
+    return False
+
+
+def _resultado_execucao(ctx: dict, selecionados: list, coberto: np.ndarray, ipe_coberto: float,
+                        motivo_limite, registrar: bool, ipe_acum: list, deltas: list, restantes: list) -> dict:
+    """Saída comum de _executar_guloso e _executar_celf (com a trilha quando registrar=True)"""
+    resultado = {
+        'selecionados': np.array(selecionados, dtype=np.int64), 'coberto': coberto, 'ids': ctx['ids'],
+        'ipe_coberto': ipe_coberto, 'ipe_total': ctx['ipe_total'], 'motivo_limite': motivo_limite
+    }
+    if registrar:
+        resultado['ipe_acum'] = np.array(ipe_acum)
+        resultado['delta_ptr'] = np.r_[0, np.cumsum([len(d) for d in deltas], dtype=np.int64)]
+        resultado['delta_pos'] = np.concatenate(deltas) if deltas else np.zeros(0, dtype=np.int32)
+        resultado['restantes'] = np.array(restantes, dtype=bool)
+    return resultado
+
+
+def _executar_guloso(df: pd.DataFrame, cobertura_frac: float, min_dist: float, max_cruzamentos: int,
+                     raio_cobertura: float, limite_cobertura_logradouro: float, grafos: dict,
+                     registrar: bool = False, custos: np.ndarray = None, orcamento: float = None) -> dict:
+    """
+    Núcleo do guloso por ordem de IPE (ver filtrar_por_cobertura_e_distancia).
+    
+    Com registrar=True, guarda também o IPE coberto acumulado após cada seleção, as posições
+    recém-cobertas em cada passo (deltas em formato CSR) e se ainda havia candidatos depois dela.
+    Com `orcamento`, delega à mochila de _executar_celf (ganho por real e ganho puro): seguir o ranking
+    pulando o que não cabe ignora o custo e cobre bem menos com o mesmo orçamento.
+    """
+    if orcamento is not None:
+        return _executar_celf(df, cobertura_frac, min_dist, max_cruzamentos, raio_cobertura,
+                              limite_cobertura_logradouro, grafos, registrar, custos, orcamento)
+    ctx = _contexto_selecao(df, min_dist, raio_cobertura, limite_cobertura_logradouro, grafos, custos)
+    ipe, ipe_total = ctx['ipe'], ctx['ipe_total']
+    n_grafo = len(ctx['ids'])
+    cobertura_por_logradouro = np.zeros(len(ctx['ipe_por_logradouro']))
+    
+    tem_camera = np.zeros(n_grafo, dtype=bool)
+    coberto = np.zeros(n_grafo, dtype=bool)
+    selecionados = []
+    ipe_coberto = 0.0
+    motivo_limite = None
+    ipe_acum, deltas, restantes = [0.0], [], []
+    
+    for k, pos in enumerate(ctx['pos_df']):
+        if max_cruzamentos is not None and len(selecionados) >= max_cruzamentos:
+            motivo_limite = 'quantidade'
+            break
+        
+        cobertura_atual = ipe_coberto / ipe_total
+        if max_cruzamentos is None and cobertura_atual >= cobertura_frac:
+            break
+        
+        if _em_conflito(ctx, pos, tem_camera):
+            continue
+        
+        novos = _area_nova(ctx, pos, coberto)
+        
+        if limite_cobertura_logradouro is not None:
+            adicional = _ipe_adicional_logradouros(ctx, pos, novos)
+            if _violaria_limite_logradouro(ctx, pos, adicional, cobertura_por_logradouro):
+                continue
+            cobertura_por_logradouro += adicional
+        
+        selecionados.append(k)
+        tem_camera[pos] = True
+        ipe_coberto += ipe[novos].sum()
+        coberto[novos] = True
+        if registrar:
+            ipe_acum.append(ipe_coberto)
+            deltas.append(novos)
+            restantes.append(k < len(df) - 1)
+    
+    return _resultado_execucao(ctx, selecionados, coberto, ipe_coberto, motivo_limite,
+                               registrar, ipe_acum, deltas, restantes)
+
+
+def _passada_celf(ctx: dict, cobertura_frac: float, max_cruzamentos: int, registrar: bool,
+                  orcamento: float = None, por_custo: bool = False) -> dict:
+    """
+    Uma execução do guloso preguiçoso sobre o contexto (ver _executar_celf).
+    
+    Com `orcamento`, candidatos cujo custo excede o saldo saem da fila (o saldo só diminui) e a
+    prioridade é o ganho por real gasto se `por_custo`, ou o ganho puro caso contrário.
+    """
+    ipe, ipe_total = ctx['ipe'], ctx['ipe_total']
+    n_grafo = len(ctx['ids'])
+    cobertura_por_logradouro = np.zeros(len(ctx['ipe_por_logradouro']))
+    custo = ctx['custo'] if orcamento is not None else None
+    divisor = custo if por_custo else np.ones(n_grafo)
+    
+    # Ganho inicial de cada posição: IPE de toda a sua área de cobertura
+    origem = np.repeat(np.arange(n_grafo), np.diff(ctx['cob_ptr']))
+    ganho_inicial = np.bincount(origem, weights=ipe[ctx['cob_ind']], minlength=n_grafo)
+    fila = [(-ganho_inicial[pos] / divisor[pos], k, pos, 0) for k, pos in enumerate(ctx['pos_df'].tolist())]
+    heapq.heapify(fila)
+    
+    tem_camera = np.zeros(n_grafo, dtype=bool)
+    coberto = np.zeros(n_grafo, dtype=bool)
+    selecionados = []
+    ipe_coberto = 0.0
+    saldo = orcamento
+    motivo_limite = None
+    ipe_acum, deltas, restantes = [0.0], [], []
+    
+    while fila:
+        if max_cruzamentos is not None and len(selecionados) >= max_cruzamentos:
+            motivo_limite = 'quantidade'
+            break
+        if max_cruzamentos is None and orcamento is None and ipe_coberto / ipe_total >= cobertura_frac:
+            break
+        
+        menos_ganho, k, pos, passo = heapq.heappop(fila)
+        if -menos_ganho <= 0:
+            break
+        if orcamento is not None and custo[pos] > saldo:
+            motivo_limite = 'orcamento'
+            continue
+        if _em_conflito(ctx, pos, tem_camera):
+            continue
+        
+        novos = _area_nova(ctx, pos, coberto)
+        if passo != len(selecionados):
+            heapq.heappush(fila, (-ipe[novos].sum() / divisor[pos], k, pos, len(selecionados)))
+            continue
+        
+        if ctx['limite'] is not None:
+            adicional = _ipe_adicional_logradouros(ctx, pos, novos)
+            if _violaria_limite_logradouro(ctx, pos, adicional, cobertura_por_logradouro):
+                continue
+            cobertura_por_logradouro += adicional
+        
+        selecionados.append(k)
+        tem_camera[pos] = True
+        ipe_coberto += ipe[novos].sum()
+        coberto[novos] = True
+        if orcamento is not None:
+            saldo -= custo[pos]
+        if registrar:
+            ipe_acum.append(ipe_coberto)
+            deltas.append(novos)
+            restantes.append(bool(fila))
+    
+    return _resultado_execucao(ctx, selecionados, coberto, ipe_coberto, motivo_limite,
+                               registrar, ipe_acum, deltas, restantes)
+
+
+def _executar_celf(df: pd.DataFrame, cobertura_frac: float, min_dist: float, max_cruzamentos: int,
+                   raio_cobertura: float, limite_cobertura_logradouro: float, grafos: dict,
+                   registrar: bool = False, custos: np.ndarray = None, orcamento: float = None) -> dict:
+    """
+    Guloso por ganho marginal com avaliação preguiçosa (CELF): a cada passo, a câmera que mais
+    acrescenta IPE coberto, em vez da próxima do ranking.
+    
+    O ganho de um candidato só diminui à medida que a cobertura cresce, então a fila de prioridade
+    guarda o último ganho calculado e só o recalcula quando o candidato chega ao topo; se ele segue no
+    topo com o ganho atualizado, é o melhor do passo. Empates ficam com o maior IPE (ordem de `df`).
+    As restrições são as do guloso por IPE: conflito de distância mínima e limite por logradouro
+    descartam o candidato. Candidatos sem ganho não recebem câmera. Mesma saída de _executar_guloso.
+    
+    Com `orcamento` (R$) e `custos` por linha, maximiza o IPE coberto sem ultrapassar o orçamento
+    (mochila): roda uma passada por ganho/custo e outra por ganho puro e fica com a que cobre mais,
+    pois nenhuma das duas sozinha tem garantia quando os custos variam.
+    """
+    ctx = _contexto_selecao(df, min_dist, raio_cobertura, limite_cobertura_logradouro, grafos, custos)
+    if orcamento is None:
+        return _passada_celf(ctx, cobertura_frac, max_cruzamentos, registrar)
+    passadas = [_passada_celf(ctx, cobertura_frac, max_cruzamentos, registrar, orcamento, por_custo)
+                for por_custo in (True, False)]
+    return max(passadas, key=lambda r: r['ipe_coberto'])
+
+
+# Motores de seleção disponíveis na barra lateral
+OTIMIZADORES = {'ipe': "Guloso por IPE (ordem do ranking)", 'celf': "Ganho marginal (CELF)"}
+EXECUTORES_SELECAO = {'ipe': _executar_guloso, 'celf': _executar_celf}
+
+
+def _montar_resultado_selecao(selecionados: np.ndarray, ipe_coberto: float, ipe_total: float,
+                              cobertura_frac: float, motivo_limite, ids_cobertos: np.ndarray) -> tuple:
+    """Formata a saída de otimizar_selecao: posições (int32) das linhas selecionadas e ids cobertos ordenados"""
+    if len(selecionados) == 0:
+        return np.zeros(0, dtype=np.int32), 0.0, False, None, np.zeros(0, dtype=np.int32)
+    
+    cobertura_real = ipe_coberto / ipe_total
+    alvo_atingido = cobertura_real >= cobertura_frac * 0.99
+    if not alvo_atingido and motivo_limite is None:
+        motivo_limite = 'restricoes'
+    
+    return (np.asarray(selecionados, dtype=np.int32), cobertura_real, alvo_atingido, motivo_limite,
+            np.sort(np.asarray(ids_cobertos, dtype=np.int32)))
+
+
+def tabela_selecionados(df: pd.DataFrame, posicoes: np.ndarray) -> pd.DataFrame:
+    """Linhas selecionadas de `df` (posições de otimizar_selecao) com a cobertura acumulada da seleção"""
+    if len(posicoes) == 0:
+        return pd.DataFrame()
+    
+    df_result = df.iloc[posicoes].reset_index(drop=True)
+    df_result['cobertura_acum'] = df_result['ipe_cruz'].cumsum() / df['ipe_cruz'].sum()
+    return df_result
+
+
+def construir_trilha_selecao(df: pd.DataFrame, min_dist: float, raio_cobertura: float, grafos: dict = None,
+                             otimizador: str = 'ipe') -> dict:
+    """
+    Executa o otimizador até o fim (sem alvo de cobertura, sem limite de quantidade e sem limite por rua).
+    
+    Sem limite por logradouro, o resultado para qualquer alvo de cobertura ou quantidade máxima é um
+    prefixo desta execução (nos dois otimizadores a ordem de escolha não depende do alvo);
+    ver selecionar_pela_trilha.
+    """
+    return EXECUTORES_SELECAO[otimizador](df, np.inf, min_dist, None, raio_cobertura, None, grafos, registrar=True)
+
+
+def selecionar_pela_trilha(df: pd.DataFrame, trilha: dict, cobertura_frac: float, max_cruzamentos: int = None) -> tuple:
+    """Resultado de otimizar_selecao como prefixo da trilha (busca binária no IPE acumulado)"""
+    selecionados = trilha['selecionados']
+    n_total = len(selecionados)
+    motivo_limite = None
+    
+    if max_cruzamentos is not None:
+        n = min(max_cruzamentos, n_total)
+        # O otimizador só registra o motivo se ainda havia candidatos a avaliar ao atingir o limite
+        if n == max_cruzamentos and n > 0 and trilha['restantes'][n - 1]:
+            motivo_limite = 'quantidade'
+    else:
+        cobertura_acum = trilha['ipe_acum'] / trilha['ipe_total']
+        n = min(int(np.searchsorted(cobertura_acum, cobertura_frac, side='left')), n_total)
+    
+    cobertos = trilha['delta_pos'][:trilha['delta_ptr'][n]]
+    return _montar_resultado_selecao(
+        selecionados[:n], trilha['ipe_acum'][n], trilha['ipe_total'], cobertura_frac, motivo_limite,
+        trilha['ids'][cobertos]
+    )
+
+
+def otimizar_selecao(df: pd.DataFrame, cobertura_frac: float, min_dist: float,
+                     max_cruzamentos: int = None, raio_cobertura: float = 50,
+                     limite_cobertura_logradouro: float = None, grafos: dict = None,
+                     trilha: dict = None, otimizador: str = 'ipe', custos: np.ndarray = None,
+                     orcamento: float = None) -> tuple:
+    """
+    Seleção de filtrar_por_cobertura_e_distancia em forma compacta, sem copiar linhas de `df`.
+    `otimizador` escolhe o motor (OTIMIZADORES); a trilha, se dada, deve ser do mesmo motor.
+    Com `orcamento` (R$, `custos` por linha de custo_por_ponto) o alvo de cobertura é ignorado:
+    maximiza-se o IPE coberto dentro do orçamento, pelo mesmo guloso custo-benefício nos dois motores.
+    
+    Retorna: (posições int32 das linhas selecionadas em `df`, cobertura_real, alvo_atingido,
+    motivo_limite, ids cobertos int32 ordenados); ver tabela_selecionados.
+    """
+    vazio = np.zeros(0, dtype=np.int32)
+    if df.empty:
+        return vazio, 0.0, True, None, vazio
+    
+    ipe_total = df['ipe_cruz'].sum()
+    if ipe_total <= 0:
+        return vazio, 0.0, True, None, vazio
+    
+    if trilha is not None and limite_cobertura_logradouro is None and orcamento is None:
+        return selecionar_pela_trilha(df, trilha, cobertura_frac, max_cruzamentos)
+    
+    r = EXECUTORES_SELECAO[otimizador](df, cobertura_frac, min_dist, max_cruzamentos, raio_cobertura,
+                                       limite_cobertura_logradouro, grafos, custos=custos, orcamento=orcamento)
+    return _montar_resultado_selecao(
+        r['selecionados'], r['ipe_coberto'], ipe_total, cobertura_frac, r['motivo_limite'], r['ids'][r['coberto']]
+    )
+
+
+def filtrar_por_cobertura_e_distancia(df: pd.DataFrame, cobertura_frac: float, min_dist: float, 
+                                       max_cruzamentos: int = None, raio_cobertura: float = 50,
+                                       limite_cobertura_logradouro: float = None, grafos: dict = None,
+                                       trilha: dict = None, otimizador: str = 'ipe', custos: np.ndarray = None,
+                                       orcamento: float = None) -> tuple:
+    """
+    Filtra cruzamentos mantendo a cobertura alvo mesmo com filtro de distância.
+    
+    Args:
+        df: DataFrame com cruzamentos ordenados por IPE
+        cobertura_frac: Fração de cobertura alvo (0-1)
+        min_dist: Distância mínima entre cruzamentos DO MESMO LOGRADOURO em metros
+        max_cruzamentos: Limite máximo de cruzamentos (None = sem limite)
+        raio_cobertura: Raio de cobertura de cada câmera NO MESMO LOGRADOURO em metros
+        limite_cobertura_logradouro: Fração máxima de cobertura por logradouro (0-1, None = sem limite)
+        grafos: {'cobertura': grafo de raio_cobertura, 'conflito': grafo de min_dist (ou None)}, de
+                construir_grafo_vizinhanca. Se omitido, os grafos são construídos a partir de `df`.
+        trilha: Execução completa de construir_trilha_selecao para os mesmos df, min_dist, raio e
+                otimizador; usada (sem nova otimização) quando não há limite por logradouro.
+        otimizador: 'ipe' percorre o ranking de IPE; 'celf' escolhe pelo maior ganho de cobertura.
+        custos: Custo (R$) de cada linha de `df` (custo_por_ponto); usado só com orçamento.
+        orcamento: Orçamento total em R$ (None = sem orçamento); substitui o alvo de cobertura.
+    
+    Retorna: (DataFrame selecionados, cobertura_real, alvo_atingido, motivo_limite, ids_cobertos)
+    """
+    posicoes, cobertura_real, alvo_atingido, motivo_limite, ids_cobertos = otimizar_selecao(
+        df, cobertura_frac, min_dist, max_cruzamentos, raio_cobertura, limite_cobertura_logradouro, grafos, trilha,
+        otimizador, custos, orcamento
+    )
+    return tabela_selecionados(df, posicoes), cobertura_real, alvo_atingido, motivo_limite, set(ids_cobertos.tolist())
+
+
+def melhorar_selecao(df: pd.DataFrame, resultado: tuple, cobertura_frac: float, min_dist: float,
+                     max_cruzamentos: int = None, raio_cobertura: float = 50,
+                     limite_cobertura_logradouro: float = None, grafos: dict = None,
+                     tempo_limite: float = 2.0, custos: np.ndarray = None, orcamento: float = None) -> tuple:
+    """
+    Busca local sobre uma seleção de otimizar_selecao, dentro de `tempo_limite` segundos.
+    
+    Movimentos, repetidos enquanto houver melhora:
+      - remoção: câmera cujo IPE coberto exclusivo não é necessário (alvo continua atingido);
+      - troca 2-por-1: duas câmeras próximas substituídas por uma entre elas, mantendo o alvo;
+      - troca 1-por-1: câmera movida para um cruzamento da sua área que cobre mais IPE;
+      - com quantidade máxima ou orçamento, vagas livres (ou saldo) são preenchidas pelo maior ganho
+        (por real gasto, com orçamento);
+      - troca 1-por-2, também só com quantidade máxima ou orçamento: uma câmera sai e os dois melhores
+        cruzamentos descobertos entram, se cabem na quantidade e no saldo e o IPE coberto aumenta (ex.: uma
+        câmera cara trocada por duas baratas, ou uma que bloqueia pela distância mínima dois pontos bons).
+    Sem quantidade máxima nem orçamento o objetivo é atingir o alvo com menos câmeras; com eles, cobrir mais IPE.
+    A contagem de câmeras que cobrem cada posição torna cada avaliação local (só as áreas envolvidas).
+    Cada movimento respeita a distância mínima e o limite por logradouro (IPE coberto das ruas da câmera);
+    a solução corrente é sempre válida, então o prazo só interrompe a melhora. Mesma saída de otimizar_selecao.
+    """
+    posicoes, _, _, motivo_limite, _ = resultado
+    if len(posicoes) == 0 or tempo_limite <= 0:
+        return resultado
+    
+    prazo = time.perf_counter() + tempo_limite
+    ctx = _contexto_selecao(df, min_dist, raio_cobertura, limite_cobertura_logradouro, grafos,
+                            custos if orcamento is not None else None)
+    ipe, ipe_total, em_df = ctx['ipe'], ctx['ipe_total'], ctx['em_df']
+    cob_ptr, cob_ind, logs_pos = ctx['cob_ptr'], ctx['cob_ind'], ctx['logs_pos']
+    n_grafo = len(ctx['ids'])
+    linha_da_pos = np.full(n_grafo, -1, dtype=np.int64)
+    linha_da_pos[ctx['pos_df']] = np.arange(len(df))
+    com_alvo = max_cruzamentos is None and orcamento is None
+    custo = ctx['custo'] if orcamento is not None else np.zeros(n_grafo)
+    
+    def area(pos):
+        return cob_ind[cob_ptr[pos]:cob_ptr[pos + 1]]
+    
+    camera = dict.fromkeys(ctx['pos_df'][posicoes].tolist())  # ordem de escolha preservada
+    tem_camera = np.zeros(n_grafo, dtype=bool)
+    tem_camera[list(camera)] = True
+    contagem = np.bincount(np.concatenate([area(p) for p in camera]), minlength=n_grafo)
+    ipe_coberto = ipe[contagem > 0].sum()
+    gasto = custo[list(camera)].sum()
+    cobertura_logradouro = np.zeros(len(ctx['ipe_por_logradouro']))
+    if limite_cobertura_logradouro is not None:
+        cobertos = np.flatnonzero((contagem > 0) & em_df)
+        np.add.at(cobertura_logradouro, logs_pos[cobertos].ravel(), np.repeat(ipe[cobertos], 2))
+    
+    def variacao(removidos, adicionados):
+        """(IPE ganho - perdido, posições perdidas, posições ganhas) ao remover e adicionar câmeras"""
+        tocadas = [area(p) for p in removidos] + [area(c) for c in adicionados]
+        sinais = [np.full(len(a), -1) for a in tocadas[:len(removidos)]] + \
+                 [np.ones(len(a), dtype=np.int64) for a in tocadas[len(removidos):]]
+        unicas, inverso = np.unique(np.concatenate(tocadas), return_inverse=True)
+        nova = contagem[unicas] + np.bincount(inverso, weights=np.concatenate(sinais)).astype(np.int64)
+        perdidas = unicas[(contagem[unicas] > 0) & (nova == 0)]
+        ganhas = unicas[(contagem[unicas] == 0) & (nova > 0)]
+        return ipe[ganhas].sum() - ipe[perdidas].sum(), perdidas, ganhas
+    
+    def em_conflito(c, removidos=(), adicionados=()):
+        """Se `c` fica a menos da distância mínima de uma câmera que permanece ou que entra junto"""
+        conflito = ctx['conflito']
+        if conflito is None:
+            return False
+        vizinhos = conflito['indices'][conflito['indptr'][c]:conflito['indptr'][c + 1]]
+        return bool(np.setdiff1d(vizinhos[tem_camera[vizinhos]], removidos).size
+                    or np.isin(vizinhos, adicionados).any())
+    
+    def permitido(removidos, adicionados, perdidas, ganhas):
+        if orcamento is not None and len(adicionados) and \
+                gasto + custo[adicionados].sum() - custo[removidos].sum() > orcamento + 1e-6:
+            return False
+        if any(em_conflito(c, removidos, adicionados[:k]) for k, c in enumerate(adicionados)):
+            return False
+        if limite_cobertura_logradouro is not None and len(ganhas):
+            delta = np.zeros(len(cobertura_logradouro))
+            np.add.at(delta, logs_pos[ganhas].ravel(), np.repeat(ipe[ganhas], 2))
+            np.add.at(delta, logs_pos[perdidas].ravel(), -np.repeat(ipe[perdidas], 2))
+            # Como no guloso, o limite vale para as ruas das câmeras adicionadas
+            total_log = ctx['ipe_por_logradouro']
+            for log in np.unique(logs_pos[adicionados].ravel()):
+                if delta[log] > 0 and total_log[log] > 0 and \
+                        (cobertura_logradouro[log] + delta[log]) / total_log[log] > limite_cobertura_logradouro:
+                    return False
+        return True
+    
+    def aplicar(removidos, adicionados, ganho, perdidas, ganhas):
+        nonlocal ipe_coberto, gasto
+        for p in removidos:
+            contagem[area(p)] -= 1
+            tem_camera[p] = False
+            gasto -= custo[p]
+            del camera[p]
+        for c in adicionados:
+            contagem[area(c)] += 1
+            tem_camera[c] = True
+            gasto += custo[c]
+            camera[c] = None
+        ipe_coberto += ganho
+        if limite_cobertura_logradouro is not None:
+            np.add.at(cobertura_logradouro, logs_pos[ganhas].ravel(), np.repeat(ipe[ganhas], 2))
+            np.add.at(cobertura_logradouro, logs_pos[perdidas].ravel(), -np.repeat(ipe[perdidas], 2))
+    
+    def atinge_alvo(valor):
+        return valor / ipe_total >= cobertura_frac
+    
+    def exclusivo(p):
+        a = area(p)
+        return ipe[a[contagem[a] == 1]].sum()
+    
+    origem = np.repeat(np.arange(n_grafo), np.diff(cob_ptr))
+    
+    def ganhos_adicao(saldo):
+        """IPE descoberto na área de cada cruzamento livre (por real, com orçamento; 0 se não cabe no saldo)"""
+        ganhos = np.bincount(origem, weights=ipe[cob_ind] * (contagem[cob_ind] == 0), minlength=n_grafo)
+        ganhos[~em_df | tem_camera] = 0
+        if orcamento is not None:
+            ganhos[custo > saldo + 1e-6] = 0
+            ganhos = ganhos / np.maximum(custo, 1e-9)
+        return ganhos
+    melhorou = True
+    while melhorou and time.perf_counter() < prazo:
+        melhorou = False
+        
+        # Remoções: câmeras sem cobertura exclusiva necessária
+        for p in sorted(camera, key=exclusivo):
+            if time.perf_counter() >= prazo:
+                break
+            ganho, perdidas, ganhas = variacao([p], [])
+            if ganho >= 0 or (com_alvo and atinge_alvo(ipe_coberto + ganho)):
+                aplicar([p], [], ganho, perdidas, ganhas)
+                melhorou = True
+        
+        # Trocas 2-por-1: um cruzamento da área de p1 substitui p1 e outra câmera vizinha
+        if com_alvo:
+            for p1 in sorted(camera, key=exclusivo):
+                if time.perf_counter() >= prazo:
+                    break
+                if not tem_camera[p1]:
+                    continue
+                for c in area(p1):
+                    if tem_camera[c] or not em_df[c]:
+                        continue
+                    vizinhas = area(c)
+                    trocado = False
+                    for p2 in vizinhas[tem_camera[vizinhas] & (vizinhas != p1)]:
+                        ganho, perdidas, ganhas = variacao([p1, p2], [c])
+                        if atinge_alvo(ipe_coberto + ganho) and permitido([p1, p2], [c], perdidas, ganhas):
+                            aplicar([p1, p2], [c], ganho, perdidas, ganhas)
+                            melhorou = trocado = True
+                            break
+                    if trocado:
+                        break
+        
+        # Trocas 1-por-1 que aumentam o IPE coberto
+        for p in sorted(camera, key=exclusivo):
+            if time.perf_counter() >= prazo:
+                break
+            if not tem_camera[p]:
+                continue
+            for c in area(p):
+                if tem_camera[c] or not em_df[c]:
+                    continue
+                ganho, perdidas, ganhas = variacao([p], [c])
+                if ganho > 1e-12 * ipe_total and permitido([p], [c], perdidas, ganhas):
+                    aplicar([p], [c], ganho, perdidas, ganhas)
+                    melhorou = True
+                    break
+        
+        # Vagas livres (quantidade máxima) ou saldo do orçamento: maior ganho entre os candidatos válidos
+        while not com_alvo and (max_cruzamentos is None or len(camera) < max_cruzamentos) \
+                and time.perf_counter() < prazo:
+            ganhos = ganhos_adicao(orcamento - gasto if orcamento is not None else None)
+            escolhido = None
+            for c in np.argsort(-ganhos)[:256]:
+                if ganhos[c] <= 0:
+                    break
+                ganho, perdidas, ganhas = variacao([], [c])
+                if permitido([], [c], perdidas, ganhas):
+                    escolhido = (c, ganho, perdidas, ganhas)
+                    break
+            if escolhido is None:
+                break
+            aplicar([], [escolhido[0]], *escolhido[1:])
+            melhorou = True
+        
+        # Trocas 1-por-2: com p fora, o melhor cruzamento livre e, com ele dentro, o segundo melhor
+        if not com_alvo and (max_cruzamentos is None or len(camera) < max_cruzamentos):
+            for p in sorted(camera, key=exclusivo):
+                if time.perf_counter() >= prazo:
+                    break
+                if not tem_camera[p]:
+                    continue
+                contagem[area(p)] -= 1
+                tem_camera[p] = False
+                par = []
+                for _ in range(2):
+                    ganhos = ganhos_adicao(orcamento - gasto + custo[p] - custo[par].sum()
+                                           if orcamento is not None else None)
+                    ganhos[p] = 0
+                    c = next((c for c in np.argsort(-ganhos)[:256] if ganhos[c] > 0 and not em_conflito(c)), None)
+                    if c is None:
+                        break
+                    par.append(c)
+                    contagem[area(c)] += 1
+                    tem_camera[c] = True
+                for c in par:
+                    contagem[area(c)] -= 1
+                    tem_camera[c] = False
+                contagem[area(p)] += 1
+                tem_camera[p] = True
+                if len(par) < 2:
+                    continue
+                ganho, perdidas, ganhas = variacao([p], par)
+                if ganho > 1e-12 * ipe_total and permitido([p], par, perdidas, ganhas):
+                    aplicar([p], par, ganho, perdidas, ganhas)
+                    melhorou = True
+                    if max_cruzamentos is not None and len(camera) >= max_cruzamentos:
+                        break
+    
+    cobertos = (contagem > 0) & em_df
+    return _montar_resultado_selecao(
+        linha_da_pos[list(camera)], ipe[cobertos].sum(), ipe_total, cobertura_frac, motivo_limite, ctx['ids'][cobertos]
+    )
+
+
+def resolver_exato(df: pd.DataFrame, resultado: tuple, cobertura_frac: float, min_dist: float,
+                   max_cruzamentos: int = None, raio_cobertura: float = 50,
+                   limite_cobertura_logradouro: float = None, grafos: dict = None,
+                   custos: np.ndarray = None, orcamento: float = None,
+                   tempo_limite: float = 30.0, gap_relativo: float = 0.01) -> tuple:
+    """
+    Programa inteiro da seleção (HiGHS via scipy.optimize.milp), partindo de uma solução heurística.
+    
+    Variáveis: x (câmera em cada linha de `df`, binária) e y (linha coberta, contínua em [0, 1]).
+    Cobertura: y_i <= soma dos x_j com i na área de j, montada direto do CSR do grafo de cobertura; a
+    maioria dos cruzamentos só é coberta por câmera própria, e aí y_i = x_i dispensa variável e restrição.
+    Conflito de distância mínima: x_a + x_b <= 1 por aresta. Limite por logradouro: IPE coberto de cada
+    rua <= limite × IPE da rua, com y_i >= x_j para y não "descobrir" pontos e burlar o limite.
+    Sem quantidade máxima nem orçamento, minimiza câmeras atingindo o alvo; senão, maximiza o IPE coberto.
+    Sem limite por rua, cruzamentos isolados dominados (ver abaixo) são fixados em zero antes de resolver.
+    
+    `resultado` (de otimizar_selecao/melhorar_selecao) entra como corte do objetivo quando é viável no
+    modelo (milp não aceita solução inicial) e é devolvido se o resolvedor não achar nada melhor no prazo.
+    Melhor, com alvo: atingir o alvo e, entre as que atingem, menos câmeras; sem alvo, mais IPE coberto.
+    O limite por rua do modelo vale para todas as ruas, mais estrito que o das heurísticas (só as ruas da
+    câmera acrescentada): uma solução do modelo vale para as heurísticas, mas a heurística pode ficar fora
+    do modelo, e aí é mantida se for melhor e não é comparada ao limitante (diagnóstico 'sem_comparacao').
+    
+    Retorna: (resultado no formato de otimizar_selecao, diagnóstico com status, gap e limitante)
+    """
+    inicio = time.perf_counter()
+    posicoes_heur = np.asarray(resultado[0], dtype=np.int64)
+    com_alvo = max_cruzamentos is None and orcamento is None
+    diagnostico = {'status': None, 'mensagem': "", 'gap': None, 'limitante': None, 'heuristica': None,
+                   'exato': None, 'tempo': 0.0, 'modo': 'cameras' if com_alvo else 'cobertura',
+                   'sem_comparacao': None}
+    if milp is None:
+        diagnostico['mensagem'] = "scipy indisponível"
+        return resultado, diagnostico
+    if df.empty:
+        diagnostico['mensagem'] = "sem cruzamentos"
+        return resultado, diagnostico
+    
+    ctx = _contexto_selecao(df, min_dist, raio_cobertura, limite_cobertura_logradouro, grafos)
+    n = len(df)
+    n_grafo = len(ctx['ids'])
+    linha = np.full(n_grafo, -1, dtype=np.int64)
+    linha[ctx['pos_df']] = np.arange(n)
+    ipe = ctx['ipe'][ctx['pos_df']]
+    # Objetivo em unidades do maior IPE (custos ~1e-5 em fração da cobertura travam o presolve)
+    escala = ipe.max() if ipe.max() > 0 else 1.0
+    peso = ipe / escala
+    
+    # C[i, j] = 1 se uma câmera em j cobre i (linhas e colunas na ordem de df)
+    origem = np.repeat(np.arange(n_grafo), np.diff(ctx['cob_ptr']))
+    manter = (linha[origem] >= 0) & (linha[ctx['cob_ind']] >= 0)
+    cobre = sparse.csr_array((np.ones(manter.sum()), (linha[origem[manter]], linha[ctx['cob_ind'][manter]])),
+                             shape=(n, n))
+    
+    # y só para cruzamentos com mais de uma câmera possível; coluna de cada cruzamento no vetor [x, y]
+    multiplos = np.flatnonzero(np.diff(cobre.indptr) > 1)
+    k = len(multiplos)
+    n_var = n + k
+    coluna = np.arange(n)
+    coluna[multiplos] = n + np.arange(k)
+    valor = np.bincount(coluna, weights=peso, minlength=n_var)   # IPE (escalado) coberto por variável
+    
+    cobre_y = cobre[multiplos]
+    restricoes = [LinearConstraint(sparse.hstack([-cobre_y, sparse.identity(k, format='csr')], format='csr'),
+                                   -np.inf, 0)] if k else []
+    grau_conflito = np.zeros(n, dtype=np.int64)
+    if ctx['conflito'] is not None:
+        conflito = ctx['conflito']
+        a = np.repeat(np.arange(n_grafo), np.diff(conflito['indptr']))
+        b = conflito['indices']
+        aresta = (a < b) & (linha[a] >= 0) & (linha[b] >= 0)
+        a, b = linha[a[aresta]], linha[b[aresta]]
+        grau_conflito += np.bincount(np.r_[a, b], minlength=n)
+        if len(a):
+            m = len(a)
+            pares = sparse.csr_array((np.ones(2 * m), (np.r_[np.arange(m), np.arange(m)], np.r_[a, b])),
+                                     shape=(m, n_var))
+            restricoes.append(LinearConstraint(pares, -np.inf, 1))
+    if limite_cobertura_logradouro is not None:
+        if k:
+            lin_y = np.repeat(np.arange(k), np.diff(cobre_y.indptr))
+            m = len(lin_y)
+            fixa_y = sparse.csr_array((np.r_[-np.ones(m), np.ones(m)],
+                                       (np.r_[np.arange(m), np.arange(m)], np.r_[cobre_y.indices, n + lin_y])),
+                                      shape=(m, n_var))
+            restricoes.append(LinearConstraint(fixa_y, 0, np.inf))
+        logs = ctx['logs_pos'][ctx['pos_df']].T.ravel()
+        ruas = sparse.csr_array((np.r_[peso, peso], (logs, np.r_[coluna, coluna])),
+                                shape=(len(ctx['ipe_por_logradouro']), n_var))
+        teto = limite_cobertura_logradouro * ctx['ipe_por_logradouro'] / escala
+        restricoes.append(LinearConstraint(ruas, -np.inf, teto + 1e-9))
+        ruas_linha = sparse.csr_array((np.r_[peso, peso], (logs, np.r_[np.arange(n), np.arange(n)])),
+                                      shape=(len(ctx['ipe_por_logradouro']), n))
+    
+    def avaliar(selecao):
+        """(fração de IPE coberta, cobertos, respeita o limite por rua) de um vetor 0/1 de câmeras"""
+        cobertos = cobre @ selecao > 0.5
+        viavel = True
+        if limite_cobertura_logradouro is not None:
+            viavel = bool((ruas_linha @ cobertos.astype(float) <= teto + 1e-9).all())
+        return float(ipe[cobertos].sum() / ctx['ipe_total']), cobertos, viavel
+    
+    x_heur = np.zeros(n)
+    x_heur[posicoes_heur] = 1
+    cobertura_heur, _, heur_viavel = avaliar(x_heur)
+    alvo_heur = bool(resultado[2])
+    if com_alvo and not alvo_heur:
+        diagnostico['sem_comparacao'] = "heurística abaixo do alvo"
+    elif not heur_viavel:
+        diagnostico['sem_comparacao'] = "limite por rua mais estrito no modelo"
+    fracao = ctx['ipe_total'] / escala   # valor escalado correspondente a 100% de cobertura
+    cameras = np.r_[np.ones(n), np.zeros(k)]
+    if com_alvo:
+        objetivo = cameras
+        restricoes.append(LinearConstraint(sparse.csr_array(valor[None, :]), cobertura_frac * fracao, np.inf))
+        diagnostico['heuristica'] = len(posicoes_heur)
+        if heur_viavel and alvo_heur:
+            restricoes.append(LinearConstraint(sparse.csr_array(cameras[None, :]), -np.inf, len(posicoes_heur)))
+    else:
+        objetivo = -valor
+        if max_cruzamentos is not None:
+            restricoes.append(LinearConstraint(sparse.csr_array(cameras[None, :]), -np.inf, max_cruzamentos))
+        if orcamento is not None:
+            restricoes.append(LinearConstraint(sparse.csr_array(np.r_[custos, np.zeros(k)][None, :]), -np.inf, orcamento))
+        diagnostico['heuristica'] = cobertura_heur
+        if heur_viavel:
+            restricoes.append(LinearConstraint(sparse.csr_array(valor[None, :]), cobertura_heur * fracao * (1 - 1e-9), np.inf))
+    
+    # Sem presolve: no conjunto completo de Recife ele não respeita o prazo (dezenas de milhares de binárias)
+    # Cruzamentos isolados (só a própria câmera os cobre, sem conflito) só disputam vagas/orçamento:
+    # sem limite por rua, entre isolados de mesmo custo só os `vagas` de maior IPE podem estar num ótimo
+    superior = np.ones(n_var)
+    if limite_cobertura_logradouro is None:
+        isolado = (np.diff(cobre.indptr) == 1) & (grau_conflito == 0)
+        custo_x = custos if orcamento is not None else np.ones(n)
+        for custo in np.unique(custo_x[isolado]):
+            vagas = np.inf
+            if max_cruzamentos is not None:
+                vagas = max_cruzamentos
+            if orcamento is not None:
+                vagas = min(vagas, orcamento // custo)
+            if com_alvo and heur_viavel and alvo_heur:
+                vagas = len(posicoes_heur)
+            grupo = np.flatnonzero(isolado & (custo_x == custo))
+            if vagas < len(grupo):
+                superior[grupo[np.argsort(-peso[grupo], kind='stable')[int(vagas):]]] = 0
+    
+    res = milp(objetivo, integrality=cameras, bounds=Bounds(0, superior), constraints=restricoes,
+               options={'time_limit': float(tempo_limite), 'mip_rel_gap': float(gap_relativo), 'presolve': False})
+    diagnostico.update(status=res.status, mensagem=res.message, gap=res.mip_gap,
+                       tempo=time.perf_counter() - inicio)
+    if res.mip_dual_bound is not None and np.isfinite(res.mip_dual_bound):
+        diagnostico['limitante'] = res.mip_dual_bound if com_alvo else -res.mip_dual_bound / fracao
+    if res.x is None:
+        return resultado, diagnostico
+    
+    x = res.x[:n] > 0.5
+    cobertura, cobertos, _ = avaliar(x.astype(float))
+    diagnostico['exato'] = int(x.sum()) if com_alvo else cobertura
+    if com_alvo and alvo_heur:
+        melhor = x.sum() < len(posicoes_heur)
+    elif com_alvo:
+        # A solução do modelo sempre atinge o alvo (restrição); a heurística não atingiu
+        melhor = True
+    else:
+        melhor = cobertura > cobertura_heur
+    if not melhor:
+        return resultado, diagnostico
+    
+    motivo_limite = None
+    if max_cruzamentos is not None and x.sum() >= max_cruzamentos:
+        motivo_limite = 'quantidade'
+    elif orcamento is not None and (~x).any() and orcamento - custos[x].sum() < custos[~x].min():
+        # O orçamento só limita se o saldo restante não paga nenhum cruzamento de fora da seleção
+        motivo_limite = 'orcamento'
+    return _montar_resultado_selecao(
+        np.flatnonzero(x), cobertura * ctx['ipe_total'], ctx['ipe_total'], cobertura_frac, motivo_limite,
+        ctx['ids'][ctx['pos_df'][cobertos]]
+    ), diagnostico
+
+
+# ============================================================
+# CENÁRIOS - VARREDURA DE PARÂMETROS EM PARALELO
+# ============================================================
+# Parâmetros varridos: chave do cenário -> rótulo na tabela
+PARAMETROS_CENARIO = {'dist_min': "Distancia (m)", 'raio_cobertura': "Raio (m)", 'peso_seg': "Seguranca (%)"}
+
+
+def interpretar_faixa(texto: str) -> list:
+    """Valores de uma faixa digitada: lista separada por vírgulas e/ou intervalos 'início-fim:passo'"""
+    valores = []
+    for parte in str(texto).replace(';', ',').split(','):
+        parte = parte.strip()
+        if not parte:
+            continue
+        intervalo = re.fullmatch(r"(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)(?:\s*:\s*(\d+(?:\.\d+)?))?", parte)
+        if intervalo:
+            inicio, fim = float(intervalo.group(1)), float(intervalo.group(2))
+            passo = float(intervalo.group(3) or 1) or 1
+            valores.extend(np.arange(inicio, fim + passo / 2, passo).tolist())
+        else:
+            valores.append(float(parte))
+    return list(dict.fromkeys(int(v) if float(v).is_integer() else v for v in valores))
+
+
+def grade_cenarios(faixas: dict) -> list:
+    """Produto cartesiano das faixas ({parâmetro: valores}) como lista de cenários (dicts)"""
+    nomes = list(faixas)
+    return [dict(zip(nomes, combinacao)) for combinacao in itertools.product(*(faixas[n] for n in nomes))]
+
+
+def pesos_com_seguranca(pesos: dict, fracao_seg: float) -> dict:
+    """Pesos normalizados com Segurança em `fracao_seg`; os demais eixos mantêm a proporção entre si"""
+    restante = 1 - pesos['seg']
+    outros = {eixo: peso for eixo, peso in pesos.items() if eixo != 'seg'}
+    if restante <= 0:
+        # Só Segurança tinha peso: os demais eixos do IPE dividem o restante por igual
+        outros = {eixo: 1 / 3 if eixo in EIXOS else 0.0 for eixo in outros}
+        restante = 1.0
+    return {'seg': fracao_seg, **{eixo: peso * (1 - fracao_seg) / restante for eixo, peso in outros.items()}}
+
+
+def avaliar_cenario(contexto: dict, cenario: dict) -> dict:
+    """
+    IPE e seleção de um cenário sobre o dataset compartilhado em `contexto` (ver executar_cenarios).
+    
+    `cenario` traz dist_min, raio_cobertura e peso_seg (%); o restante vem dos parâmetros atuais em
+    contexto['parametros'], inclusive a busca local (tempo_busca_local) e o modo exato (tempo_exato,
+    gap_exato), aplicados como na seleção principal quando não são None. Retorna a linha da tabela.
+    """
+    parametros = {**contexto['parametros'], **cenario}
+    pesos = pesos_com_seguranca(contexto['pesos'], parametros['peso_seg'] / 100)
+    pesos_extra = {eixo: pesos[eixo] for eixo in pesos if eixo not in EIXOS}
+    calc = calcular_ipe_base(contexto['base'], pesos['seg'], pesos['lct'], pesos['com'], pesos['mob'],
+                             contexto['eixos_extra'], pesos_extra)
+    dist, raio = parametros['dist_min'], parametros['raio_cobertura']
+    grafos = {'cobertura': contexto['grafos'][('cobertura', raio)],
+              'conflito': contexto['grafos'][('conflito', dist)] if dist > 0 else None}
+    
+    custos = custo_por_ponto(calc['camera_tipo'], parametros['precos'], parametros['cameras_por_tipo'])
+    orcamento = parametros['orcamento']
+    custos_orcamento = custos if orcamento is not None else None
+    argumentos = (calc, parametros['cobertura_pct'] / 100, dist, parametros['max_cruzamentos'], raio,
+                  parametros['limite_cob_log'], grafos)
+    resultado = otimizar_selecao(*argumentos, None, parametros['otimizador'], custos_orcamento, orcamento)
+    if parametros['tempo_busca_local'] is not None:
+        resultado = melhorar_selecao(calc, resultado, *argumentos[1:], parametros['tempo_busca_local'],
+                                     custos_orcamento, orcamento)
+    if parametros['tempo_exato'] is not None:
+        resultado, _ = resolver_exato(calc, resultado, *argumentos[1:], custos_orcamento, orcamento,
+                                      parametros['tempo_exato'], parametros['gap_exato'] / 100)
+    posicoes, cobertura_real, alvo_atingido, _, ids_cobertos = resultado
+    if parametros['modelo_custo'] == 'tipo':
+        custo = float(custos[posicoes].sum())
+    else:
+        custo_unitario = PRECO_CAMERA_PADRAO
+        if len(posicoes):
+            custo_unitario = custo_por_ponto(calc['camera_tipo'].iloc[posicoes], parametros['precos'],
+                                             dict.fromkeys(TIPOS_CAMERA, 1)).mean()
+        qtd_3cam, qtd_2cam, qtd_1cam = pontos_regra_50_30_20(len(ids_cobertos))
+        custo = (qtd_3cam * 3 + qtd_2cam * 2 + qtd_1cam) * custo_unitario
+    
+    selecionados = tabela_selecionados(calc, posicoes)
+    linha = {rotulo: cenario[chave] for chave, rotulo in PARAMETROS_CENARIO.items()}
+    linha.update({
+        "Pontos": len(posicoes), "Cobertura (%)": round(cobertura_real * 100, 2), "Alvo": bool(alvo_atingido),
+        "Custo (R$)": round(custo, 2),
+    })
+    for camada, rotulo in (('alagamentos', "Alagamentos"), ('sinistros', "Sinistros")):
+        riscos = verificar_riscos(selecionados, contexto['indices'][camada], parametros['raio_risco'])
+        linha[rotulo] = riscos['atingidos']
+    return linha
+
+
+def _linha_sem_resultado(cenario: dict) -> dict:
+    """Linha da tabela só com os parâmetros, para cenário que estourou o prazo ou falhou"""
+    return {rotulo: cenario[chave] for chave, rotulo in PARAMETROS_CENARIO.items()}
+
+
+# Processos da varredura: um pool por servidor, compartilhado pelas sessões; COP_CENARIOS_PROCESSOS limita o total
+PROCESSOS_CENARIOS = max(1, int(os.environ.get("COP_CENARIOS_PROCESSOS", os.cpu_count() or 1)))
+# Prazo de cada cenário (s), somado aos tempos de busca local e modo exato quando ligados
+PRAZO_CENARIO_S = 120
+# Folga do processo principal sobre o prazo do lote antes de encerrar o pool (início do processo, leitura do contexto)
+FOLGA_LOTE_S = 30
+ALINHAMENTO_CONTEXTO = 64
+
+_pool = None
+_pool_trava = threading.Lock()
+# Contextos já mapeados neste processo do pool (caminho -> contexto); guarda os mais recentes
+_contextos_mapeados = OrderedDict()
+
+
+def _pool_cenarios() -> ProcessPoolExecutor:
+    """
+    Pool de processos da varredura, criado no primeiro uso.
+    
+    Processos por forkserver (spawn sem ele): nascem de um interpretador limpo, sem as threads nem as
+    travas do servidor do Streamlit, e importam este módulo (pré-carregado no forkserver).
+    """
+    global _pool
+    with _pool_trava:
+        if _pool is None:
+            if 'forkserver' in multiprocessing.get_all_start_methods():
+                mp = multiprocessing.get_context('forkserver')
+                mp.set_forkserver_preload([__name__])
+            else:
+                mp = multiprocessing.get_context('spawn')
+            _pool = ProcessPoolExecutor(PROCESSOS_CENARIOS, mp_context=mp)
+        return _pool
+
+
+def _descartar_pool(pool: ProcessPoolExecutor):
+    """Encerra os processos de um pool travado; o próximo pedido cria outro"""
+    global _pool
+    with _pool_trava:
+        if _pool is pool:
+            _pool = None
+    processos = list((getattr(pool, '_processes', None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for processo in processos:
+        processo.terminate()
+
+
+def publicar_contexto(contexto: dict) -> str:
+    """
+    Grava o contexto da varredura num arquivo mapeável (em /dev/shm, quando existe) e devolve o caminho.
+    
+    Pickle protocolo 5 com buffers fora de banda: os arrays NumPy (inclusive os blocos dos DataFrames)
+    ficam alinhados no arquivo e cada processo os lê por mmap (_contexto_publicado), sem cópia.
+    Layout: quantidade de partes e tamanhos (int64), depois o pickle e os buffers, cada um alinhado.
+    """
+    buffers = []
+    dados = pickle.dumps(contexto, protocol=5, buffer_callback=buffers.append)
+    partes = [memoryview(dados)] + [buffer.raw() for buffer in buffers]
+    pasta = "/dev/shm" if os.path.isdir("/dev/shm") else None
+    descritor, caminho = tempfile.mkstemp(prefix="cop_cenarios_", suffix=".bin", dir=pasta)
+    with os.fdopen(descritor, 'wb') as arquivo:
+        arquivo.write(np.array([len(partes)] + [parte.nbytes for parte in partes], dtype=np.int64).tobytes())
+        for parte in partes:
+            arquivo.write(b"\0" * (-arquivo.tell() % ALINHAMENTO_CONTEXTO))
+            arquivo.write(parte)
+    return caminho
+
+
+def _contexto_publicado(caminho: str) -> dict:
+    """Contexto gravado por publicar_contexto, mapeado uma vez por processo (arrays somente leitura)"""
+    contexto = _contextos_mapeados.get(caminho)
+    if contexto is not None:
+        _contextos_mapeados.move_to_end(caminho)
+        return contexto
+    with open(caminho, 'rb') as arquivo:
+        visao = memoryview(mmap.mmap(arquivo.fileno(), 0, access=mmap.ACCESS_READ))
+    quantidade = int(np.frombuffer(visao[:8], dtype=np.int64)[0])
+    tamanhos = np.frombuffer(visao[8:8 * (quantidade + 1)], dtype=np.int64)
+    partes = []
+    inicio = 8 * (quantidade + 1)
+    for tamanho in tamanhos:
+        inicio += -inicio % ALINHAMENTO_CONTEXTO
+        partes.append(visao[inicio:inicio + int(tamanho)])
+        inicio += int(tamanho)
+    contexto = pickle.loads(partes[0], buffers=partes[1:])
+    _contextos_mapeados[caminho] = contexto
+    while len(_contextos_mapeados) > 2:
+        _contextos_mapeados.popitem(last=False)
+    return contexto
+
+
+def _estourou_prazo(sinal, quadro):
+    """Tratador do SIGALRM em _avaliar_lote"""
+    raise TimeoutError("prazo do cenário esgotado")
+
+
+def _avaliar_lote(caminho: str, cenarios: list, prazo: float) -> list:
+    """
+    Processo do pool: avalia um lote sobre o contexto publicado em `caminho`.
+    
+    Cada cenário tem `prazo` segundos (SIGALRM, onde existe); o que estoura vira None e o lote segue.
+    """
+    contexto = _contexto_publicado(caminho)
+    com_alarme = hasattr(signal, 'setitimer')
+    if com_alarme:
+        signal.signal(signal.SIGALRM, _estourou_prazo)
+    linhas = []
+    try:
+        for cenario in cenarios:
+            if com_alarme:
+                signal.setitimer(signal.ITIMER_REAL, prazo)
+            try:
+                linhas.append(avaliar_cenario(contexto, cenario))
+            except TimeoutError:
+                linhas.append(None)
+            finally:
+                if com_alarme:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+    finally:
+        if com_alarme:
+            signal.signal(signal.SIGALRM, signal.SIG_DFL)
+    return linhas
+
+
+def prazo_cenario(parametros: dict) -> float:
+    """Prazo (s) de um cenário: PRAZO_CENARIO_S mais os tempos de busca local e modo exato pedidos"""
+    return PRAZO_CENARIO_S + (parametros['tempo_busca_local'] or 0) + (parametros['tempo_exato'] or 0)
+
+
+def _rodar_lotes(lotes: list, indices: list, caminho: str, prazo: float, resultados: dict) -> list:
+    """
+    Roda os lotes `indices` no pool e guarda as linhas em `resultados`; devolve os lotes que o pool perdeu.
+    
+    Perdido é o lote que não chegou a rodar até o fim porque o pool quebrou (processo morto, pool
+    encerrado por outra sessão). Lote que passa do prazo mais a folga encerra o pool e fica sem
+    resultado; lote que falha por erro no cálculo também.
+    """
+    pool = _pool_cenarios()
+    try:
+        futuros = {pool.submit(_avaliar_lote, caminho, lotes[i], prazo): i for i in indices}
+    except (BrokenProcessPool, RuntimeError):
+        # Quebrado ou já encerrado por outra sessão: o próximo pedido cria outro pool
+        _descartar_pool(pool)
+        return list(indices)
+    
+    # Prazo de cada lote contado de quando sai da fila do pool (outras sessões podem estar na frente)
+    inicio = {}
+    pendentes = set(futuros)
+    travados = set()
+    while pendentes:
+        _, pendentes = wait(pendentes, timeout=1.0)
+        agora = time.monotonic()
+        for futuro in pendentes:
+            if futuro.running():
+                inicio.setdefault(futuro, agora)
+        travados = {futuro for futuro in pendentes if futuro in inicio
+                    and agora - inicio[futuro] > len(lotes[futuros[futuro]]) * prazo + FOLGA_LOTE_S}
+        if travados:
+            _descartar_pool(pool)
+            break
+    
+    perdidos = []
+    for futuro, i in futuros.items():
+        if futuro in travados:
+            resultados[i] = [None] * len(lotes[i])
+        elif futuro in pendentes:
+            perdidos.append(i)
+        else:
+            try:
+                resultados[i] = futuro.result()
+            except (BrokenProcessPool, CancelledError):
+                _descartar_pool(pool)
+                perdidos.append(i)
+            except Exception:
+                resultados[i] = [None] * len(lotes[i])
+    return perdidos
+
+
+def executar_cenarios(contexto: dict, cenarios: list, processos: int = None) -> list:
+    """
+    Avalia os cenários no pool compartilhado e devolve as linhas na ordem de `cenarios`.
+    
+    A sessão usa até `processos` processos do pool (no máximo PROCESSOS_CENARIOS, somando todas as sessões);
+    o contexto vai uma vez por varredura, por arquivo mapeado (publicar_contexto). Nada roda na thread do
+    servidor: todo cenário tem prazo. Cenário que estoura o prazo ou falha vira linha só com os parâmetros
+    (_linha_sem_resultado). Lotes perdidos porque o pool quebrou são refeitos uma vez num pool novo.
+    """
+    processos = max(1, min(processos or PROCESSOS_CENARIOS, PROCESSOS_CENARIOS, len(cenarios)))
+    prazo = prazo_cenario(contexto['parametros'])
+    lotes = [cenarios[i::processos] for i in range(processos)]
+    caminho = publicar_contexto(contexto)
+    resultados = {}
+    try:
+        perdidos = _rodar_lotes(lotes, list(range(processos)), caminho, prazo, resultados)
+        if perdidos:
+            perdidos = _rodar_lotes(lotes, perdidos, caminho, prazo, resultados)
+    finally:
+        os.remove(caminho)
+    for i in perdidos:
+        resultados[i] = [None] * len(lotes[i])
+    
+    # Lote i tem os cenários i, i + processos, ...: intercala de volta na ordem original
+    ordenados = [None] * len(cenarios)
+    for i, lote in enumerate(lotes):
+        ordenados[i::processos] = [linha or _linha_sem_resultado(cenario)
+                                   for linha, cenario in zip(resultados[i], lote)]
+    return ordenados
@@ -0,0 +1,277 @@
+"""
+Seleção de câmeras (nucleo.py) sobre dados sintéticos fixos.
+
+O guloso por IPE e a trilha devem repetir o guloso original (iterrows, copiado abaixo em forma compacta);
+CELF, busca local e modo exato devem respeitar distância mínima, limite por rua, quantidade e orçamento.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import nucleo
+from nucleo import distancia_metros
+
+ESPACO_M = 60.0
+MIN_DIST = 100.0
+RAIO = 130.0
+
+
+# ============================================================================
+# DADOS
+# ============================================================================
+
+def grade_cruzamentos(semente: int, linhas: int = 8, colunas: int = 8) -> pd.DataFrame:
+    """Cruzamentos numa grade (ruas 1..linhas x 101..colunas), com falhas e deslocamentos, ordenados por IPE"""
+    rng = np.random.default_rng(semente)
+    i, j = np.meshgrid(np.arange(linhas), np.arange(colunas), indexing='ij')
+    i, j = i.ravel(), j.ravel()
+    manter = rng.random(len(i)) > 0.15
+    i, j = i[manter], j[manter]
+    n = len(i)
+    df = pd.DataFrame({
+        'id': rng.permutation(n) + 1,
+        'cod_log1': i + 1,
+        'cod_log2': j + 101,
+        'lat': -8.05 + (i * ESPACO_M + rng.uniform(-5, 5, n)) / nucleo.METROS_POR_GRAU,
+        'lon': -34.9 + (j * ESPACO_M + rng.uniform(-5, 5, n)) / nucleo.METROS_POR_GRAU,
+        'ipe_cruz': np.round(rng.gamma(2.0, 1.0, n), 3),
+    })
+    return df.sort_values('ipe_cruz', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def custos_sinteticos(df: pd.DataFrame, semente: int) -> np.ndarray:
+    return np.random.default_rng(semente).choice([12_000.0, 30_000.0, 55_000.0], len(df))
+
+
+def guloso_referencia(df: pd.DataFrame, cobertura_frac: float, min_dist: float, max_cruzamentos: int = None,
+                      raio_cobertura: float = 50, limite_cobertura_logradouro: float = None) -> tuple:
+    """Guloso por IPE original de filtrar_por_cobertura_e_distancia: (ids, cobertura, alvo, motivo, cobertos)"""
+    ipe_total = df['ipe_cruz'].sum()
+    linhas = list(df.itertuples(index=False))
+    por_id = {c.id: c for c in linhas}
+    por_logradouro = {}
+    ipe_por_logradouro = {}
+    for c in linhas:
+        for log in (c.cod_log1, c.cod_log2):
+            por_logradouro.setdefault(log, []).append(c)
+            ipe_por_logradouro[log] = ipe_por_logradouro.get(log, 0) + c.ipe_cruz
+
+    cameras_por_logradouro = {}
+    cobertura_por_logradouro = {}
+    selecionados, cobertos, ipe_coberto, motivo_limite = [], set(), 0.0, None
+
+    for c in linhas:
+        if max_cruzamentos is not None and len(selecionados) >= max_cruzamentos:
+            motivo_limite = 'quantidade'
+            break
+        if max_cruzamentos is None and ipe_coberto / ipe_total >= cobertura_frac:
+            break
+        ruas = (c.cod_log1, c.cod_log2)
+        if min_dist > 0 and any(distancia_metros(c.lat, c.lon, lat, lon) < min_dist
+                                for log in ruas for lat, lon in cameras_por_logradouro.get(log, [])):
+            continue
+
+        novos = {o.id for log in ruas for o in por_logradouro[log]
+                 if o.id not in cobertos and distancia_metros(c.lat, c.lon, o.lat, o.lon) <= raio_cobertura}
+        novos.add(c.id)
+        # O cruzamento da câmera conta nas suas ruas mesmo se já estava coberto (como no original)
+        adicional = {log: c.ipe_cruz for log in ruas}
+        for cob in novos - {c.id}:
+            o = por_id[cob]
+            for log in (o.cod_log1, o.cod_log2):
+                adicional[log] = adicional.get(log, 0) + o.ipe_cruz
+        if limite_cobertura_logradouro is not None and any(
+                (cobertura_por_logradouro.get(log, 0) + adicional[log]) / ipe_por_logradouro[log]
+                > limite_cobertura_logradouro for log in ruas):
+            continue
+
+        selecionados.append(c.id)
+        for log in ruas:
+            cameras_por_logradouro.setdefault(log, []).append((c.lat, c.lon))
+        for log, valor in adicional.items():
+            cobertura_por_logradouro[log] = cobertura_por_logradouro.get(log, 0) + valor
+        ipe_coberto += sum(por_id[cob].ipe_cruz for cob in novos if cob not in cobertos)
+        cobertos |= novos
+
+    if not selecionados:
+        return [], 0.0, False, None, []
+    cobertura = ipe_coberto / ipe_total
+    alvo = cobertura >= cobertura_frac * 0.99
+    if not alvo and motivo_limite is None:
+        motivo_limite = 'restricoes'
+    return selecionados, cobertura, alvo, motivo_limite, sorted(cobertos)
+
+
+# ============================================================================
+# VERIFICAÇÕES
+# ============================================================================
+
+def cobertos_por(df: pd.DataFrame, linha: int, raio_cobertura: float) -> set:
+    c = df.iloc[linha]
+    ruas = {c['cod_log1'], c['cod_log2']}
+    mesma_rua = df['cod_log1'].isin(ruas) | df['cod_log2'].isin(ruas)
+    return {k for k in np.flatnonzero(mesma_rua)
+            if distancia_metros(c['lat'], c['lon'], df['lat'].iat[k], df['lon'].iat[k]) <= raio_cobertura}
+
+
+def verificar_restricoes(df: pd.DataFrame, resultado: tuple, min_dist: float, raio_cobertura: float,
+                         max_cruzamentos: int = None, limite_cobertura_logradouro: float = None,
+                         custos: np.ndarray = None, orcamento: float = None):
+    posicoes, cobertura, _, _, ids_cobertos = resultado
+    posicoes = list(posicoes)
+    assert len(set(posicoes)) == len(posicoes)
+
+    sel = df.iloc[posicoes]
+    for a in range(len(sel)):
+        for b in range(a + 1, len(sel)):
+            p, q = sel.iloc[a], sel.iloc[b]
+            if {p['cod_log1'], p['cod_log2']} & {q['cod_log1'], q['cod_log2']}:
+                assert distancia_metros(p['lat'], p['lon'], q['lat'], q['lon']) >= min_dist
+
+    if max_cruzamentos is not None:
+        assert len(posicoes) <= max_cruzamentos
+    if orcamento is not None:
+        assert custos[posicoes].sum() <= orcamento + 1e-6
+
+    # Cobertura declarada confere com a geometria
+    cobertos = set().union(*(cobertos_por(df, p, raio_cobertura) for p in posicoes)) if posicoes else set()
+    assert sorted(df['id'].iloc[sorted(cobertos)]) == list(ids_cobertos)
+    assert cobertura == pytest.approx(df['ipe_cruz'].iloc[sorted(cobertos)].sum() / df['ipe_cruz'].sum())
+
+    # Limite por rua como nas heurísticas: ao entrar (na ordem da seleção), as ruas da câmera ficam no limite
+    if limite_cobertura_logradouro is not None:
+        ipe_por_log = pd.concat([df.groupby('cod_log1')['ipe_cruz'].sum(),
+                                 df.groupby('cod_log2')['ipe_cruz'].sum()]).groupby(level=0).sum()
+        atuais = set()
+        for p in posicoes:
+            atuais |= cobertos_por(df, p, raio_cobertura)
+            cob = df.iloc[sorted(atuais)]
+            for log in (df['cod_log1'].iat[p], df['cod_log2'].iat[p]):
+                na_rua = cob.loc[(cob['cod_log1'] == log) | (cob['cod_log2'] == log), 'ipe_cruz'].sum()
+                assert na_rua <= limite_cobertura_logradouro * ipe_por_log[log] + 1e-9
+
+
+# ============================================================================
+# GULOSO POR IPE E TRILHA
+# ============================================================================
+
+@pytest.mark.parametrize('semente', [0, 1, 2])
+@pytest.mark.parametrize('cobertura_frac,max_cruzamentos,limite', [
+    (0.5, None, None), (0.8, None, None), (0.95, 12, None), (0.7, None, 0.5), (0.9, 15, 0.4),
+])
+def test_guloso_ipe_igual_ao_original(semente, cobertura_frac, max_cruzamentos, limite):
+    df = grade_cruzamentos(semente)
+    ids, cobertura, alvo, motivo, cobertos = guloso_referencia(df, cobertura_frac, MIN_DIST, max_cruzamentos,
+                                                               RAIO, limite)
+    posicoes, cobertura_n, alvo_n, motivo_n, cobertos_n = nucleo.otimizar_selecao(
+        df, cobertura_frac, MIN_DIST, max_cruzamentos, RAIO, limite, otimizador='ipe'
+    )
+    assert df['id'].iloc[posicoes].tolist() == ids
+    assert cobertura_n == pytest.approx(cobertura)
+    assert (bool(alvo_n), motivo_n) == (alvo, motivo)
+    assert cobertos_n.tolist() == cobertos
+
+
+@pytest.mark.parametrize('semente', [0, 3])
+def test_trilha_igual_ao_guloso(semente):
+    df = grade_cruzamentos(semente)
+    trilha = nucleo.construir_trilha_selecao(df, MIN_DIST, RAIO)
+    for cobertura_frac, max_cruzamentos in [(0.3, None), (0.6, None), (0.9, None), (0.98, None), (0.9, 5), (0.5, 40)]:
+        pela_trilha = nucleo.otimizar_selecao(df, cobertura_frac, MIN_DIST, max_cruzamentos, RAIO, trilha=trilha)
+        ids, cobertura, alvo, motivo, cobertos = guloso_referencia(df, cobertura_frac, MIN_DIST, max_cruzamentos, RAIO)
+        assert df['id'].iloc[pela_trilha[0]].tolist() == ids
+        assert pela_trilha[1] == pytest.approx(cobertura)
+        assert (bool(pela_trilha[2]), pela_trilha[3]) == (alvo, motivo)
+        assert pela_trilha[4].tolist() == cobertos
+
+
+# ============================================================================
+# RESTRIÇÕES: CELF, BUSCA LOCAL E MODO EXATO
+# ============================================================================
+
+CENARIOS_RESTRICOES = [
+    # (cobertura_frac, max_cruzamentos, limite por rua, orçamento)
+    (0.8, None, None, None),
+    (0.9, 10, None, None),
+    (0.7, None, 0.5, None),
+    (0.9, 12, 0.4, None),
+    (0.9, None, None, 250_000.0),
+    (0.9, None, 0.5, 250_000.0),
+]
+
+
+@pytest.mark.parametrize('otimizador', list(nucleo.OTIMIZADORES))
+@pytest.mark.parametrize('cobertura_frac,max_cruzamentos,limite,orcamento', CENARIOS_RESTRICOES)
+def test_heuristicas_respeitam_restricoes(otimizador, cobertura_frac, max_cruzamentos, limite, orcamento):
+    df = grade_cruzamentos(5)
+    custos = custos_sinteticos(df, 5) if orcamento is not None else None
+    argumentos = (df, cobertura_frac, MIN_DIST, max_cruzamentos, RAIO, limite)
+    resultado = nucleo.otimizar_selecao(*argumentos, None, None, otimizador, custos, orcamento)
+    verificar_restricoes(df, resultado, MIN_DIST, RAIO, max_cruzamentos, limite, custos, orcamento)
+
+    melhorado = nucleo.melhorar_selecao(df, resultado, *argumentos[1:], None, 1.0, custos, orcamento)
+    verificar_restricoes(df, melhorado, MIN_DIST, RAIO, max_cruzamentos, limite, custos, orcamento)
+    if max_cruzamentos is None and orcamento is None and resultado[2]:
+        assert melhorado[2] and len(melhorado[0]) <= len(resultado[0])
+    else:
+        assert melhorado[1] >= resultado[1] - 1e-12
+
+
+def test_orcamento_mesmo_resultado_nos_dois_motores():
+    df = grade_cruzamentos(2)
+    custos = custos_sinteticos(df, 2)
+    ipe = nucleo.otimizar_selecao(df, 0.9, MIN_DIST, None, RAIO, None, None, None, 'ipe', custos, 200_000.0)
+    celf = nucleo.otimizar_selecao(df, 0.9, MIN_DIST, None, RAIO, None, None, None, 'celf', custos, 200_000.0)
+    assert ipe[0].tolist() == celf[0].tolist()
+    assert ipe[3] == 'orcamento'
+
+
+def test_busca_local_troca_uma_por_duas():
+    # Um cruzamento bom entre dois quase tão bons, a 50 m de cada: a distância mínima prende o guloso no do meio
+    passo = 50 / nucleo.METROS_POR_GRAU
+    df = pd.DataFrame({'id': [1, 2, 3], 'cod_log1': [10, 10, 10], 'cod_log2': [20, 21, 22],
+                       'lat': [-8.05, -8.05 - passo, -8.05 + passo], 'lon': [-34.9] * 3, 'ipe_cruz': [1.0, 0.8, 0.8]})
+    resultado = nucleo.otimizar_selecao(df, 0.9, 60, 3, 5)
+    assert resultado[0].tolist() == [0]
+    melhorado = nucleo.melhorar_selecao(df, resultado, 0.9, 60, 3, 5)
+    assert sorted(melhorado[0].tolist()) == [1, 2]
+    verificar_restricoes(df, melhorado, 60, 5, 3)
+
+
+@pytest.mark.skipif(nucleo.milp is None, reason="requer scipy")
+@pytest.mark.parametrize('cobertura_frac,max_cruzamentos,limite,orcamento', CENARIOS_RESTRICOES)
+def test_exato_respeita_restricoes(cobertura_frac, max_cruzamentos, limite, orcamento):
+    df = grade_cruzamentos(7, 6, 6)
+    custos = custos_sinteticos(df, 7) if orcamento is not None else None
+    argumentos = (df, cobertura_frac, MIN_DIST, max_cruzamentos, RAIO, limite)
+    heuristica = nucleo.otimizar_selecao(*argumentos, None, None, 'celf', custos, orcamento)
+    resultado, diagnostico = nucleo.resolver_exato(df, heuristica, *argumentos[1:], None, custos, orcamento,
+                                                   tempo_limite=20)
+    verificar_restricoes(df, resultado, MIN_DIST, RAIO, max_cruzamentos, limite, custos, orcamento)
+
+    # Nunca pior que a heurística de partida
+    if max_cruzamentos is None and orcamento is None and heuristica[2]:
+        assert resultado[2] and len(resultado[0]) <= len(heuristica[0])
+    else:
+        assert resultado[1] >= heuristica[1] - 1e-12
+    if diagnostico['sem_comparacao'] is None and diagnostico['exato'] is not None:
+        assert diagnostico['heuristica'] >= diagnostico['limitante'] - 1e-9 if diagnostico['modo'] == 'cameras' \
+            else diagnostico['heuristica'] <= diagnostico['limitante'] + 1e-9
+
+
+@pytest.mark.skipif(nucleo.milp is None, reason="requer scipy")
+def test_exato_atinge_alvo_que_a_heuristica_perdeu():
+    # Três cruzamentos na mesma rua a 30 m: com distância mínima de 40 m o guloso fica no do meio (abaixo do alvo),
+    # as duas pontas atingem o alvo
+    passo = 30 / nucleo.METROS_POR_GRAU
+    df = pd.DataFrame({'id': [2, 1, 3], 'cod_log1': [10, 10, 10], 'cod_log2': [21, 20, 22],
+                       'lat': [-8.05 + passo, -8.05, -8.05 + 2 * passo], 'lon': [-34.9] * 3,
+                       'ipe_cruz': [5.0, 4.5, 4.5]})
+    heuristica = nucleo.otimizar_selecao(df, 0.6, 40, None, 5)
+    assert heuristica[0].tolist() == [0] and not heuristica[2]
+
+    resultado, diagnostico = nucleo.resolver_exato(df, heuristica, 0.6, 40, None, 5)
+    assert sorted(resultado[0].tolist()) == [1, 2]
+    assert resultado[2] and resultado[1] == pytest.approx(9 / 14)
+    assert diagnostico['sem_comparacao'] is not None
+    verificar_restricoes(df, resultado, 40, 5)